@@ -0,0 +1,159 @@
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from battle_engine import UNIT_TYPES
+from battle_records import decode_battle
+
+# Time buckets rollups are kept at
+ROLLUP_GRANULARITIES = ("hour", "day")
+
+# Indexes backing dashboard reads over a time range, optionally for one scenario
+ROLLUP_INDEXES = [
+    [("granularity", 1), ("bucket", 1)],
+    [("granularity", 1), ("scenario", 1), ("bucket", 1)]
+]
+
+# Counters every rollup document carries, summed over the battles in its bucket
+ROLLUP_COUNTERS = (
+    ["battles", "wins", "win_probability_sum"]
+    + [f"player_losses.{unit_type}" for unit_type in UNIT_TYPES]
+    + [f"enemy_losses.{unit_type}" for unit_type in UNIT_TYPES]
+)
+
+def bucket_start(timestamp: datetime, granularity: str):
+    """Start of the hour or day a timestamp falls in"""
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def rollup_id(scenario, granularity, bucket: datetime):
+    return f"{granularity}:{scenario}:{bucket.isoformat()}"
+
+def rollup_increments(records):
+    """Fold battle records into {(scenario, granularity, bucket): {counter: amount}}"""
+    increments = {}
+    for record in records:
+        record = decode_battle(record)
+        result = record["result"]
+        win_probability = result["win_probability"]
+        for granularity in ROLLUP_GRANULARITIES:
+            key = (record["scenario"], granularity, bucket_start(record["timestamp"], granularity))
+            counters = increments.get(key)
+            if counters is None:
+                counters = increments[key] = dict.fromkeys(ROLLUP_COUNTERS, 0)
+            counters["battles"] += 1
+            # Same cut-off as battle_outcome: below 0.5 is a loss
+            counters["wins"] += 1 if win_probability >= 0.5 else 0
+            counters["win_probability_sum"] += win_probability
+            for unit_type in UNIT_TYPES:
+                counters[f"player_losses.{unit_type}"] += result["expected_losses"][unit_type]
+                counters[f"enemy_losses.{unit_type}"] += result["enemy_losses"][unit_type]
+    return increments
+
+async def apply_rollups(collection, records):
+    """Add newly written battles to their rollup documents, one upsert per bucket"""
+    operations = [
+        UpdateOne(
+            {"_id": rollup_id(scenario, granularity, bucket)},
+            {
+                "$inc": counters,
+                "$setOnInsert": {"scenario": scenario, "granularity": granularity, "bucket": bucket}
+            },
+            upsert=True
+        )
+        for (scenario, granularity, bucket), counters in rollup_increments(records).items()
+    ]
+    if operations:
+        await collection.bulk_write(operations, ordered=False)
+
+def rollup_pipeline(granularity: str):
+    """Aggregation computing every rollup of one granularity from the battles collection"""
+    bucket_format = "%Y-%m-%dT%H:00:00" if granularity == "hour" else "%Y-%m-%dT00:00:00"
+    group = {
+        "_id": {
+            "scenario": "$scenario",
+            "bucket": {"$dateToString": {"format": bucket_format, "date": "$timestamp"}}
+        },
+        "battles": {"$sum": 1},
+        "wins": {"$sum": {"$cond": [{"$gte": ["$result.win_probability", 0.5]}, 1, 0]}},
+        "win_probability_sum": {"$sum": "$result.win_probability"}
+    }
+    # Losses are per-type fields in the original layout and one array in the compact one
+    for i, unit_type in enumerate(UNIT_TYPES):
+        group[f"player_losses_{unit_type}"] = {"$sum": {
+            "$ifNull": [f"$result.expected_losses.{unit_type}", {"$arrayElemAt": ["$result.losses", i]}]
+        }}
+        group[f"enemy_losses_{unit_type}"] = {"$sum": {
+            "$ifNull": [f"$result.enemy_losses.{unit_type}", {"$arrayElemAt": ["$result.losses", i + len(UNIT_TYPES)]}]
+        }}
+    return [{"$group": group}]
+
+def rollup_from_group(row, granularity: str):
+    """Rollup document for one output row of rollup_pipeline"""
+    scenario = row["_id"]["scenario"]
+    bucket = datetime.fromisoformat(row["_id"]["bucket"])
+    return {
+        "_id": rollup_id(scenario, granularity, bucket),
+        "scenario": scenario,
+        "granularity": granularity,
+        "bucket": bucket,
+        "battles": row["battles"],
+        "wins": row["wins"],
+        "win_probability_sum": row["win_probability_sum"],
+        "player_losses": {unit_type: row[f"player_losses_{unit_type}"] for unit_type in UNIT_TYPES},
+        "enemy_losses": {unit_type: row[f"enemy_losses_{unit_type}"] for unit_type in UNIT_TYPES}
+    }
+
+async def rebuild_rollups(battles_collection, rollups_collection):
+    """Recompute every rollup from scratch with aggregation pipelines; returns the rollup count"""
+    documents = []
+    for granularity in ROLLUP_GRANULARITIES:
+        async for row in battles_collection.aggregate(rollup_pipeline(granularity), allowDiskUse=True):
+            documents.append(rollup_from_group(row, granularity))
+    await rollups_collection.delete_many({})
+    if documents:
+        await rollups_collection.insert_many(documents, ordered=False)
+    return len(documents)
+
+def summarize_rollup(rollup):
+    """Dashboard row with rates and averages derived from a rollup's counters"""
+    battles = rollup["battles"]
+    return {
+        "scenario": rollup["scenario"],
+        "bucket": rollup["bucket"],
+        "battles": battles,
+        "win_rate": round(rollup["wins"] / battles, 4) if battles else 0.0,
+        "average_win_probability": round(rollup["win_probability_sum"] / battles, 4) if battles else 0.0,
+        "average_player_losses": {
+            unit_type: round(rollup["player_losses"][unit_type] / battles, 1) if battles else 0.0
+            for unit_type in UNIT_TYPES
+        },
+        "average_enemy_losses": {
+            unit_type: round(rollup["enemy_losses"][unit_type] / battles, 1) if battles else 0.0
+            for unit_type in UNIT_TYPES
+        }
+    }
+
+def combine_rollups(rollups):
+    """Sum rollups per scenario, for totals over a whole time range"""
+    totals = {}
+    for rollup in rollups:
+        total = totals.get(rollup["scenario"])
+        if total is None:
+            total = totals[rollup["scenario"]] = {
+                "scenario": rollup["scenario"],
+                "bucket": None,
+                "battles": 0,
+                "wins": 0,
+                "win_probability_sum": 0.0,
+                "player_losses": dict.fromkeys(UNIT_TYPES, 0),
+                "enemy_losses": dict.fromkeys(UNIT_TYPES, 0)
+            }
+        total["battles"] += rollup["battles"]
+        total["wins"] += rollup["wins"]
+        total["win_probability_sum"] += rollup["win_probability_sum"]
+        for unit_type in UNIT_TYPES:
+            total["player_losses"][unit_type] += rollup["player_losses"][unit_type]
+            total["enemy_losses"][unit_type] += rollup["enemy_losses"][unit_type]
+    return list(totals.values())
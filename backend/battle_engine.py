@@ -0,0 +1,625 @@
+import hashlib
+import itertools
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+# Unit types in the fixed column order used by every array in this module
+UNIT_TYPES = ["infantry", "ranged", "cavalry", "siege"]
+
+# Bonus columns: research attack/defense/hp followed by hero army attack/defense/hp
+BONUS_FIELDS = ["research_attack", "research_defense", "research_hp", "army_attack", "army_defense", "army_hp"]
+
+# Default relative spread of the randomized stats and losses used in Monte Carlo mode
+STAT_SPREAD = 0.1
+LOSS_SPREAD = 0.15
+
+# Weight of the player's loss fraction against win probability when scoring optimizer candidates
+OPTIMIZER_LOSS_WEIGHT = 0.1
+
+# How often a running optimizer search checks whether it has been asked to stop
+OPTIMIZER_STOP_CHECK_MS = 5
+
+# Bonus-point step for the sensitivity report's finite differences
+SENSITIVITY_BONUS_STEP = 0.01
+
+# Optional JSON/YAML balance file overriding the built-in unit stats
+UNIT_STATS_FILE = os.environ.get('UNIT_STATS_FILE', '')
+
+# How often (at most) get_unit_tables checks UNIT_STATS_FILE for changes, so that every
+# server and pool process picks up a new balance, not just the one that served a reload
+UNIT_STATS_CHECK_MS = int(os.environ.get('UNIT_STATS_CHECK_MS', '1000'))
+
+# Lanchester engine: share of a unit's attack landing each round, the remaining-troop
+# fraction at which a side breaks, and the default round cap
+LANCHESTER_ROUND_SCALE = 0.25
+LANCHESTER_BREAK_FRACTION = 0.3
+LANCHESTER_MAX_ROUNDS = 50
+
+# Unit stats (base values)
+UNIT_STATS = {
+    "infantry": {"attack": 100, "defense": 120, "hp": 800, "strong_vs": "ranged", "weak_vs": "cavalry"},
+    "ranged": {"attack": 110, "defense": 80, "hp": 600, "strong_vs": "cavalry", "weak_vs": "infantry"},
+    "cavalry": {"attack": 130, "defense": 90, "hp": 700, "strong_vs": "infantry", "weak_vs": "ranged"},
+    "siege": {"attack": 200, "defense": 60, "hp": 500, "strong_vs": "wall", "weak_vs": "all"}
+}
+
+class UnitTables:
+    """UNIT_STATS compiled once into flat tuples (scalar path) and arrays (batch path)"""
+
+    def __init__(self, unit_stats):
+        self.unit_stats = unit_stats
+        # Identifies this balance version, e.g. to invalidate tables precomputed from it
+        self.key = hashlib.sha256(json.dumps(unit_stats, sort_keys=True).encode()).hexdigest()[:16]
+        self.attack = tuple(float(unit_stats[t]["attack"]) for t in UNIT_TYPES)
+        self.defense = tuple(float(unit_stats[t]["defense"]) for t in UNIT_TYPES)
+        self.hp = tuple(float(unit_stats[t]["hp"]) for t in UNIT_TYPES)
+        # Index of the unit type each type is strong against, or -1 (e.g. siege vs walls)
+        self.strong_index = tuple(
+            UNIT_TYPES.index(unit_stats[t]["strong_vs"]) if unit_stats[t]["strong_vs"] in UNIT_TYPES else -1
+            for t in UNIT_TYPES
+        )
+
+        self.base_attack = np.array(self.attack, dtype=np.float64)
+        self.base_defense = np.array(self.defense, dtype=np.float64)
+        self.base_hp = np.array(self.hp, dtype=np.float64)
+        # strong_vs[i, j] is 1 when unit type i is strong against unit type j
+        self.strong_vs = np.zeros((len(UNIT_TYPES), len(UNIT_TYPES)), dtype=np.int64)
+        for i, j in enumerate(self.strong_index):
+            if j >= 0:
+                self.strong_vs[i, j] = 1
+
+def validate_unit_stats(unit_stats):
+    """Raise ValueError unless unit_stats has numeric attack/defense/hp and a strong_vs for every unit type"""
+    if not isinstance(unit_stats, dict):
+        raise ValueError("Unit stats must be a mapping of unit type to stats")
+    missing = [t for t in UNIT_TYPES if t not in unit_stats]
+    if missing:
+        raise ValueError(f"Unit stats missing unit types: {', '.join(missing)}")
+    for unit_type in UNIT_TYPES:
+        stats = unit_stats[unit_type]
+        if not isinstance(stats, dict):
+            raise ValueError(f"{unit_type} must be a mapping of stat name to value")
+        for field in ("attack", "defense", "hp"):
+            value = stats.get(field)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"{unit_type}.{field} must be a non-negative number")
+        if not isinstance(stats.get("strong_vs"), str):
+            raise ValueError(f"{unit_type}.strong_vs must be a string")
+
+def load_unit_stats(path):
+    """Read unit stats from a JSON or YAML balance file"""
+    with open(path) as f:
+        if path.endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("Reading YAML unit stats requires PyYAML (pip install PyYAML)")
+            try:
+                unit_stats = yaml.safe_load(f)
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid YAML in {path}: {e}")
+        else:
+            unit_stats = json.load(f)
+    validate_unit_stats(unit_stats)
+    return unit_stats
+
+def _file_signature(path):
+    """(mtime, size) of a balance file, which changes whenever the file is rewritten"""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+_tables_signature = _file_signature(UNIT_STATS_FILE) if UNIT_STATS_FILE else None
+_tables = UnitTables(load_unit_stats(UNIT_STATS_FILE) if UNIT_STATS_FILE else UNIT_STATS)
+_tables_checked_at = time.monotonic()
+
+def get_unit_tables():
+    """Current compiled unit stat tables, reloaded once UNIT_STATS_FILE has changed on disk"""
+    global _tables_checked_at, _tables_signature
+    if UNIT_STATS_FILE and time.monotonic() - _tables_checked_at >= UNIT_STATS_CHECK_MS / 1000:
+        _tables_checked_at = time.monotonic()
+        try:
+            signature = _file_signature(UNIT_STATS_FILE)
+            if signature != _tables_signature:
+                _tables_signature = signature
+                reload_unit_stats()
+        except (OSError, ValueError) as e:
+            # Keep serving the last good stats; the file is retried once it changes again
+            print(f"Unit stats reload from {UNIT_STATS_FILE} failed: {e}")
+    return _tables
+
+def reload_unit_stats(path=None):
+    """Swap in unit stats from a balance file (default UNIT_STATS_FILE) and return the new tables"""
+    global _tables, _tables_signature
+    path = path or UNIT_STATS_FILE
+    if not path:
+        raise ValueError("No unit stats file configured (set UNIT_STATS_FILE)")
+    signature = _file_signature(path)
+    tables = UnitTables(load_unit_stats(path))
+    if path == UNIT_STATS_FILE:
+        _tables_signature = signature
+    _tables = tables
+    return tables
+
+def _row_sum(values):
+    """Sum the last axis left to right so results match the scalar accumulation order"""
+    total = np.zeros(values.shape[:-1], dtype=values.dtype)
+    for column in range(values.shape[-1]):
+        total = total + values[..., column]
+    return total
+
+def unit_stats_batch(bonuses):
+    """Per-unit attack, defense and hp (each N x 4) for an (N x 6) bonus matrix"""
+    bonuses = np.asarray(bonuses, dtype=np.float64)
+    tables = get_unit_tables()
+
+    # Research bonuses first, then hero bonuses, matching calculate_effective_stats
+    attack = tables.base_attack * (1 + bonuses[:, 0:1] / 100) * (1 + bonuses[:, 3:4] / 100)
+    defense = tables.base_defense * (1 + bonuses[:, 1:2] / 100) * (1 + bonuses[:, 4:5] / 100)
+    hp = tables.base_hp * (1 + bonuses[:, 2:3] / 100) * (1 + bonuses[:, 5:6] / 100)
+    return attack, defense, hp
+
+def effective_stats_batch(counts, bonuses):
+    """Calculate effective army stats for an (N x 4) count matrix and (N x 6) bonus matrix"""
+    counts = np.asarray(counts, dtype=np.int64)
+    present = counts > 0
+    attack, defense, hp = unit_stats_batch(bonuses)
+
+    return {
+        "total_attack": _row_sum(np.where(present, attack * counts, 0.0)),
+        "total_defense": _row_sum(np.where(present, defense * counts, 0.0)),
+        "total_hp": _row_sum(np.where(present, hp * counts, 0.0)),
+        "unit_count": counts.sum(axis=1)
+    }
+
+def type_advantage_batch(player_counts, enemy_counts):
+    """Calculate type advantage multipliers for matching rows of two (N x 4) count matrices"""
+    player_counts = np.asarray(player_counts, dtype=np.int64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+
+    # Enemy count of the type each player unit is strong against (0 when none)
+    countered = enemy_counts @ get_unit_tables().strong_vs.T
+    terms = np.where(player_counts > 0, player_counts * countered, 0).astype(np.float64) * 0.25
+    advantage_score = _row_sum(terms)
+
+    total_units = player_counts.sum(axis=1) * enemy_counts.sum(axis=1)
+    valid = (player_counts.sum(axis=1) > 0) & (enemy_counts.sum(axis=1) > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        advantage = 1 + advantage_score / total_units.astype(np.float64)
+    return np.where(valid, advantage, 1.0)
+
+def battle_outcome(player_power, enemy_power):
+    """Turn power arrays into win probabilities and per-side loss rates"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        total_power = player_power + enemy_power
+        win_probability = np.where(total_power > 0, player_power / total_power, 0.5)
+
+        damage_to_player = np.where(player_power > 0, enemy_power / player_power, 1.0)
+        damage_to_enemy = np.where(enemy_power > 0, player_power / enemy_power, 1.0)
+
+    player_loss_rate = np.minimum(damage_to_player * 0.3, 0.8)
+    enemy_loss_rate = np.minimum(damage_to_enemy * 0.3, 0.8)
+
+    losing = win_probability < 0.5
+    player_loss_rate = np.where(losing, np.minimum(player_loss_rate * 1.5, 0.9), player_loss_rate)
+    enemy_loss_rate = np.where(losing, enemy_loss_rate, np.minimum(enemy_loss_rate * 1.5, 0.9))
+    return win_probability, player_loss_rate, enemy_loss_rate
+
+def _battle_rates(player_counts, player_bonuses, enemy_counts, enemy_bonuses):
+    """Powers, advantages, win probability and loss rates for N battles"""
+    player_stats = effective_stats_batch(player_counts, player_bonuses)
+    enemy_stats = effective_stats_batch(enemy_counts, enemy_bonuses)
+
+    player_advantage = type_advantage_batch(player_counts, enemy_counts)
+    enemy_advantage = type_advantage_batch(enemy_counts, player_counts)
+
+    player_power = player_stats["total_attack"] * player_advantage * player_stats["total_hp"] / 1000
+    enemy_power = enemy_stats["total_attack"] * enemy_advantage * enemy_stats["total_hp"] / 1000
+
+    win_probability, player_loss_rate, enemy_loss_rate = battle_outcome(player_power, enemy_power)
+    return player_power, enemy_power, player_advantage, enemy_advantage, win_probability, player_loss_rate, enemy_loss_rate
+
+def simulate_battles(player_counts, player_bonuses, enemy_counts, enemy_bonuses):
+    """Simulate N battles at once; row i gives the same numbers as simulate_battle for pair i"""
+    player_counts = np.asarray(player_counts, dtype=np.int64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+
+    player_power, enemy_power, player_advantage, enemy_advantage, win_probability, player_loss_rate, enemy_loss_rate = (
+        _battle_rates(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+    )
+
+    # int() truncates toward zero, and so does the float -> int64 cast
+    player_losses = (player_counts * player_loss_rate[:, None]).astype(np.int64)
+    enemy_losses = (enemy_counts * enemy_loss_rate[:, None]).astype(np.int64)
+
+    return {
+        "win_probability": win_probability,
+        "player_losses": player_losses,
+        "enemy_losses": enemy_losses,
+        "player_power": player_power,
+        "enemy_power": enemy_power,
+        "type_advantage": player_advantage - enemy_advantage
+    }
+
+def sensitivity_report(player_counts, player_bonuses, enemy_counts, enemy_bonuses, bonus_step=SENSITIVITY_BONUS_STEP):
+    """Derivatives of win probability and expected losses with respect to every input of one battle
+
+    Central differences over all 20 inputs (4 counts and 6 bonuses per side), evaluated as
+    one 41-row batch. Losses are kept fractional here so the derivatives are not swamped
+    by rounding to whole troops. gradient[side, input] holds the derivatives of
+    (win_probability, player_losses, enemy_losses): per troop for counts, per bonus
+    point for bonuses.
+    """
+    counts = np.asarray([player_counts, enemy_counts], dtype=np.int64)
+    bonuses = np.asarray([player_bonuses, enemy_bonuses], dtype=np.float64)
+    inputs = len(UNIT_TYPES) + len(BONUS_FIELDS)
+
+    # Row 0 is the battle itself; rows 1 + 2k and 2 + 2k step input k down and up
+    rows = 1 + 2 * 2 * inputs
+    batch_counts = np.repeat(counts[None], rows, axis=0)
+    batch_bonuses = np.repeat(bonuses[None], rows, axis=0)
+    spans = np.zeros((2, inputs))
+    for side in range(2):
+        # Count steps scale with army size; a single troop would be lost in float noise on huge armies
+        count_step = max(int(counts[side].sum()) // 1000, 1)
+        for k in range(inputs):
+            row = 1 + 2 * (side * inputs + k)
+            if k < len(UNIT_TYPES):
+                lower = max(counts[side, k] - count_step, 0)
+                upper = counts[side, k] + count_step
+                batch_counts[row, side, k] = lower
+                batch_counts[row + 1, side, k] = upper
+            else:
+                b = k - len(UNIT_TYPES)
+                lower = bonuses[side, b] - bonus_step
+                upper = bonuses[side, b] + bonus_step
+                batch_bonuses[row, side, b] = lower
+                batch_bonuses[row + 1, side, b] = upper
+            spans[side, k] = upper - lower
+
+    _, _, _, _, win_probability, player_loss_rate, enemy_loss_rate = _battle_rates(
+        batch_counts[:, 0], batch_bonuses[:, 0], batch_counts[:, 1], batch_bonuses[:, 1]
+    )
+    outcome = np.stack([
+        win_probability,
+        batch_counts[:, 0].sum(axis=1) * player_loss_rate,
+        batch_counts[:, 1].sum(axis=1) * enemy_loss_rate
+    ], axis=1)
+
+    stepped = outcome[1:].reshape(2, inputs, 2, 3)
+    gradient = (stepped[:, :, 1] - stepped[:, :, 0]) / spans[:, :, None]
+    return {
+        "win_probability": float(outcome[0, 0]),
+        "player_losses": float(outcome[0, 1]),
+        "enemy_losses": float(outcome[0, 2]),
+        "gradient": gradient
+    }
+
+def _pairwise_advantage(player_counts, enemy_counts):
+    """type_advantage_batch for every (player row, enemy row) pair, as an (R x C) matrix"""
+    countered = enemy_counts @ get_unit_tables().strong_vs.T
+    players = player_counts[:, None, :]
+    terms = np.where(players > 0, players * countered[None, :, :], 0).astype(np.float64) * 0.25
+    advantage_score = _row_sum(terms)
+
+    player_totals = player_counts.sum(axis=1)[:, None]
+    enemy_totals = enemy_counts.sum(axis=1)[None, :]
+    valid = (player_totals > 0) & (enemy_totals > 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        advantage = 1 + advantage_score / (player_totals * enemy_totals).astype(np.float64)
+    return np.where(valid, advantage, 1.0)
+
+def tournament_matrix(player_counts, player_bonuses, enemy_counts, enemy_bonuses):
+    """Battle every player row against every enemy row; entry (i, j) matches simulate_battle
+
+    Returns (R x C) matrices of win probability and total troops lost by each side.
+    """
+    player_counts = np.asarray(player_counts, dtype=np.int64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+
+    # Stats only depend on the army itself, so they are computed once per row and column
+    player_stats = effective_stats_batch(player_counts, player_bonuses)
+    enemy_stats = effective_stats_batch(enemy_counts, enemy_bonuses)
+
+    player_advantage = _pairwise_advantage(player_counts, enemy_counts)
+    enemy_advantage = _pairwise_advantage(enemy_counts, player_counts).T
+
+    player_power = player_stats["total_attack"][:, None] * player_advantage * player_stats["total_hp"][:, None] / 1000
+    enemy_power = enemy_stats["total_attack"][None, :] * enemy_advantage * enemy_stats["total_hp"][None, :] / 1000
+
+    win_probability, player_loss_rate, enemy_loss_rate = battle_outcome(player_power, enemy_power)
+
+    # Truncate per unit type before summing, as simulate_battle does
+    player_losses = (player_counts[:, None, :] * player_loss_rate[:, :, None]).astype(np.int64).sum(axis=2)
+    enemy_losses = (enemy_counts[None, :, :] * enemy_loss_rate[:, :, None]).astype(np.int64).sum(axis=2)
+
+    return {
+        "win_probability": win_probability,
+        "player_losses": player_losses,
+        "enemy_losses": enemy_losses
+    }
+
+def _wilson_interval(wins, trials, z=1.96):
+    """Wilson score interval for a binomial proportion"""
+    p = wins / trials
+    denominator = 1 + z * z / trials
+    center = (p + z * z / (2 * trials)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / trials + z * z / (4 * trials * trials)) / denominator
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+def _loss_distribution(losses):
+    """Summarize a (trials x 4) loss matrix per unit type"""
+    mean = losses.mean(axis=0)
+    p5, p50, p95 = np.percentile(losses, [5, 50, 95], axis=0)
+    return {
+        unit_type: {
+            "mean": float(mean[i]),
+            "p5": float(p5[i]),
+            "p50": float(p50[i]),
+            "p95": float(p95[i])
+        }
+        for i, unit_type in enumerate(UNIT_TYPES)
+    }
+
+def monte_carlo_battle(player_counts, player_bonuses, enemy_counts, enemy_bonuses, trials, seed=None,
+                       stat_spread=STAT_SPREAD, loss_spread=LOSS_SPREAD):
+    """Run randomized engagements around one matchup with all trials drawn in a single batch"""
+    player_counts = np.asarray(player_counts, dtype=np.int64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+    base = simulate_battles([player_counts], [player_bonuses], [enemy_counts], [enemy_bonuses])
+    rng = np.random.default_rng(seed)
+
+    # Mean-one lognormal noise on each side's attack and hp; power scales with their product
+    stat_noise = rng.lognormal(-stat_spread ** 2 / 2, stat_spread, size=(4, trials))
+    player_power = base["player_power"][0] * stat_noise[0] * stat_noise[1]
+    enemy_power = base["enemy_power"][0] * stat_noise[2] * stat_noise[3]
+
+    win_probability, player_loss_rate, enemy_loss_rate = battle_outcome(player_power, enemy_power)
+    wins = int(np.count_nonzero(rng.random(trials) < win_probability))
+
+    # Per-type noise on loss rates, since not every unit type bleeds evenly
+    loss_noise = rng.lognormal(-loss_spread ** 2 / 2, loss_spread, size=(2, trials, len(UNIT_TYPES)))
+    player_rates = np.clip(player_loss_rate[:, None] * loss_noise[0], 0.0, 1.0)
+    enemy_rates = np.clip(enemy_loss_rate[:, None] * loss_noise[1], 0.0, 1.0)
+    player_losses = (player_counts * player_rates).astype(np.int64)
+    enemy_losses = (enemy_counts * enemy_rates).astype(np.int64)
+
+    lower, upper = _wilson_interval(wins, trials)
+    return {
+        "trials": trials,
+        "win_probability": wins / trials,
+        "confidence_interval": [lower, upper],
+        "win_probability_std": float(win_probability.std()),
+        "mean_player_losses": player_losses.mean(axis=0),
+        "mean_enemy_losses": enemy_losses.mean(axis=0),
+        "player_loss_distribution": _loss_distribution(player_losses),
+        "enemy_loss_distribution": _loss_distribution(enemy_losses)
+    }
+
+def _simplex_grid(parts, dims=len(UNIT_TYPES)):
+    """All non-negative integer vectors of length dims that sum to parts"""
+    grid = [c + (parts - sum(c),) for c in itertools.product(range(parts + 1), repeat=dims - 1) if sum(c) <= parts]
+    return np.array(grid, dtype=np.int64)
+
+# Local search moves: shift troops between types while keeping the total fixed
+NEIGHBOR_MOVES = np.array(
+    [m for m in itertools.product(range(-2, 3), repeat=len(UNIT_TYPES)) if sum(m) == 0 and any(m)],
+    dtype=np.int64
+)
+
+def optimize_composition(total_troops, player_bonuses, enemy_counts, enemy_bonuses, max_ms=200,
+                         grid_parts=20, loss_weight=OPTIMIZER_LOSS_WEIGHT):
+    """Search compositions of total_troops for the best score against one enemy army"""
+    steps = optimize_composition_steps(
+        total_troops, player_bonuses, enemy_counts, enemy_bonuses, max_ms, grid_parts, loss_weight, progress_ms=None
+    )
+    for result in steps:
+        pass
+    return result
+
+def optimize_composition_steps(total_troops, player_bonuses, enemy_counts, enemy_bonuses, max_ms=200,
+                               grid_parts=20, loss_weight=OPTIMIZER_LOSS_WEIGHT, progress_ms=50, stop=None):
+    """optimize_composition that also yields the best result so far while it searches
+
+    An intermediate result is yielded when the best candidate has improved and at least
+    progress_ms has passed since the previous one (never, if progress_ms is None). The
+    last item is always the final result. Setting `stop` (a threading or multiprocessing
+    Event) ends the search early, as if its time budget had run out.
+    """
+    start = time.perf_counter()
+    deadline = start + max_ms / 1000
+    player_bonuses = np.asarray(player_bonuses, dtype=np.float64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+    enemy_bonuses = np.asarray(enemy_bonuses, dtype=np.float64)
+
+    def evaluate(candidates):
+        n = len(candidates)
+        outcome = simulate_battles(
+            candidates,
+            np.broadcast_to(player_bonuses, (n, len(BONUS_FIELDS))),
+            np.broadcast_to(enemy_counts, (n, len(UNIT_TYPES))),
+            np.broadcast_to(enemy_bonuses, (n, len(BONUS_FIELDS)))
+        )
+        scores = outcome["win_probability"] - loss_weight * outcome["player_losses"].sum(axis=1) / total_troops
+        return scores, outcome
+
+    # Coarse pass over every composition on a 1/grid_parts lattice
+    fractions = _simplex_grid(grid_parts)
+    candidates = fractions * total_troops // grid_parts
+    candidates[np.arange(len(candidates)), fractions.argmax(axis=1)] += total_troops - candidates.sum(axis=1)
+    scores, _ = evaluate(candidates)
+    evaluated = len(candidates)
+    best = candidates[scores.argmax()]
+    best_score = scores.max()
+
+    def result():
+        _, outcome = evaluate(best[None, :])
+        return {
+            "composition": best,
+            "score": float(best_score),
+            "win_probability": float(outcome["win_probability"][0]),
+            "player_losses": outcome["player_losses"][0],
+            "enemy_losses": outcome["enemy_losses"][0],
+            "candidates_evaluated": evaluated,
+            "elapsed_ms": (time.perf_counter() - start) * 1000
+        }
+
+    last_progress = None
+    if progress_ms is not None:
+        last_progress = time.perf_counter()
+        yield result()
+
+    # Fine pass: hill-climb from the best lattice point, halving the step when stuck
+    step = max(total_troops // (grid_parts * 2), 1)
+    next_stop_check = time.perf_counter()
+    while time.perf_counter() < deadline:
+        # A manager Event costs a round trip to read, so it is checked every few milliseconds
+        if stop is not None and time.perf_counter() >= next_stop_check:
+            if stop.is_set():
+                break
+            next_stop_check = time.perf_counter() + OPTIMIZER_STOP_CHECK_MS / 1000
+        neighbors = best + step * NEIGHBOR_MOVES
+        neighbors = neighbors[(neighbors >= 0).all(axis=1)]
+        scores, _ = evaluate(neighbors)
+        evaluated += len(neighbors)
+        if scores.max() > best_score:
+            best = neighbors[scores.argmax()]
+            best_score = scores.max()
+            if last_progress is not None and time.perf_counter() - last_progress >= progress_ms / 1000:
+                last_progress = time.perf_counter()
+                yield result()
+        elif step == 1:
+            break
+        else:
+            step = max(step // 2, 1)
+
+    yield result()
+
+def _kill_rates(attack, target_defense, target_hp, advantage):
+    """(N x 4 x 4) targets of type j killed per round by one unit of type i firing only at them"""
+    attack = attack[:, :, None]
+    # Armor soaks a share of each hit; type advantage adds on top
+    mitigated = attack * attack / (attack + target_defense[:, None, :])
+    return LANCHESTER_ROUND_SCALE * mitigated * advantage / target_hp[:, None, :]
+
+def _round_kills(shooters, targets, kill_rates, advantage):
+    """(4 x N) targets killed in one round, with battles along the last axis
+
+    Type i splits its fire across target types in proportion to targets_j * advantage_ij,
+    so kills_j = targets_j * sum_i (shooters_i / sum_k targets_k * advantage_ik) * rate_ij * advantage_ij.
+    Sums are spelled out left to right so a batch column matches _round_kills_single exactly.
+    """
+    weight_totals = (advantage[:, 0, None] * targets[0] + advantage[:, 1, None] * targets[1]
+                     + advantage[:, 2, None] * targets[2] + advantage[:, 3, None] * targets[3])
+    per_weight = np.divide(shooters, weight_totals, out=np.zeros_like(shooters), where=weight_totals > 0)
+    return targets * (per_weight[0] * kill_rates[0] + per_weight[1] * kill_rates[1]
+                      + per_weight[2] * kill_rates[2] + per_weight[3] * kill_rates[3])
+
+def _round_kills_single(shooters, targets, kill_rates, advantage):
+    """_round_kills for one battle on plain floats, which skips numpy's per-call overhead"""
+    t0, t1, t2, t3 = targets
+    per_weight = []
+    for shooter, (a0, a1, a2, a3) in zip(shooters, advantage):
+        weight_total = t0 * a0 + t1 * a1 + t2 * a2 + t3 * a3
+        per_weight.append(shooter / weight_total if weight_total > 0 else 0.0)
+    p0, p1, p2, p3 = per_weight
+    return [target * (p0 * r0 + p1 * r1 + p2 * r2 + p3 * r3)
+            for target, r0, r1, r2, r3 in zip(targets, *kill_rates)]
+
+def _lanchester_rounds(player, enemy, player_kill_rates, enemy_kill_rates, advantage,
+                       player_floor, enemy_floor, active, max_rounds):
+    """Fight up to max_rounds for N battles; returns surviving troops (each N x 4) and rounds fought"""
+    # Work on (4 x N) troops and (4 x 4 x N) kill rates so every per-type slice is contiguous
+    player = player.T.copy()
+    enemy = enemy.T.copy()
+    player_kill_rates = np.ascontiguousarray(player_kill_rates.transpose(1, 2, 0))
+    enemy_kill_rates = np.ascontiguousarray(enemy_kill_rates.transpose(1, 2, 0))
+    rounds = np.zeros(len(active), dtype=np.int64)
+    for _ in range(max_rounds):
+        if not active.any():
+            break
+        # Both sides fire simultaneously at the troops standing at the start of the round
+        enemy_killed = _round_kills(player, enemy, player_kill_rates, advantage)
+        player_killed = _round_kills(enemy, player, enemy_kill_rates, advantage)
+        player = np.where(active, np.maximum(player - player_killed, 0.0), player)
+        enemy = np.where(active, np.maximum(enemy - enemy_killed, 0.0), enemy)
+        rounds += active
+        active &= (_row_sum(player.T) > player_floor) & (_row_sum(enemy.T) > enemy_floor)
+    return player.T, enemy.T, rounds
+
+def _lanchester_rounds_single(player, enemy, player_kill_rates, enemy_kill_rates, advantage,
+                              player_floor, enemy_floor, active, max_rounds):
+    """_lanchester_rounds for a single battle, run on plain floats"""
+    player = player[0].tolist()
+    enemy = enemy[0].tolist()
+    player_kill_rates = player_kill_rates[0].tolist()
+    enemy_kill_rates = enemy_kill_rates[0].tolist()
+    advantage = advantage.tolist()
+    player_floor = float(player_floor[0])
+    enemy_floor = float(enemy_floor[0])
+    rounds = 0
+
+    if active[0]:
+        for _ in range(max_rounds):
+            enemy_killed = _round_kills_single(player, enemy, player_kill_rates, advantage)
+            player_killed = _round_kills_single(enemy, player, enemy_kill_rates, advantage)
+            player = [max(p - k, 0.0) for p, k in zip(player, player_killed)]
+            enemy = [max(e - k, 0.0) for e, k in zip(enemy, enemy_killed)]
+            rounds += 1
+            p0, p1, p2, p3 = player
+            e0, e1, e2, e3 = enemy
+            if p0 + p1 + p2 + p3 <= player_floor or e0 + e1 + e2 + e3 <= enemy_floor:
+                break
+    return np.array([player]), np.array([enemy]), np.array([rounds], dtype=np.int64)
+
+def lanchester_battles(player_counts, player_bonuses, enemy_counts, enemy_bonuses,
+                       max_rounds=LANCHESTER_MAX_ROUNDS, break_fraction=LANCHESTER_BREAK_FRACTION):
+    """Simulate N battles in discrete rounds of per-type Lanchester attrition
+
+    Each round is a handful of (N x 4 x 4) array operations, so the cost depends on the
+    number of rounds and battles, not on troop counts. A battle stops once either side
+    falls to break_fraction of its starting troops; the loop ends when every battle has.
+    """
+    player_start = np.asarray(player_counts, dtype=np.float64).clip(min=0)
+    enemy_start = np.asarray(enemy_counts, dtype=np.float64).clip(min=0)
+    advantage = 1 + 0.25 * get_unit_tables().strong_vs
+
+    player_attack, player_defense, player_hp = unit_stats_batch(player_bonuses)
+    enemy_attack, enemy_defense, enemy_hp = unit_stats_batch(enemy_bonuses)
+    # Kill rates pre-multiplied by the focus weights' advantage term
+    player_kill_rates = _kill_rates(player_attack, enemy_defense, enemy_hp, advantage) * advantage
+    enemy_kill_rates = _kill_rates(enemy_attack, player_defense, player_hp, advantage) * advantage
+
+    player_floor = break_fraction * _row_sum(player_start)
+    enemy_floor = break_fraction * _row_sum(enemy_start)
+    active = (_row_sum(player_start) > 0) & (_row_sum(enemy_start) > 0)
+    # Single battles (the /api/battle/simulate path) skip numpy's per-call overhead
+    run_rounds = _lanchester_rounds_single if len(player_start) == 1 else _lanchester_rounds
+    player, enemy, rounds = run_rounds(
+        player_start, enemy_start, player_kill_rates, enemy_kill_rates, advantage,
+        player_floor, enemy_floor, active, max_rounds
+    )
+
+    # Score the survivors with the same attack x hp power measure as simulate_battles
+    player_power = (player * player_attack).sum(axis=1) * (player * player_hp).sum(axis=1) / 1000
+    enemy_power = (enemy * enemy_attack).sum(axis=1) * (enemy * enemy_hp).sum(axis=1) / 1000
+    total_power = player_power + enemy_power
+    with np.errstate(divide="ignore", invalid="ignore"):
+        win_probability = np.where(total_power > 0, player_power / total_power, 0.5)
+
+    player_counts = np.asarray(player_counts, dtype=np.int64)
+    enemy_counts = np.asarray(enemy_counts, dtype=np.int64)
+    return {
+        "win_probability": win_probability,
+        "player_losses": (player_start - player).astype(np.int64),
+        "enemy_losses": (enemy_start - enemy).astype(np.int64),
+        "player_power": player_power,
+        "enemy_power": enemy_power,
+        "type_advantage": type_advantage_batch(player_counts, enemy_counts) - type_advantage_batch(enemy_counts, player_counts),
+        "rounds": rounds,
+        "player_broken": _row_sum(player) <= player_floor,
+        "enemy_broken": _row_sum(enemy) <= enemy_floor
+    }
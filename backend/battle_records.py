@@ -0,0 +1,250 @@
+"""Compact storage layout for battle records
+
+Schema version 2 keeps battle_id, timestamp, scenario and result.win_probability where
+they always were, so indexes, filters and cursors work on both layouts. Everything else
+is packed:
+
+    player_army / enemy_army   [infantry, ranged, cavalry, siege,
+                                research_attack, research_defense, research_hp,
+                                hero army_attack, hero army_defense, hero army_hp]
+    player_hero / enemy_hero   [name, attack_bonus, defense_bonus, hp_bonus], only when a hero was given
+    result.losses              player losses then enemy losses, in UNIT_TYPES order
+    result.recommendation      index into RECOMMENDATIONS (the text itself if it is not listed)
+    result.confidence_level    index into CONFIDENCE_LEVELS
+    result.details             [player_power, enemy_power, type_advantage]
+    result.lanchester          [rounds, player_broken, enemy_broken], Lanchester engine only
+    result.monte_carlo         unchanged, Monte Carlo mode only
+
+Documents without schema_version are the original nested layout (version 1); the
+migration marks old documents it cannot convert with schema_version 1.
+"""
+import asyncio
+import os
+import time
+
+from pymongo import ReplaceOne, UpdateOne
+
+from battle_engine import UNIT_TYPES
+
+BATTLE_SCHEMA_VERSION = 2
+
+# Stored codes index into these tuples, so only ever append to them
+RECOMMENDATIONS = (
+    "Strong victory expected! Proceed with confidence.",
+    "Favorable battle. Consider attacking if losses are acceptable.",
+    "Close battle. Consider adjusting army composition for better type advantage.",
+    "Close battle. Consider adding more troops or improving hero/research bonuses.",
+    "High risk of defeat. Your army composition is weak against enemy. Add more cavalry to counter their infantry.",
+    "High risk of defeat. Your army composition is weak against enemy. Add more infantry to counter their ranged.",
+    "High risk of defeat. Your army composition is weak against enemy. Add more ranged to counter their cavalry.",
+    "High risk of defeat. Your army composition is weak against enemy. ",
+    "High risk of defeat. Consider significantly increasing army size or improving bonuses."
+)
+CONFIDENCE_LEVELS = ("High", "Medium", "Low")
+
+RECOMMENDATION_CODES = {text: code for code, text in enumerate(RECOMMENDATIONS)}
+CONFIDENCE_CODES = {level: code for code, level in enumerate(CONFIDENCE_LEVELS)}
+
+ARMY_BONUS_FIELDS = ("research_attack", "research_defense", "research_hp")
+HERO_ARMY_FIELDS = ("army_attack", "army_defense", "army_hp")
+HERO_SELF_FIELDS = ("attack_bonus", "defense_bonus", "hp_bonus")
+DETAIL_FIELDS = ("player_power", "enemy_power", "type_advantage")
+
+# Documents per migration batch, and the pause between batches to leave room for live traffic
+BATTLE_MIGRATION_BATCH_SIZE = int(os.environ.get('BATTLE_MIGRATION_BATCH_SIZE', '500'))
+BATTLE_MIGRATION_PAUSE_MS = int(os.environ.get('BATTLE_MIGRATION_PAUSE_MS', '50'))
+
+def _encode_army(army: dict):
+    hero = army.get("hero")
+    values = [army["composition"][unit_type] for unit_type in UNIT_TYPES]
+    values += [army[field] for field in ARMY_BONUS_FIELDS]
+    values += [hero[field] if hero else 0.0 for field in HERO_ARMY_FIELDS]
+    return values, ([hero["name"]] + [hero[field] for field in HERO_SELF_FIELDS] if hero else None)
+
+def _decode_army(values, hero_values):
+    army = {"composition": dict(zip(UNIT_TYPES, values[:4]))}
+    if hero_values is None:
+        army["hero"] = None
+    else:
+        army["hero"] = {"name": hero_values[0], **dict(zip(HERO_SELF_FIELDS, hero_values[1:]))}
+        army["hero"].update(zip(HERO_ARMY_FIELDS, values[7:10]))
+    army.update(zip(ARMY_BONUS_FIELDS, values[4:7]))
+    return army
+
+def encode_battle(record: dict):
+    """Compact (version 2) form of a battle record in the original nested layout"""
+    result = record["result"]
+    compact = {
+        "schema_version": BATTLE_SCHEMA_VERSION,
+        "battle_id": record["battle_id"],
+        "timestamp": record["timestamp"],
+        "scenario": record["scenario"]
+    }
+    for side in ("player", "enemy"):
+        values, hero = _encode_army(record[f"{side}_army"])
+        compact[f"{side}_army"] = values
+        if hero is not None:
+            compact[f"{side}_hero"] = hero
+
+    details = result.get("details") or {}
+    compact_result = {
+        "win_probability": result["win_probability"],
+        "losses": [result["expected_losses"][t] for t in UNIT_TYPES] + [result["enemy_losses"][t] for t in UNIT_TYPES],
+        "recommendation": RECOMMENDATION_CODES.get(result["recommendation"], result["recommendation"]),
+        "confidence_level": CONFIDENCE_CODES.get(result["confidence_level"], result["confidence_level"]),
+        "details": [details.get(field) for field in DETAIL_FIELDS]
+    }
+    if details.get("engine") == "lanchester":
+        compact_result["lanchester"] = [details["rounds"], details["player_broken"], details["enemy_broken"]]
+    if result.get("monte_carlo") is not None:
+        compact_result["monte_carlo"] = result["monte_carlo"]
+    compact["result"] = compact_result
+    return compact
+
+def decode_battle(document: dict):
+    """Battle in the original nested layout, whichever layout it is stored in
+
+    Works on projected documents too: only the parts present are decoded.
+    """
+    if document.get("schema_version") != BATTLE_SCHEMA_VERSION:
+        return {key: value for key, value in document.items() if key != "schema_version"}
+    battle = {key: value for key, value in document.items() if key not in (
+        "schema_version", "player_army", "player_hero", "enemy_army", "enemy_hero", "result"
+    )}
+    for side in ("player", "enemy"):
+        if f"{side}_army" in document:
+            battle[f"{side}_army"] = _decode_army(document[f"{side}_army"], document.get(f"{side}_hero"))
+
+    compact_result = document.get("result")
+    if compact_result is not None:
+        recommendation = compact_result["recommendation"]
+        confidence = compact_result["confidence_level"]
+        details = dict(zip(DETAIL_FIELDS, compact_result["details"]))
+        if "lanchester" in compact_result:
+            rounds, player_broken, enemy_broken = compact_result["lanchester"]
+            details.update({
+                "engine": "lanchester",
+                "rounds": rounds,
+                "player_broken": player_broken,
+                "enemy_broken": enemy_broken
+            })
+        losses = compact_result["losses"]
+        battle["result"] = {
+            "battle_id": document.get("battle_id"),
+            "win_probability": compact_result["win_probability"],
+            "expected_losses": dict(zip(UNIT_TYPES, losses[:4])),
+            "enemy_losses": dict(zip(UNIT_TYPES, losses[4:])),
+            "recommendation": RECOMMENDATIONS[recommendation] if isinstance(recommendation, int) else recommendation,
+            "confidence_level": CONFIDENCE_LEVELS[confidence] if isinstance(confidence, int) else confidence,
+            "details": details,
+            "monte_carlo": compact_result.get("monte_carlo")
+        }
+        if battle["result"]["battle_id"] is None:
+            del battle["result"]["battle_id"]
+    return battle
+
+def stored_fields(names):
+    """Stored top-level fields to project so that the given decoded fields can be rebuilt"""
+    stored = {"schema_version"}
+    for name in names:
+        root = name.split(".")[0]
+        stored.add(root)
+        if root in ("player_army", "enemy_army"):
+            stored.add(root.replace("_army", "_hero"))
+    return stored
+
+def select_fields(battle: dict, names):
+    """Copy only the given (possibly dotted) fields of a decoded battle"""
+    selected = {}
+    for name in names:
+        source = battle
+        parts = name.split(".")
+        for part in parts:
+            if not isinstance(source, dict) or part not in source:
+                break
+            source = source[part]
+        else:
+            target = selected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = source
+    return selected
+
+class BattleMigration:
+    """Rewrite version 1 battle documents in the compact layout, batch by batch in the background"""
+
+    def __init__(self, batch_size=BATTLE_MIGRATION_BATCH_SIZE, pause_ms=BATTLE_MIGRATION_PAUSE_MS):
+        self.batch_size = batch_size
+        self.pause = pause_ms / 1000
+        self.migrated = 0
+        self.skipped = 0
+        self.started_at = None
+        self.finished_at = None
+        self.last_error = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None and not self._task.done()
+
+    def start(self, collection):
+        """Start migrating unless a migration is already running; returns whether one was started"""
+        if self.running:
+            return False
+        self.migrated = 0
+        self.skipped = 0
+        self.started_at = time.perf_counter()
+        self.finished_at = None
+        self.last_error = None
+        self._task = asyncio.create_task(self._run(collection))
+        return True
+
+    async def _run(self, collection):
+        try:
+            while True:
+                documents = await collection.find(
+                    {"schema_version": {"$exists": False}}
+                ).limit(self.batch_size).to_list(length=self.batch_size)
+                if not documents:
+                    break
+                operations = []
+                converted = 0
+                for document in documents:
+                    # Match only documents still in the old layout, in case a batch is retried
+                    match = {"_id": document["_id"], "schema_version": {"$exists": False}}
+                    try:
+                        operations.append(ReplaceOne(match, {"_id": document["_id"], **encode_battle(document)}))
+                        converted += 1
+                    except (KeyError, TypeError, AttributeError):
+                        # Left as it is, but marked so the next batch does not pick it up again
+                        operations.append(UpdateOne(match, {"$set": {"schema_version": 1}}))
+                await collection.bulk_write(operations, ordered=False)
+                self.migrated += converted
+                self.skipped += len(documents) - converted
+                await asyncio.sleep(self.pause)
+        except Exception as e:
+            print(f"Battle migration failed: {e}")
+            self.last_error = str(e)
+        finally:
+            self.finished_at = time.perf_counter()
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self):
+        elapsed = None
+        if self.started_at is not None:
+            elapsed = (self.finished_at or time.perf_counter()) - self.started_at
+        return {
+            "running": self.running,
+            "migrated": self.migrated,
+            "skipped": self.skipped,
+            "elapsed_s": round(elapsed, 3) if elapsed is not None else None,
+            "documents_per_second": round(self.migrated / elapsed, 1) if elapsed else 0.0,
+            "last_error": self.last_error
+        }
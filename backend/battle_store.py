@@ -0,0 +1,414 @@
+"""Where battles and their analytics rollups are kept
+
+Two interchangeable backends answer the same calls: MongoBattleStore (the MongoDB
+collections, reconnecting in the background) and SQLiteBattleStore (one embedded
+database file in WAL mode, for deployments without MongoDB). Both take stored records
+in the compact layout and return them as stored; decoding is left to the caller.
+
+History filters are passed as keyword dicts with the build_history_filter arguments:
+scenario, since, until, min_win_probability and max_win_probability.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from pymongo.errors import BulkWriteError
+
+from analytics import (
+    ROLLUP_GRANULARITIES, ROLLUP_INDEXES, ROLLUP_COUNTERS, apply_rollups, rebuild_rollups, rollup_increments,
+    rollup_id
+)
+from battle_engine import UNIT_TYPES
+from database import Database
+from history_query import (
+    BATTLE_INDEXES, HISTORY_SORT, EXPORT_SORT, build_history_filter, build_history_projection, decode_cursor
+)
+
+# Database file of the embedded store
+BATTLE_SQLITE_PATH = os.environ.get(
+    'BATTLE_SQLITE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "battles.db")
+)
+
+# How long a SQLite call waits on a lock held by another process before failing
+BATTLE_SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('BATTLE_SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+async def ensure_indexes(db):
+    """Create the indexes history reads rely on (no-op when they already exist)"""
+    for keys in BATTLE_INDEXES:
+        await db['battles'].create_index(keys)
+    for keys in ROLLUP_INDEXES:
+        await db['battle_rollups'].create_index(keys)
+
+class MongoBattleStore:
+    """Battles in MongoDB, available whenever the background connection is up"""
+
+    name = "mongo"
+
+    def __init__(self, url, database_name):
+        self.database = Database(url, database_name, on_connect=ensure_indexes)
+
+    @property
+    def available(self):
+        return self.database.available
+
+    def start(self):
+        self.database.start()
+
+    async def close(self):
+        await self.database.close()
+
+    def status(self):
+        return {"backend": self.name, **self.database.status()}
+
+    def insert_many(self, records, ordered=False):
+        """Insert a batch of stored records (BufferedBattleWriter's collection interface)"""
+        return self.database.collection('battles').insert_many(records, ordered=ordered)
+
+    async def apply_rollups(self, records):
+        await apply_rollups(self.database.collection('battle_rollups'), records)
+
+    async def recent_battles(self, filters, cursor=None, fields=None, limit=10):
+        """Newest first page of stored battles; cursor resumes after a previous page"""
+        query = build_history_filter(cursor=cursor, **filters)
+        return await self.database.collection('battles').find(
+            query,
+            build_history_projection(fields)
+        ).sort(HISTORY_SORT).limit(limit).to_list(length=limit)
+
+    async def iter_battles(self, filters, fields=None, batch_size=1000):
+        """Every matching stored battle, oldest first, fetched batch_size at a time"""
+        cursor = self.database.collection('battles').find(
+            build_history_filter(**filters),
+            build_history_projection(fields)
+        ).sort(EXPORT_SORT).batch_size(batch_size)
+        try:
+            async for battle in cursor:
+                yield battle
+        finally:
+            await cursor.close()
+
+    async def read_rollups(self, granularity, scenario=None, since=None, until=None, limit=1000):
+        """Rollup documents of one granularity, oldest bucket first"""
+        query = {"granularity": granularity}
+        if scenario:
+            query["scenario"] = scenario
+        if since or until:
+            query["bucket"] = {}
+            if since:
+                query["bucket"]["$gte"] = since
+            if until:
+                query["bucket"]["$lt"] = until
+        return await self.database.collection('battle_rollups').find(query, {"_id": 0}).sort(
+            [("bucket", 1), ("scenario", 1)]
+        ).limit(limit).to_list(length=limit)
+
+    async def rebuild_rollups(self):
+        return await rebuild_rollups(self.database.collection('battles'), self.database.collection('battle_rollups'))
+
+def _sql_time(value: datetime):
+    """Fixed-width text form of a timestamp, so that text order is time order
+
+    Aware timestamps are compared in UTC, as MongoDB does.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+def _column(counter):
+    return counter.replace(".", "_")
+
+ROLLUP_COLUMNS = [_column(counter) for counter in ROLLUP_COUNTERS]
+
+SQLITE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS battles (
+        battle_id TEXT PRIMARY KEY,
+        timestamp TEXT NOT NULL,
+        scenario TEXT,
+        win_probability REAL,
+        document TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS battles_timestamp ON battles (timestamp DESC, battle_id DESC)",
+    "CREATE INDEX IF NOT EXISTS battles_scenario_timestamp ON battles (scenario, timestamp DESC, battle_id DESC)",
+    "CREATE INDEX IF NOT EXISTS battles_win_probability ON battles (win_probability)",
+    f"""CREATE TABLE IF NOT EXISTS battle_rollups (
+        id TEXT PRIMARY KEY,
+        scenario TEXT,
+        granularity TEXT NOT NULL,
+        bucket TEXT NOT NULL,
+        {", ".join(f"{column} NUMERIC NOT NULL DEFAULT 0" for column in ROLLUP_COLUMNS)}
+    )""",
+    "CREATE INDEX IF NOT EXISTS battle_rollups_bucket ON battle_rollups (granularity, bucket)",
+    "CREATE INDEX IF NOT EXISTS battle_rollups_scenario_bucket ON battle_rollups (granularity, scenario, bucket)"
+]
+
+# Rollup upsert: a new bucket row, or the increments added to the existing one
+ROLLUP_UPSERT = (
+    f"INSERT INTO battle_rollups (id, scenario, granularity, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * (len(ROLLUP_COLUMNS) + 4))}) "
+    f"ON CONFLICT(id) DO UPDATE SET {', '.join(f'{c} = {c} + excluded.{c}' for c in ROLLUP_COLUMNS)}"
+)
+
+# Bucket prefix of the stored timestamp text, per granularity
+BUCKET_PREFIX = {"hour": (13, ":00:00.000000"), "day": (10, "T00:00:00.000000")}
+
+def _history_where(filters, position=None, newest_first=True):
+    """SQL WHERE clause and parameters equivalent to build_history_filter"""
+    clauses = []
+    params = []
+    if filters.get("scenario"):
+        clauses.append("scenario = ?")
+        params.append(filters["scenario"])
+    if filters.get("since"):
+        clauses.append("timestamp >= ?")
+        params.append(_sql_time(filters["since"]))
+    if filters.get("until"):
+        clauses.append("timestamp < ?")
+        params.append(_sql_time(filters["until"]))
+    if filters.get("min_win_probability") is not None:
+        clauses.append("win_probability >= ?")
+        params.append(filters["min_win_probability"])
+    if filters.get("max_win_probability") is not None:
+        clauses.append("win_probability <= ?")
+        params.append(filters["max_win_probability"])
+    if position is not None:
+        timestamp, battle_id = position
+        op = "<" if newest_first else ">"
+        clauses.append(f"(timestamp {op} ? OR (timestamp = ? AND battle_id {op} ?))")
+        params += [_sql_time(timestamp), _sql_time(timestamp), battle_id]
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+def _load_document(text):
+    document = json.loads(text)
+    document["timestamp"] = datetime.fromisoformat(document["timestamp"])
+    return document
+
+class SQLiteBattleStore:
+    """Battles in an embedded SQLite database file in WAL mode
+
+    Writes go through one connection and reads through another, so in WAL mode a
+    history read never waits on a batch being written. Every call runs in a thread to
+    keep the event loop free.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path=BATTLE_SQLITE_PATH):
+        self.path = path
+        self.state = "stopped"
+        self.last_error = None
+        self._writer = None
+        self._reader = None
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.state == "open"
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self.path, timeout=BATTLE_SQLITE_BUSY_TIMEOUT_MS / 1000, check_same_thread=False, isolation_level=None
+        )
+        connection.execute("PRAGMA journal_mode=WAL")
+        # Safe with WAL: a power loss can only lose the last transactions, never corrupt the file
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def start(self):
+        """Open (creating if needed) the database file"""
+        if self.available:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._writer = self._connect()
+            for statement in SQLITE_SCHEMA:
+                self._writer.execute(statement)
+            self._reader = self._connect()
+            self.state = "open"
+            self.last_error = None
+            print(f"SQLite battle store opened at {self.path}")
+        except Exception as e:
+            print(f"SQLite battle store not available: {e}")
+            self.state = "failed"
+            self.last_error = str(e)
+
+    async def close(self):
+        for connection in (self._writer, self._reader):
+            if connection is not None:
+                connection.close()
+        self._writer = self._reader = None
+        self.state = "stopped"
+
+    def status(self):
+        return {"backend": self.name, "state": self.state, "path": self.path, "last_error": self.last_error}
+
+    def _write(self, statement, rows, clear=None):
+        """Run an executemany (after an optional DELETE) as one transaction"""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                if clear:
+                    self._writer.execute(clear)
+                self._writer.executemany(statement, rows)
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+
+    def _insert(self, statement, rows):
+        """Run an INSERT OR IGNORE row by row as one transaction; returns the indices of ignored rows"""
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                ignored = [i for i, row in enumerate(rows) if self._writer.execute(statement, row).rowcount == 0]
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+        return ignored
+
+    def _read(self, statement, params):
+        with self._read_lock:
+            return self._reader.execute(statement, params).fetchall()
+
+    async def insert_many(self, records, ordered=False):
+        """Insert a batch of stored records in one transaction; a battle_id already stored is skipped
+
+        Skipped records are reported the way MongoDB reports duplicate keys, a BulkWriteError
+        raised after the rest of the batch is stored, so the writer leaves them out of the rollups.
+        """
+        rows = [
+            (
+                record["battle_id"],
+                _sql_time(record["timestamp"]),
+                record.get("scenario"),
+                record["result"]["win_probability"],
+                json.dumps({
+                    **{key: value for key, value in record.items() if key != "_id"},
+                    "timestamp": record["timestamp"].isoformat()
+                })
+            )
+            for record in records
+        ]
+        ignored = await asyncio.to_thread(
+            self._insert,
+            "INSERT OR IGNORE INTO battles (battle_id, timestamp, scenario, win_probability, document) "
+            "VALUES (?, ?, ?, ?, ?)",
+            rows
+        )
+        if ignored:
+            raise BulkWriteError({
+                "writeErrors": [
+                    {"index": i, "code": 11000, "errmsg": f"duplicate battle_id {rows[i][0]}"} for i in ignored
+                ],
+                "nInserted": len(rows) - len(ignored)
+            })
+
+    async def apply_rollups(self, records):
+        rows = [
+            (rollup_id(scenario, granularity, bucket), scenario, granularity, _sql_time(bucket),
+             *(counters[counter] for counter in ROLLUP_COUNTERS))
+            for (scenario, granularity, bucket), counters in rollup_increments(records).items()
+        ]
+        if rows:
+            await asyncio.to_thread(self._write, ROLLUP_UPSERT, rows)
+
+    async def recent_battles(self, filters, cursor=None, fields=None, limit=10):
+        """Newest first page of stored battles; cursor resumes after a previous page"""
+        position = decode_cursor(cursor) if cursor else None
+        where, params = _history_where(filters, position)
+        rows = await asyncio.to_thread(
+            self._read,
+            f"SELECT document FROM battles{where} ORDER BY timestamp DESC, battle_id DESC LIMIT ?",
+            params + [limit]
+        )
+        return [_load_document(text) for (text,) in rows]
+
+    async def iter_battles(self, filters, fields=None, batch_size=1000):
+        """Every matching stored battle, oldest first, fetched batch_size at a time"""
+        position = None
+        while True:
+            where, params = _history_where(filters, position, newest_first=False)
+            rows = await asyncio.to_thread(
+                self._read,
+                f"SELECT document FROM battles{where} ORDER BY timestamp, battle_id LIMIT ?",
+                params + [batch_size]
+            )
+            for (text,) in rows:
+                battle = _load_document(text)
+                yield battle
+            if len(rows) < batch_size:
+                return
+            position = (battle["timestamp"], battle["battle_id"])
+
+    async def read_rollups(self, granularity, scenario=None, since=None, until=None, limit=1000):
+        """Rollup documents of one granularity, oldest bucket first, shaped like the MongoDB ones"""
+        clauses = ["granularity = ?"]
+        params = [granularity]
+        if scenario:
+            clauses.append("scenario = ?")
+            params.append(scenario)
+        if since:
+            clauses.append("bucket >= ?")
+            params.append(_sql_time(since))
+        if until:
+            clauses.append("bucket < ?")
+            params.append(_sql_time(until))
+        rows = await asyncio.to_thread(
+            self._read,
+            f"SELECT scenario, granularity, bucket, {', '.join(ROLLUP_COLUMNS)} FROM battle_rollups "
+            f"WHERE {' AND '.join(clauses)} ORDER BY bucket, scenario LIMIT ?",
+            params + [limit]
+        )
+        rollups = []
+        for scenario, granularity, bucket, *values in rows:
+            counters = dict(zip(ROLLUP_COLUMNS, values))
+            rollups.append({
+                "scenario": scenario,
+                "granularity": granularity,
+                "bucket": datetime.fromisoformat(bucket),
+                "battles": counters["battles"],
+                "wins": counters["wins"],
+                "win_probability_sum": counters["win_probability_sum"],
+                "player_losses": {unit_type: counters[f"player_losses_{unit_type}"] for unit_type in UNIT_TYPES},
+                "enemy_losses": {unit_type: counters[f"enemy_losses_{unit_type}"] for unit_type in UNIT_TYPES}
+            })
+        return rollups
+
+    def _replace_rollups(self, statements):
+        """Clear the rollups and run the INSERT ... SELECT statements as one transaction
+
+        Reading the battles inside the write transaction means no batch can be stored
+        between the read and the replace. Returns the number of rollup rows inserted.
+        """
+        with self._write_lock:
+            self._writer.execute("BEGIN IMMEDIATE")
+            try:
+                self._writer.execute("DELETE FROM battle_rollups")
+                inserted = sum(self._writer.execute(statement).rowcount for statement in statements)
+                self._writer.execute("COMMIT")
+            except BaseException:
+                self._writer.execute("ROLLBACK")
+                raise
+        return inserted
+
+    async def rebuild_rollups(self):
+        """Recompute every rollup from scratch with GROUP BY queries; returns the rollup count"""
+        losses = ", ".join(
+            f"SUM(json_extract(document, '$.result.losses[{i}]'))" for i in range(2 * len(UNIT_TYPES))
+        )
+        statements = []
+        for granularity in ROLLUP_GRANULARITIES:
+            length, suffix = BUCKET_PREFIX[granularity]
+            bucket = f"substr(timestamp, 1, {length}) || '{suffix}'"
+            # Same id as rollup_id: the bucket's isoformat(), which has no microseconds
+            statements.append(
+                f"INSERT INTO battle_rollups (id, scenario, granularity, bucket, {', '.join(ROLLUP_COLUMNS)}) "
+                f"SELECT '{granularity}:' || scenario || ':' || substr({bucket}, 1, 19), scenario, "
+                f"'{granularity}', {bucket} AS bucket_start, COUNT(*), SUM(win_probability >= 0.5), "
+                f"SUM(win_probability), {losses} FROM battles GROUP BY scenario, bucket_start"
+            )
+        return await asyncio.to_thread(self._replace_rollups, statements)
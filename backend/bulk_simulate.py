@@ -0,0 +1,211 @@
+"""Offline bulk battle simulation from CSV or Parquet
+
+Each input row is one matchup. Unit counts and bonuses are given per side, as
+player_<field> and enemy_<field> columns, where a field is a unit type (infantry,
+ranged, cavalry, siege) or a bonus (research_attack, research_defense, research_hp,
+army_attack, army_defense, army_hp). Missing bonus columns count as 0. Every other
+input column is copied through to the output unchanged.
+
+Rows are read, simulated and written one chunk at a time, so memory use does not
+grow with the input. No server or MongoDB is needed:
+
+    python3 backend/bulk_simulate.py matchups.csv results.parquet --workers 0
+"""
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import typer
+
+from battle_engine import UNIT_TYPES, BONUS_FIELDS, simulate_battles, reload_unit_stats
+
+SIDES = ("player", "enemy")
+
+def _is_parquet(path):
+    return path.endswith((".parquet", ".pq"))
+
+def read_chunks(path, chunk_size):
+    """Yield DataFrames of at most chunk_size rows from a CSV or Parquet file"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pandas()
+    else:
+        # round_trip parsing reads back exactly the floats that were written
+        yield from pd.read_csv(path, chunksize=chunk_size, float_precision="round_trip")
+
+def count_rows(path):
+    """Row count from Parquet metadata, or None for CSV (which would need a full pass)"""
+    if _is_parquet(path):
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    return None
+
+class ChunkWriter:
+    """Append encoded result chunks to a CSV or Parquet file
+
+    Parquet output keeps the schema of the first chunk; later chunks are cast to it, so a
+    column whose type pandas inferred differently in one chunk does not end the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.csv = not _is_parquet(path)
+        self.file = None
+        self.schema = None
+
+    def write(self, encoded):
+        if self.csv:
+            if self.file is None:
+                self.file = open(self.path, "w", newline="")
+            self.file.write(encoded)
+        else:
+            import pyarrow.parquet as pq
+            if self.file is None:
+                self.schema = encoded.schema
+                self.file = pq.ParquetWriter(self.path, self.schema)
+            elif not encoded.schema.equals(self.schema):
+                # Raises ArrowInvalid (a ValueError) if a column cannot take the first chunk's type
+                encoded = encoded.cast(self.schema)
+            self.file.write_table(encoded)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+def check_columns(frame):
+    """Raise ValueError if a unit count column is missing"""
+    missing = [f"{side}_{unit_type}" for side in SIDES for unit_type in UNIT_TYPES
+               if f"{side}_{unit_type}" not in frame.columns]
+    if missing:
+        raise ValueError(f"Missing input columns: {', '.join(missing)}")
+
+def _side_arrays(frame, side):
+    """(N x 4) counts and (N x 6) bonuses for one side of a chunk"""
+    counts = frame[[f"{side}_{unit_type}" for unit_type in UNIT_TYPES]].fillna(0).to_numpy(dtype=np.int64)
+    bonuses = np.zeros((len(frame), len(BONUS_FIELDS)))
+    for i, field in enumerate(BONUS_FIELDS):
+        column = f"{side}_{field}"
+        if column in frame.columns:
+            bonuses[:, i] = frame[column].fillna(0).to_numpy(dtype=np.float64)
+    return counts, bonuses
+
+def simulate_chunk(frame):
+    """Input chunk plus result columns, with the same numbers simulate_battle gives"""
+    player_counts, player_bonuses = _side_arrays(frame, "player")
+    enemy_counts, enemy_bonuses = _side_arrays(frame, "enemy")
+    outcome = simulate_battles(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+
+    result = frame.reset_index(drop=True)
+    # Write counts and bonuses as simulated: int64 and float64, blanks as 0. A blank cell
+    # would otherwise make pandas read that column as float in this chunk only
+    for side, counts, bonuses in (("player", player_counts, player_bonuses), ("enemy", enemy_counts, enemy_bonuses)):
+        for i, unit_type in enumerate(UNIT_TYPES):
+            result[f"{side}_{unit_type}"] = counts[:, i]
+        for i, field in enumerate(BONUS_FIELDS):
+            if f"{side}_{field}" in result.columns:
+                result[f"{side}_{field}"] = bonuses[:, i]
+    result["win_probability"] = outcome["win_probability"]
+    for i, unit_type in enumerate(UNIT_TYPES):
+        result[f"player_losses_{unit_type}"] = outcome["player_losses"][:, i]
+    for i, unit_type in enumerate(UNIT_TYPES):
+        result[f"enemy_losses_{unit_type}"] = outcome["enemy_losses"][:, i]
+    result["player_power"] = outcome["player_power"]
+    result["enemy_power"] = outcome["enemy_power"]
+    result["type_advantage"] = outcome["type_advantage"]
+    return result
+
+def encode_chunk(frame, csv, header):
+    """Simulate a chunk and encode it for the writer: CSV text or an Arrow table
+
+    Encoding happens here rather than in the writer so it is spread across workers too.
+    """
+    result = simulate_chunk(frame)
+    if csv:
+        return result.to_csv(index=False, header=header)
+    import pyarrow as pa
+    return pa.Table.from_pandas(result, preserve_index=False)
+
+def _report(done, total, start):
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else 0.0
+    progress = f"{done:,}/{total:,} ({done / total:.0%})" if total else f"{done:,}"
+    typer.echo(f"\r{progress} battles  {rate:,.0f} battles/s  {elapsed:.1f}s", err=True, nl=False)
+
+def _checked(chunks):
+    """Pass chunks through, failing on the first one without the unit count columns"""
+    for chunk in chunks:
+        check_columns(chunk)
+        yield chunk
+
+def _encoded_chunks(chunks, csv):
+    """(rows, encoded result) per chunk, in input order"""
+    for i, chunk in enumerate(_checked(chunks)):
+        yield len(chunk), encode_chunk(chunk, csv, i == 0)
+
+def _pooled_chunks(pool, chunks, csv, workers):
+    """Same as _encoded_chunks, spread across the pool
+
+    At most two chunks per worker are in flight, which keeps memory bounded.
+    """
+    pending = deque()
+    for i, chunk in enumerate(_checked(chunks)):
+        pending.append((len(chunk), pool.submit(encode_chunk, chunk, csv, i == 0)))
+        if len(pending) >= workers * 2:
+            rows, future = pending.popleft()
+            yield rows, future.result()
+    while pending:
+        rows, future = pending.popleft()
+        yield rows, future.result()
+
+def main(
+    input_path: str = typer.Argument(..., help="CSV or Parquet file of matchups"),
+    output_path: str = typer.Argument(..., help="CSV or Parquet file to write results to"),
+    chunk_size: int = typer.Option(100_000, help="rows read and simulated at a time"),
+    workers: int = typer.Option(1, help="worker processes; 0 uses one per CPU"),
+    unit_stats: str = typer.Option(None, help="JSON or YAML unit stats file to simulate with"),
+    quiet: bool = typer.Option(False, help="no progress readout")
+):
+    """Simulate every matchup in a file through the battle engine"""
+    if chunk_size < 1:
+        raise typer.BadParameter("chunk_size must be at least 1")
+    if unit_stats:
+        reload_unit_stats(unit_stats)
+    workers = workers or os.cpu_count() or 1
+
+    total = count_rows(input_path)
+    writer = ChunkWriter(output_path)
+    done = 0
+    start = time.perf_counter()
+    pool = None
+    try:
+        chunks = read_chunks(input_path, chunk_size)
+        if workers == 1:
+            results = _encoded_chunks(chunks, writer.csv)
+        else:
+            initializer = reload_unit_stats if unit_stats else None
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                                       initargs=(unit_stats,) if unit_stats else ())
+            results = _pooled_chunks(pool, chunks, writer.csv, workers)
+
+        for rows, encoded in results:
+            writer.write(encoded)
+            done += rows
+            if not quiet:
+                _report(done, total, start)
+    except ValueError as e:
+        typer.echo(f"\n❌ {e}", err=True)
+        raise typer.Exit(code=1)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    typer.echo(f"\n✅ {done:,} battles in {elapsed:.1f}s -> {output_path}", err=True)
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,111 @@
+import asyncio
+import os
+import random
+from datetime import datetime
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+# Connection pool bounds for each server process
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', '0'))
+
+# How long a single operation may wait to find a usable server
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', '2000'))
+
+# Reconnect delay doubles from the first value up to the cap while MongoDB is down
+MONGO_RETRY_INITIAL_MS = int(os.environ.get('MONGO_RETRY_INITIAL_MS', '500'))
+MONGO_RETRY_MAX_MS = int(os.environ.get('MONGO_RETRY_MAX_MS', '30000'))
+
+# How often a connected database is pinged, so outages are noticed without a failed request
+MONGO_HEALTH_CHECK_MS = int(os.environ.get('MONGO_HEALTH_CHECK_MS', '5000'))
+
+class Database:
+    """MongoDB connection opened in the background and re-established whenever it is lost
+
+    Nothing here blocks startup: start() returns at once, and callers check `available`
+    before using the database.
+    """
+
+    def __init__(self, url, name, on_connect=None):
+        self.url = url
+        self.name = name
+        # Awaited with the database on every (re)connect, e.g. to create indexes
+        self.on_connect = on_connect
+        self.client = None
+        self.db = None
+        self.state = "stopped"
+        self.last_error = None
+        self.connected_since = None
+        self.connects = 0
+        self.retry_delay = MONGO_RETRY_INITIAL_MS / 1000
+        self._task = None
+
+    @property
+    def available(self):
+        return self.state == "connected"
+
+    def collection(self, name):
+        """Collection handle, or None before start()"""
+        return self.db[name] if self.db is not None else None
+
+    def start(self):
+        """Create the client and start connecting in the background"""
+        if self._task is not None:
+            return
+        self.client = AsyncIOMotorClient(
+            self.url,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS
+        )
+        self.db = self.client[self.name]
+        self.state = "connecting"
+        self._task = asyncio.create_task(self._monitor())
+
+    async def _monitor(self):
+        while True:
+            try:
+                await self.client.admin.command("ping")
+                if not self.available:
+                    if self.on_connect:
+                        await self.on_connect(self.db)
+                    self.state = "connected"
+                    self.connected_since = datetime.now()
+                    self.connects += 1
+                    self.last_error = None
+                    print("MongoDB connected successfully")
+                self.retry_delay = MONGO_RETRY_INITIAL_MS / 1000
+                await asyncio.sleep(MONGO_HEALTH_CHECK_MS / 1000)
+            except Exception as e:
+                if self.state != "disconnected":
+                    print(f"MongoDB not available: {e}")
+                    print("Running without database persistence until it is reachable")
+                self.state = "disconnected"
+                self.connected_since = None
+                self.last_error = str(e)
+                # Jitter keeps many workers from retrying in lockstep
+                await asyncio.sleep(self.retry_delay * random.uniform(0.8, 1.2))
+                self.retry_delay = min(self.retry_delay * 2, MONGO_RETRY_MAX_MS / 1000)
+
+    async def close(self):
+        """Stop reconnecting and close the client"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.client is not None:
+            self.client.close()
+        self.state = "stopped"
+
+    def status(self):
+        return {
+            "state": self.state,
+            "connected_since": self.connected_since.isoformat() if self.connected_since else None,
+            "connects": self.connects,
+            "last_error": self.last_error,
+            "retry_delay_s": round(self.retry_delay, 3) if self.state == "disconnected" else None,
+            "max_pool_size": MONGO_MAX_POOL_SIZE
+        }
@@ -0,0 +1,104 @@
+import base64
+import json
+from datetime import datetime
+
+from battle_records import stored_fields
+
+# Top-level battle document fields a client may project on (dotted sub-paths are allowed too)
+HISTORY_FIELDS = {"battle_id", "timestamp", "scenario", "player_army", "enemy_army", "result"}
+
+# Projection used by list views that only need a one-line summary per battle
+HISTORY_SUMMARY_FIELDS = [
+    "battle_id",
+    "timestamp",
+    "scenario",
+    "result.win_probability",
+    "result.confidence_level",
+    "result.recommendation"
+]
+
+# Indexes backing history sorting, keyset pagination and filters
+BATTLE_INDEXES = [
+    [("timestamp", -1), ("battle_id", -1)],
+    [("scenario", 1), ("timestamp", -1), ("battle_id", -1)],
+    [("result.win_probability", 1)],
+    [("battle_id", 1)]
+]
+
+# Sort order shared by every history read; battle_id breaks timestamp ties
+HISTORY_SORT = [("timestamp", -1), ("battle_id", -1)]
+
+# Exports run oldest first so a `since` pull can resume from the last timestamp it saw
+EXPORT_SORT = [("timestamp", 1), ("battle_id", 1)]
+
+def encode_cursor(battle: dict):
+    """Opaque token pointing just past the given battle in history order"""
+    position = {"t": battle["timestamp"].isoformat(), "id": battle["battle_id"]}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(token: str):
+    """Inverse of encode_cursor; raises ValueError on a malformed token"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(token.encode()))
+        return datetime.fromisoformat(position["t"]), str(position["id"])
+    except Exception:
+        raise ValueError("Invalid history cursor")
+
+def build_history_filter(scenario=None, since=None, until=None, min_win_probability=None,
+                         max_win_probability=None, cursor=None):
+    """MongoDB filter for history reads"""
+    clauses = []
+    if scenario:
+        clauses.append({"scenario": scenario})
+    if since or until:
+        timestamp = {}
+        if since:
+            timestamp["$gte"] = since
+        if until:
+            timestamp["$lt"] = until
+        clauses.append({"timestamp": timestamp})
+    if min_win_probability is not None or max_win_probability is not None:
+        win_probability = {}
+        if min_win_probability is not None:
+            win_probability["$gte"] = min_win_probability
+        if max_win_probability is not None:
+            win_probability["$lte"] = max_win_probability
+        clauses.append({"result.win_probability": win_probability})
+    if cursor:
+        timestamp, battle_id = decode_cursor(cursor)
+        clauses.append({"$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "battle_id": {"$lt": battle_id}}
+        ]})
+    if not clauses:
+        return {}
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+def history_field_names(fields=None):
+    """Decoded fields a history read returns: for a comma-separated list or "summary", None for everything"""
+    if not fields:
+        return None
+    if fields == "summary":
+        names = list(HISTORY_SUMMARY_FIELDS)
+    else:
+        names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name.split(".")[0] not in HISTORY_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown history fields: {', '.join(unknown)}")
+    # The cursor needs timestamp and battle_id on every row
+    return names + [name for name in ("timestamp", "battle_id") if name not in names]
+
+def build_history_projection(fields=None):
+    """Projection for a comma-separated field list, "summary", or None for whole documents
+
+    Stored battles may be in the compact layout, where a dotted field cannot be projected
+    on its own, so whole top-level fields are read and trimmed after decoding.
+    """
+    names = history_field_names(fields)
+    if names is None:
+        return {"_id": 0}
+    projection = {name: 1 for name in stored_fields(names)}
+    projection["_id"] = 0
+    return projection
@@ -0,0 +1,168 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Histogram buckets in seconds, from sub-millisecond engine calls to slow optimizer searches
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# The sampling profiler endpoint must be switched on explicitly
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() in ("1", "true", "yes")
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in pairs]
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+def _format_value(value):
+    """Sample value as Prometheus expects it: a float, +Inf, -Inf or NaN (booleans become 1 and 0)"""
+    value = float(value)
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(value)
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in sorted(self.values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+class Gauge(Counter):
+    """Value that can go up and down"""
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            self.values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus exposition layout"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labels)
+        with self._lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[len(self.buckets)] += 1
+            state[-1] += value
+
+    def samples(self):
+        for key, state in sorted(self.values.items()):
+            for i, bound in enumerate(self.buckets):
+                yield f"{self.name}_bucket", _format_labels(self.labels, key, ("le", repr(bound))), state[i]
+            yield f"{self.name}_bucket", _format_labels(self.labels, key, ("le", "+Inf")), state[len(self.buckets)]
+            yield f"{self.name}_sum", _format_labels(self.labels, key), state[-1]
+            yield f"{self.name}_count", _format_labels(self.labels, key), state[len(self.buckets)]
+
+REQUEST_DURATION = Histogram(
+    "lords_http_request_duration_seconds", "HTTP request latency by endpoint", ["method", "endpoint", "status"]
+)
+STAGE_DURATION = Histogram(
+    "lords_stage_duration_seconds", "Time spent in each stage of request handling", ["endpoint", "stage"]
+)
+REQUEST_ERRORS = Counter(
+    "lords_http_request_errors_total", "Requests that ended in a 5xx response", ["method", "endpoint"]
+)
+DB_FALLBACKS = Counter(
+    "lords_db_fallbacks_total", "Operations that skipped the database because it was unavailable", ["operation"]
+)
+IN_FLIGHT = Gauge("lords_http_requests_in_flight", "Requests currently being handled")
+STATUS = Gauge("lords_component_status", "Point-in-time values reported by server components", ["component", "field"])
+
+REGISTRY = [REQUEST_DURATION, STAGE_DURATION, REQUEST_ERRORS, DB_FALLBACKS, IN_FLIGHT, STATUS]
+
+# When the current request entered the middleware, and which endpoint it hit
+request_started = ContextVar("request_started", default=None)
+request_endpoint = ContextVar("request_endpoint", default="background")
+
+@contextmanager
+def stage_timer(stage):
+    """Record how long the wrapped block takes as one stage of the current request"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, endpoint=request_endpoint.get(), stage=stage)
+
+def mark_handler_entry():
+    """Record request parsing and validation time, i.e. middleware entry up to the handler body"""
+    started = request_started.get()
+    if started is not None:
+        STAGE_DURATION.observe(time.perf_counter() - started, endpoint=request_endpoint.get(), stage="validation")
+
+def render_metrics():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def sample_stacks(duration, interval=0.001):
+    """Sample the stacks of every other thread for `duration` seconds
+
+    Returns collapsed stacks ("outer;inner count" per line), the input format of flamegraph tools.
+    Work running in worker processes is not visible here.
+    """
+    me = threading.get_ident()
+    stacks = StackCounter()
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == me:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return "\n".join(f"{stack} {count}" for stack, count in stacks.most_common()) + "\n"
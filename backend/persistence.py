@@ -0,0 +1,130 @@
+import asyncio
+import inspect
+import os
+from contextlib import asynccontextmanager
+
+from metrics import stage_timer
+
+# Flush once this many battle records are buffered
+BATTLE_WRITE_BATCH_SIZE = int(os.environ.get('BATTLE_WRITE_BATCH_SIZE', '100'))
+
+# Flush at least this often while records are waiting
+BATTLE_WRITE_FLUSH_MS = int(os.environ.get('BATTLE_WRITE_FLUSH_MS', '1000'))
+
+# Records beyond this many (e.g. while the database is down) drop the oldest first
+BATTLE_WRITE_MAX_BUFFER = int(os.environ.get('BATTLE_WRITE_MAX_BUFFER', '10000'))
+
+class BufferedBattleWriter:
+    """Collect battle records and write them with insert_many on a size or time threshold
+
+    The collection only needs an insert_many method; it may be a motor collection or any
+    synchronous stand-in such as mongomock. on_written, if given, is awaited with the
+    records of every batch that were inserted.
+    """
+
+    def __init__(self, collection, batch_size=BATTLE_WRITE_BATCH_SIZE, flush_ms=BATTLE_WRITE_FLUSH_MS,
+                 max_buffer=BATTLE_WRITE_MAX_BUFFER, on_written=None):
+        self.collection = collection
+        self.on_written = on_written
+        self.batch_size = batch_size
+        self.flush_interval = flush_ms / 1000
+        self.max_buffer = max_buffer
+        self.buffer = []
+        self.written = 0
+        self.dropped = 0
+        self.failed_flushes = 0
+        self._flush_lock = asyncio.Lock()
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def start(self):
+        """Start the background flush loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def add(self, record: dict):
+        """Queue a record; never waits on the database"""
+        self.buffer.append(record)
+        if len(self.buffer) > self.max_buffer:
+            overflow = len(self.buffer) - self.max_buffer
+            del self.buffer[:overflow]
+            self.dropped += overflow
+        if len(self.buffer) >= self.batch_size:
+            self._wake.set()
+
+    async def flush(self):
+        """Write every buffered record"""
+        async with self._flush_lock:
+            await self._write_buffer()
+
+    @asynccontextmanager
+    async def paused(self):
+        """Write every buffered record, then hold off further writes until the block exits
+
+        Records added meanwhile stay buffered, so work that must not interleave with
+        writes (such as rebuilding rollups from the stored battles) runs inside it.
+        """
+        async with self._flush_lock:
+            await self._write_buffer()
+            yield
+
+    async def _write_buffer(self):
+        """Write the buffer in batches; callers hold the flush lock"""
+        while self.buffer:
+            records = self.buffer[:self.batch_size]
+            del self.buffer[:len(records)]
+            stored = records
+            try:
+                with stage_timer("db_flush"):
+                    result = self.collection.insert_many(records, ordered=False)
+                    if inspect.isawaitable(result):
+                        await result
+                self.written += len(records)
+            except Exception as e:
+                details = getattr(e, "details", None)
+                if not (isinstance(details, dict) and "nInserted" in details):
+                    # Put the batch back so the next flush retries it
+                    print(f"Battle write batch failed: {e}")
+                    self.failed_flushes += 1
+                    self.buffer[:0] = records
+                    return
+                # Per-document errors: the rest of the batch landed, so retrying would duplicate it
+                print(f"Battle write batch partially failed: {e}")
+                failed = {error["index"] for error in details.get("writeErrors", [])}
+                stored = [record for i, record in enumerate(records) if i not in failed]
+                self.written += details["nInserted"]
+                self.dropped += len(records) - details["nInserted"]
+            if self.on_written and stored:
+                try:
+                    await self.on_written(stored)
+                except Exception as e:
+                    # The battles are stored; only the derived data missed this batch
+                    print(f"Battle write follow-up failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def close(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "buffered": len(self.buffer),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed_flushes
+        }
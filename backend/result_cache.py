@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+# Cache settings for repeated battle simulations
+BATTLE_CACHE_ENABLED = os.environ.get('BATTLE_CACHE_ENABLED', 'true').lower() in ("1", "true", "yes")
+BATTLE_CACHE_SIZE = int(os.environ.get('BATTLE_CACHE_SIZE', '10000'))
+BATTLE_CACHE_TTL_S = float(os.environ.get('BATTLE_CACHE_TTL_S', '300'))
+
+def canonical_key(*parts):
+    """Hash JSON-serializable parts into a stable cache key"""
+    payload = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class TTLCache:
+    """Bounded LRU cache whose entries also expire after ttl_seconds"""
+
+    def __init__(self, max_entries=BATTLE_CACHE_SIZE, ttl_seconds=BATTLE_CACHE_TTL_S, enabled=BATTLE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled or key is None:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if not self.enabled or key is None or self.max_entries <= 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "size": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+class SingleFlight:
+    """Let concurrent callers with the same key share one in-flight computation
+
+    Only calls that overlap in time are merged; finished results are not kept (that is
+    what TTLCache is for).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args):
+        """Return await fn(*args), or the result of an identical call already running; None keys never merge"""
+        if key is None:
+            return await fn(*args)
+        task = self._calls.get(key)
+        if task is None:
+            # The computation is its own task, so it finishes even if the caller that started it is cancelled
+            task = asyncio.ensure_future(fn(*args))
+            self._calls[key] = task
+            self.executed += 1
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        # A caller giving up, the first one included, must not cancel the computation the others are waiting on
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # Mark the exception retrieved so it is not logged again when every caller has gone
+            task.exception()
+
+    def stats(self):
+        calls = self.executed + self.coalesced
+        return {
+            "in_flight": len(self._calls),
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+            "coalesced_rate": round(self.coalesced / calls, 4) if calls else 0.0
+        }
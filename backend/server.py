@@ -1,35 +1,120 @@
-from fastapi import FastAPI, HTTPException, Request
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 from typing import Optional, List, Dict
 import os
-from pymongo import MongoClient
+import asyncio
+import json
+import zlib
 import uuid
 from datetime import datetime
+from contextlib import asynccontextmanager
 import math
+import time
+from functools import partial
+from battle_engine import (
+    UNIT_TYPES, BONUS_FIELDS, LANCHESTER_MAX_ROUNDS, simulate_battles, monte_carlo_battle, optimize_composition,
+    optimize_composition_steps,
+    lanchester_battles, tournament_matrix, sensitivity_report,
+    get_unit_tables, reload_unit_stats
+)
+from worker_pool import POOL_MIN_BATCH, run_in_pool, run_chunked, stream_in_pool, shutdown_pool, recycle_pool
+from battle_store import BATTLE_SQLITE_PATH, MongoBattleStore, SQLiteBattleStore
+from persistence import BufferedBattleWriter
+from result_cache import TTLCache, SingleFlight, canonical_key
+from metrics import (
+    REQUEST_DURATION, REQUEST_ERRORS, DB_FALLBACKS, IN_FLIGHT, STATUS, PROFILING_ENABLED,
+    request_started, request_endpoint, stage_timer, mark_handler_entry, render_metrics, sample_stacks
+)
+from win_surface import WinSurface
+from analytics import ROLLUP_GRANULARITIES, summarize_rollup, combine_rollups
+from battle_records import BATTLE_SCHEMA_VERSION, BattleMigration, encode_battle, decode_battle, select_fields
+from history_query import encode_cursor, decode_cursor, history_field_names
 
 # Database setup
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
 
-# Try to connect to MongoDB, but don't fail if it's not available
-try:
-    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)
-    # Test the connection
-    client.server_info()
-    db = client['lords_mobile_ai']
-    battles_collection = db['battles']
-    strategies_collection = db['strategies']
-    mongo_available = True
-    print("MongoDB connected successfully")
-except Exception as e:
-    print(f"MongoDB not available: {e}")
-    print("Running in test mode without database persistence")
-    mongo_available = False
-    # Create dummy collections for testing
-    battles_collection = None
-    strategies_collection = None
-
-app = FastAPI(title="Lords Mobile AI Assistant")
+# Where battles are stored: "mongo", or "sqlite" for an embedded database file that needs no server
+BATTLE_STORE = os.environ.get('BATTLE_STORE', 'mongo')
+
+# Shared secret for admin endpoints; they are disabled when unset
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+
+# Upper bound on battles accepted by a single batch simulation request
+MAX_BATCH_BATTLES = int(os.environ.get('MAX_BATCH_BATTLES', '10000'))
+
+# Upper bound on armies per side of a tournament, and on matrix cells returned per page
+MAX_TOURNAMENT_ARMIES = int(os.environ.get('MAX_TOURNAMENT_ARMIES', '5000'))
+MAX_TOURNAMENT_CELLS = int(os.environ.get('MAX_TOURNAMENT_CELLS', '250000'))
+
+# Upper bound on Monte Carlo trials for a single simulation request
+MAX_MONTE_CARLO_TRIALS = int(os.environ.get('MAX_MONTE_CARLO_TRIALS', '1000000'))
+
+# Battle engines a request can choose, and the round cap for the Lanchester engine
+BATTLE_ENGINES = ("formula", "lanchester")
+MAX_LANCHESTER_ROUNDS = int(os.environ.get('MAX_LANCHESTER_ROUNDS', '500'))
+
+# Upper bound on the search time budget of a single optimization request
+MAX_OPTIMIZE_MS = int(os.environ.get('MAX_OPTIMIZE_MS', '5000'))
+
+# Upper bound on rollup buckets returned by a single analytics request
+MAX_ANALYTICS_BUCKETS = int(os.environ.get('MAX_ANALYTICS_BUCKETS', '1000'))
+
+# Upper bound on battles returned by a single history page
+MAX_HISTORY_LIMIT = int(os.environ.get('MAX_HISTORY_LIMIT', '100'))
+
+# Default and maximum server-side cursor batch size for history exports
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '1000'))
+MAX_EXPORT_BATCH_SIZE = int(os.environ.get('MAX_EXPORT_BATCH_SIZE', '10000'))
+
+def open_battle_store():
+    """Battle store selected by BATTLE_STORE (not started yet)"""
+    if BATTLE_STORE == "sqlite":
+        return SQLiteBattleStore(BATTLE_SQLITE_PATH)
+    if BATTLE_STORE != "mongo":
+        raise ValueError(f"Unknown BATTLE_STORE: {BATTLE_STORE} (expected mongo or sqlite)")
+    return MongoBattleStore(MONGO_URL, 'lords_mobile_ai')
+
+async def update_battle_rollups(records):
+    """Fold battles that were just written into the analytics rollups"""
+    with stage_timer("rollup_update"):
+        await battle_store.apply_rollups(records)
+
+# Battles and rollups; MongoDB connects in the background at startup and reconnects whenever it drops
+battle_store = open_battle_store()
+
+# Battle records are buffered and written in batches off the request path
+battle_writer = BufferedBattleWriter(None, on_written=update_battle_rollups)
+
+# Rewrites battles stored in the original layout into the compact one, when started by an admin
+battle_migration = BattleMigration()
+
+# Results of recent simulations, keyed on normalized request contents
+battle_cache = TTLCache()
+
+# Identical requests arriving together wait on one computation instead of each running it
+simulate_flights = SingleFlight()
+optimize_flights = SingleFlight()
+
+# Precomputed win-probability surface (memory-mapped); None until one has been built
+win_surface = WinSurface.load()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Don't wait for MongoDB: requests are served while it connects in the background
+    battle_store.start()
+    battle_writer.collection = battle_store
+    battle_writer.start()
+    yield
+    await battle_migration.stop()
+    # Write out buffered battles before the store goes away
+    if battle_store.available:
+        await battle_writer.close()
+    await battle_store.close()
+    shutdown_pool()
+
+app = FastAPI(title="Lords Mobile AI Assistant", lifespan=lifespan)
 
 # CORS configuration - Secure settings
 app.add_middleware(
@@ -52,6 +137,48 @@ async def security_headers(request: Request, call_next):
     response.headers["Content-Security-Policy"] = "default-src 'self'"
     return response
 
+class RequestMetricsMiddleware:
+    """Time every HTTP request and count server errors, labelled by route template
+
+    A plain ASGI middleware: it only wraps send to see the status, so unlike
+    @app.middleware("http") it adds no extra stream layer to each request.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        request_started.set(start)
+        request_endpoint.set(scope["path"])
+        IN_FLIGHT.inc()
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            IN_FLIGHT.dec()
+            # Label by route template so unmatched paths cannot blow up the label set
+            route = scope.get("route")
+            endpoint = route.path if route else "unmatched"
+            REQUEST_DURATION.observe(
+                time.perf_counter() - start, method=scope["method"], endpoint=endpoint, status=str(status)
+            )
+            if status >= 500:
+                REQUEST_ERRORS.inc(method=scope["method"], endpoint=endpoint)
+
+# Request metrics middleware (added last, so it wraps everything else)
+app.add_middleware(RequestMetricsMiddleware)
+
 # Data models
 class UnitComposition(BaseModel):
     infantry: int = 0
@@ -79,6 +206,21 @@ class BattleRequest(BaseModel):
     player_army: Army
     enemy_army: Army
     scenario: str = "field_battle"
+    # Monte Carlo mode: 0 keeps the deterministic simulation
+    trials: int = 0
+    seed: Optional[int] = None
+    # "formula" (power ratio) or "lanchester" (round-by-round attrition)
+    engine: str = "formula"
+    max_rounds: int = LANCHESTER_MAX_ROUNDS
+
+class MonteCarloSummary(BaseModel):
+    trials: int
+    seed: Optional[int] = None
+    win_probability: float
+    confidence_interval: List[float]
+    win_probability_std: float
+    player_loss_distribution: Dict[str, Dict[str, float]]
+    enemy_loss_distribution: Dict[str, Dict[str, float]]
 
 class BattleResult(BaseModel):
     battle_id: str
@@ -88,35 +230,76 @@ class BattleResult(BaseModel):
     recommendation: str
     confidence_level: str
     details: Dict
+    monte_carlo: Optional[MonteCarloSummary] = None
+
+class BatchBattleRequest(BaseModel):
+    battles: List[BattleRequest]
+
+class BatchBattleItem(BaseModel):
+    win_probability: float
+    expected_losses: UnitComposition
+    enemy_losses: UnitComposition
+    recommendation: str
+    confidence_level: str
+    details: Dict
+
+class BatchBattleResult(BaseModel):
+    results: List[BatchBattleItem]
+    battle_count: int
+    elapsed_ms: float
+    battles_per_second: float
+
+class TournamentRequest(BaseModel):
+    armies: List[Army]
+    opponents: Optional[List[Army]] = None  # defaults to the armies themselves
+    row_offset: int = 0
+    row_limit: Optional[int] = None
+
+class TournamentResult(BaseModel):
+    rows: int
+    columns: int
+    row_offset: int
+    row_count: int
+    next_row_offset: Optional[int]
+    # Row-major matrices over (armies[row_offset:row_offset + row_count], opponents)
+    win_probability: List[List[float]]
+    player_losses: List[List[int]]
+    enemy_losses: List[List[int]]
+    elapsed_ms: float
 
-# Unit stats (base values)
-UNIT_STATS = {
-    "infantry": {"attack": 100, "defense": 120, "hp": 800, "strong_vs": "ranged", "weak_vs": "cavalry"},
-    "ranged": {"attack": 110, "defense": 80, "hp": 600, "strong_vs": "cavalry", "weak_vs": "infantry"},
-    "cavalry": {"attack": 130, "defense": 90, "hp": 700, "strong_vs": "infantry", "weak_vs": "ranged"},
-    "siege": {"attack": 200, "defense": 60, "hp": 500, "strong_vs": "wall", "weak_vs": "all"}
-}
+def composition_counts(composition: UnitComposition):
+    """Unit counts in UNIT_TYPES order"""
+    return (composition.infantry, composition.ranged, composition.cavalry, composition.siege)
 
 def calculate_effective_stats(composition: UnitComposition, hero: Optional[Hero], research_attack: float, research_defense: float, research_hp: float):
     """Calculate effective army stats with bonuses"""
+    tables = get_unit_tables()
+    counts = composition_counts(composition)
     total_attack = 0
     total_defense = 0
     total_hp = 0
     
-    for unit_type, count in composition.dict().items():
+    # Bonus multipliers are the same for every unit type
+    research_attack_mult = 1 + research_attack / 100
+    research_defense_mult = 1 + research_defense / 100
+    research_hp_mult = 1 + research_hp / 100
+    if hero:
+        hero_attack_mult = 1 + hero.army_attack / 100
+        hero_defense_mult = 1 + hero.army_defense / 100
+        hero_hp_mult = 1 + hero.army_hp / 100
+    
+    for i, count in enumerate(counts):
         if count > 0:
-            base_stats = UNIT_STATS[unit_type]
-            
             # Apply research bonuses
-            attack = base_stats["attack"] * (1 + research_attack / 100)
-            defense = base_stats["defense"] * (1 + research_defense / 100)
-            hp = base_stats["hp"] * (1 + research_hp / 100)
+            attack = tables.attack[i] * research_attack_mult
+            defense = tables.defense[i] * research_defense_mult
+            hp = tables.hp[i] * research_hp_mult
             
             # Apply hero bonuses
             if hero:
-                attack *= (1 + hero.army_attack / 100)
-                defense *= (1 + hero.army_defense / 100)
-                hp *= (1 + hero.army_hp / 100)
+                attack *= hero_attack_mult
+                defense *= hero_defense_mult
+                hp *= hero_hp_mult
             
             total_attack += attack * count
             total_defense += defense * count
@@ -126,25 +309,24 @@ def calculate_effective_stats(composition: UnitComposition, hero: Optional[Hero]
         "total_attack": total_attack,
         "total_defense": total_defense,
         "total_hp": total_hp,
-        "unit_count": sum(composition.dict().values())
+        "unit_count": sum(counts)
     }
 
 def calculate_type_advantage(player_comp: UnitComposition, enemy_comp: UnitComposition):
     """Calculate type advantage multiplier"""
-    player_units = player_comp.dict()
-    enemy_units = enemy_comp.dict()
+    strong_index = get_unit_tables().strong_index
+    player_units = composition_counts(player_comp)
+    enemy_units = composition_counts(enemy_comp)
     
     advantage_score = 0
     
     # Calculate advantage for each unit type
-    for unit_type, count in player_units.items():
-        if count > 0:
-            strong_vs = UNIT_STATS[unit_type]["strong_vs"]
-            if strong_vs in enemy_units:
-                advantage_score += count * enemy_units[strong_vs] * 0.25
+    for i, count in enumerate(player_units):
+        if count > 0 and strong_index[i] >= 0:
+            advantage_score += count * enemy_units[strong_index[i]] * 0.25
     
-    total_player_units = sum(player_units.values())
-    total_enemy_units = sum(enemy_units.values())
+    total_player_units = sum(player_units)
+    total_enemy_units = sum(enemy_units)
     
     if total_player_units > 0 and total_enemy_units > 0:
         return 1 + (advantage_score / (total_player_units * total_enemy_units))
@@ -173,6 +355,11 @@ def simulate_battle(player_army: Army, enemy_army: Army):
     player_advantage = calculate_type_advantage(player_army.composition, enemy_army.composition)
     enemy_advantage = calculate_type_advantage(enemy_army.composition, player_army.composition)
     
+    return battle_from_stats(player_army, enemy_army, player_stats, enemy_stats, player_advantage, enemy_advantage)
+
+def battle_from_stats(player_army: Army, enemy_army: Army, player_stats: Dict, enemy_stats: Dict,
+                      player_advantage: float, enemy_advantage: float):
+    """Finish simulate_battle from effective stats and type advantages that are already known"""
     # Apply advantages
     effective_player_attack = player_stats["total_attack"] * player_advantage
     effective_enemy_attack = enemy_stats["total_attack"] * enemy_advantage
@@ -221,6 +408,118 @@ def simulate_battle(player_army: Army, enemy_army: Army):
         "type_advantage": player_advantage - enemy_advantage
     }
 
+def merge_patch(base: Dict, patch: Dict):
+    """Apply a partial update to a nested dict; null replaces a value, nested dicts merge"""
+    merged = dict(base)
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = merge_patch(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+class LiveBattleSession:
+    """Both armies of one live what-if session, plus the stats last computed for them"""
+    
+    def __init__(self):
+        self.armies = {"player_army": Army(composition=UnitComposition()), "enemy_army": Army(composition=UnitComposition())}
+        self.stats = {}
+        self.advantages = None
+    
+    def update(self, changes: Dict):
+        """Apply partial army updates and return the parts that had to be recomputed
+        
+        Raises ValidationError or ValueError (leaving the session unchanged) if an updated army is invalid.
+        """
+        updated = {}
+        for side in ("player_army", "enemy_army"):
+            if changes.get(side) is not None:
+                if not isinstance(changes[side], dict):
+                    raise ValueError(f"{side} must be an object")
+                army = Army(**merge_patch(self.armies[side].dict(), changes[side]))
+                if army != self.armies[side]:
+                    updated[side] = army
+        
+        recomputed = []
+        for side, army in updated.items():
+            # Effective stats depend only on the side's own army, type advantage on both compositions
+            if army.composition != self.armies[side].composition:
+                self.advantages = None
+            self.armies[side] = army
+            self.stats[side] = None
+        for side in ("player_army", "enemy_army"):
+            if self.stats.get(side) is None:
+                army = self.armies[side]
+                self.stats[side] = calculate_effective_stats(
+                    army.composition, army.hero, army.research_attack, army.research_defense, army.research_hp
+                )
+                recomputed.append(f"{side}_stats")
+        if self.advantages is None:
+            player, enemy = self.armies["player_army"].composition, self.armies["enemy_army"].composition
+            self.advantages = (calculate_type_advantage(player, enemy), calculate_type_advantage(enemy, player))
+            recomputed.append("type_advantage")
+        return recomputed
+    
+    def result(self):
+        """The same numbers simulate_battle gives for the current armies"""
+        return battle_from_stats(
+            self.armies["player_army"],
+            self.armies["enemy_army"],
+            self.stats["player_army"],
+            self.stats["enemy_army"],
+            *self.advantages
+        )
+
+def armies_to_arrays(armies: List[Army]):
+    """Convert armies into an (N x 4) count matrix and an (N x 6) bonus matrix"""
+    counts = []
+    bonuses = []
+    for army in armies:
+        composition = army.composition
+        hero = army.hero
+        counts.append([composition.infantry, composition.ranged, composition.cavalry, composition.siege])
+        bonuses.append([
+            army.research_attack,
+            army.research_defense,
+            army.research_hp,
+            hero.army_attack if hero else 0.0,
+            hero.army_defense if hero else 0.0,
+            hero.army_hp if hero else 0.0
+        ])
+    return counts, bonuses
+
+def determine_confidence_level(win_prob: float):
+    """Bucket a win probability into a confidence level"""
+    if win_prob >= 0.7 or win_prob <= 0.3:
+        return "High"
+    elif win_prob >= 0.6 or win_prob <= 0.4:
+        return "Medium"
+    return "Low"
+
+def simulate_battle_lanchester(player_army: Army, enemy_army: Army, max_rounds: int = LANCHESTER_MAX_ROUNDS):
+    """Simulate battle outcome round by round"""
+    player_counts, player_bonuses = armies_to_arrays([player_army])
+    enemy_counts, enemy_bonuses = armies_to_arrays([enemy_army])
+    outcome = lanchester_battles(player_counts, player_bonuses, enemy_counts, enemy_bonuses, max_rounds)
+    
+    return {
+        "win_probability": float(outcome["win_probability"][0]),
+        "player_losses": UnitComposition(**dict(zip(UNIT_TYPES, outcome["player_losses"][0].tolist()))),
+        "enemy_losses": UnitComposition(**dict(zip(UNIT_TYPES, outcome["enemy_losses"][0].tolist()))),
+        "player_power": float(outcome["player_power"][0]),
+        "enemy_power": float(outcome["enemy_power"][0]),
+        "type_advantage": float(outcome["type_advantage"][0]),
+        "rounds": int(outcome["rounds"][0]),
+        "player_broken": bool(outcome["player_broken"][0]),
+        "enemy_broken": bool(outcome["enemy_broken"][0])
+    }
+
+async def simulate_battle_monte_carlo(player_army: Army, enemy_army: Army, trials: int, seed: Optional[int] = None):
+    """Simulate a battle as many randomized engagements on the worker pool"""
+    (player_counts,), (player_bonuses,) = armies_to_arrays([player_army])
+    (enemy_counts,), (enemy_bonuses,) = armies_to_arrays([enemy_army])
+    return await run_in_pool(monte_carlo_battle, player_counts, player_bonuses, enemy_counts, enemy_bonuses, trials, seed)
+
 def generate_recommendation(battle_result: Dict, player_army: Army, enemy_army: Army):
     """Generate strategic recommendation"""
     win_prob = battle_result["win_probability"]
@@ -259,89 +558,682 @@ def generate_recommendation(battle_result: Dict, player_army: Army, enemy_army:
 
 @app.get("/api/health")
 async def health_check():
-    return {"status": "healthy", "service": "Lords Mobile AI Assistant"}
+    # The service stays healthy without its battle store; only persistence and history are affected
+    return {
+        "status": "healthy",
+        "service": "Lords Mobile AI Assistant",
+        "database": battle_store.status()
+    }
 
-@app.post("/api/battle/simulate", response_model=BattleResult)
-async def simulate_battle_endpoint(battle_request: BattleRequest):
-    """Simulate battle and provide strategic recommendation"""
-    try:
-        # Run battle simulation
-        battle_result = simulate_battle(battle_request.player_army, battle_request.enemy_army)
-        
-        # Generate recommendation
+async def compute_battle_result(battle_request: BattleRequest):
+    """Run the simulation for a request and return every BattleResult field except battle_id"""
+    # Run battle simulation
+    with stage_timer("simulate_battle"):
+        if battle_request.engine == "lanchester":
+            battle_result = simulate_battle_lanchester(
+                battle_request.player_army,
+                battle_request.enemy_army,
+                battle_request.max_rounds
+            )
+        else:
+            battle_result = simulate_battle(battle_request.player_army, battle_request.enemy_army)
+    
+    # Monte Carlo mode replaces the point estimate with the sampled mean
+    monte_carlo = None
+    if battle_request.trials > 0:
+        with stage_timer("monte_carlo"):
+            mc_result = await simulate_battle_monte_carlo(
+                battle_request.player_army,
+                battle_request.enemy_army,
+                battle_request.trials,
+                battle_request.seed
+            )
+        battle_result["win_probability"] = mc_result["win_probability"]
+        battle_result["player_losses"] = UnitComposition(
+            **dict(zip(UNIT_TYPES, mc_result["mean_player_losses"].astype(int).tolist()))
+        )
+        battle_result["enemy_losses"] = UnitComposition(
+            **dict(zip(UNIT_TYPES, mc_result["mean_enemy_losses"].astype(int).tolist()))
+        )
+        monte_carlo = MonteCarloSummary(
+            trials=mc_result["trials"],
+            seed=battle_request.seed,
+            win_probability=round(mc_result["win_probability"], 4),
+            confidence_interval=[round(bound, 4) for bound in mc_result["confidence_interval"]],
+            win_probability_std=round(mc_result["win_probability_std"], 4),
+            player_loss_distribution=mc_result["player_loss_distribution"],
+            enemy_loss_distribution=mc_result["enemy_loss_distribution"]
+        )
+    
+    # Generate recommendation
+    with stage_timer("generate_recommendation"):
         recommendation = generate_recommendation(
             battle_result, 
             battle_request.player_army, 
             battle_request.enemy_army
         )
-        
-        # Determine confidence level
-        win_prob = battle_result["win_probability"]
-        if win_prob >= 0.7 or win_prob <= 0.3:
-            confidence = "High"
-        elif win_prob >= 0.6 or win_prob <= 0.4:
-            confidence = "Medium"
-        else:
-            confidence = "Low"
-        
-        # Create battle result
+    
+    # Determine confidence level
+    win_prob = battle_result["win_probability"]
+    if monte_carlo:
+        # Confidence comes from the interval bound closest to an even fight
+        lower, upper = mc_result["confidence_interval"]
+        confidence = determine_confidence_level(min(max(0.5, lower), upper))
+    else:
+        confidence = determine_confidence_level(win_prob)
+    
+    details = {
+        "player_power": round(battle_result["player_power"], 2),
+        "enemy_power": round(battle_result["enemy_power"], 2),
+        "type_advantage": round(battle_result["type_advantage"], 3)
+    }
+    if battle_request.engine == "lanchester":
+        details.update({
+            "engine": "lanchester",
+            "rounds": battle_result["rounds"],
+            "player_broken": battle_result["player_broken"],
+            "enemy_broken": battle_result["enemy_broken"]
+        })
+    
+    return {
+        "win_probability": round(win_prob, 3),
+        "expected_losses": battle_result["player_losses"],
+        "enemy_losses": battle_result["enemy_losses"],
+        "recommendation": recommendation,
+        "confidence_level": confidence,
+        "details": details,
+        "monte_carlo": monte_carlo
+    }
+
+def battle_cache_key(battle_request: BattleRequest):
+    """Canonical cache key over the inputs that affect a simulation, or None if it is not cacheable"""
+    # Unseeded Monte Carlo runs are random by design
+    if battle_request.trials > 0 and battle_request.seed is None:
+        return None
+    # Hero names and hero self-bonuses do not enter the battle model, and no hero equals a zero-bonus hero
+    counts, bonuses = armies_to_arrays([battle_request.player_army, battle_request.enemy_army])
+    # Keyed on the balance version too, so no process serves results computed with old unit stats
+    return canonical_key(
+        get_unit_tables().key,
+        counts,
+        [[float(b) for b in row] for row in bonuses],
+        battle_request.scenario,
+        battle_request.trials,
+        battle_request.seed,
+        battle_request.engine,
+        battle_request.max_rounds if battle_request.engine == "lanchester" else None
+    )
+
+def battle_request_error(battle_request: BattleRequest, monte_carlo: bool = True):
+    """Why a battle request cannot be simulated, or None if it can"""
+    if battle_request.trials < 0 or battle_request.trials > MAX_MONTE_CARLO_TRIALS:
+        return f"trials must be between 0 and {MAX_MONTE_CARLO_TRIALS}"
+    if battle_request.seed is not None and battle_request.seed < 0:
+        return "seed must be non-negative"
+    if battle_request.trials > 0 and not monte_carlo:
+        return "Monte Carlo mode is only available from /api/battle/simulate"
+    if battle_request.engine not in BATTLE_ENGINES:
+        return f"engine must be one of: {', '.join(BATTLE_ENGINES)}"
+    if battle_request.engine == "lanchester":
+        if battle_request.max_rounds <= 0 or battle_request.max_rounds > MAX_LANCHESTER_ROUNDS:
+            return f"max_rounds must be between 1 and {MAX_LANCHESTER_ROUNDS}"
+        if battle_request.trials > 0:
+            return "Monte Carlo mode is only available with the formula engine"
+    return None
+
+@app.post("/api/battle/simulate", response_model=BattleResult)
+async def simulate_battle_endpoint(battle_request: BattleRequest):
+    """Simulate battle and provide strategic recommendation"""
+    mark_handler_entry()
+    error = battle_request_error(battle_request)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    try:
+        # Create battle result; cache hits skip the simulation but still get a fresh battle_id
         battle_id = str(uuid.uuid4())
+        with stage_timer("cache_lookup"):
+            cache_key = battle_cache_key(battle_request)
+            fields = battle_cache.get(cache_key)
+        if fields is None:
+            fields = await simulate_flights.run(cache_key, compute_battle_result, battle_request)
+            battle_cache.set(cache_key, fields)
         
-        result = BattleResult(
-            battle_id=battle_id,
-            win_probability=round(win_prob, 3),
-            expected_losses=battle_result["player_losses"],
-            enemy_losses=battle_result["enemy_losses"],
-            recommendation=recommendation,
-            confidence_level=confidence,
-            details={
-                "player_power": round(battle_result["player_power"], 2),
-                "enemy_power": round(battle_result["enemy_power"], 2),
-                "type_advantage": round(battle_result["type_advantage"], 3)
-            }
-        )
+        result = BattleResult(battle_id=battle_id, **fields)
         
         # Save to database
-        if mongo_available:
-            battles_collection.insert_one({
-                "battle_id": battle_id,
-                "timestamp": datetime.now(),
-                "player_army": battle_request.player_army.dict(),
-                "enemy_army": battle_request.enemy_army.dict(),
-                "result": result.dict(),
-                "scenario": battle_request.scenario
-            })
+        if battle_store.available:
+            with stage_timer("db_write"):
+                battle_writer.add(encode_battle({
+                    "battle_id": battle_id,
+                    "timestamp": datetime.now(),
+                    "player_army": battle_request.player_army.dict(),
+                    "enemy_army": battle_request.enemy_army.dict(),
+                    "result": result.dict(),
+                    "scenario": battle_request.scenario
+                }))
+        else:
+            DB_FALLBACKS.inc(operation="battle_write")
         
         return result
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Battle simulation failed: {str(e)}")
 
+def require_admin(request: Request):
+    """Reject the request unless it carries the configured admin API key"""
+    if not ADMIN_API_KEY:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_API_KEY)")
+    if request.headers.get("Authorization") != f"Bearer {ADMIN_API_KEY}":
+        raise HTTPException(status_code=401, detail="Invalid admin credentials")
+
+@app.get("/api/unit-stats")
+async def get_unit_stats():
+    """Unit stats currently used by the battle model"""
+    return {"unit_stats": get_unit_tables().unit_stats}
+
+@app.post("/api/unit-stats/reload")
+async def reload_unit_stats_endpoint(request: Request):
+    """Reload unit stats from the configured balance file without restarting
+
+    Applies the file in this process at once and reports errors in it. Other server
+    processes (uvicorn --workers) and pool workers pick up the changed file on their
+    own within UNIT_STATS_CHECK_MS.
+    """
+    require_admin(request)
+    try:
+        tables = reload_unit_stats()
+    except (OSError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Unit stats reload failed: {str(e)}")
+    # Cached results and running workers were computed with the old stats; entries are
+    # keyed by balance version, so clearing only frees the memory sooner
+    battle_cache.clear()
+    recycle_pool()
+    return {"status": "reloaded", "unit_stats": tables.unit_stats}
+
+@app.get("/api/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, stage and component metrics in the Prometheus text format"""
+    STATUS.set(1 if battle_store.available else 0, component=battle_store.name, field="available")
+    for component, stats in (
+        ("battle_writer", battle_writer.stats()),
+        ("battle_cache", battle_cache.stats()),
+        ("simulate_coalescing", simulate_flights.stats()),
+        ("optimize_coalescing", optimize_flights.stats())
+    ):
+        for field, value in stats.items():
+            # Flags such as "enabled" are reported as 1 or 0
+            if isinstance(value, (bool, int, float)):
+                STATUS.set(float(value), component=component, field=field)
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/debug/profile", response_class=PlainTextResponse)
+async def profile_server(request: Request, seconds: float = 5.0):
+    """Sample the server's stacks for a few seconds and return them as collapsed stacks"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled (set PROFILING_ENABLED)")
+    require_admin(request)
+    if seconds <= 0 or seconds > 60:
+        raise HTTPException(status_code=400, detail="seconds must be between 0 and 60")
+    stacks = await asyncio.to_thread(sample_stacks, seconds)
+    return PlainTextResponse(stacks)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    """Hit/miss counters for the battle result cache, and how many requests were coalesced"""
+    return {
+        **battle_cache.stats(),
+        "coalescing": {"simulate": simulate_flights.stats(), "optimize": optimize_flights.stats()}
+    }
+
+@app.post("/api/battle/simulate/batch", response_model=BatchBattleResult)
+async def simulate_battle_batch_endpoint(batch_request: BatchBattleRequest):
+    """Simulate many battles in one vectorized pass"""
+    mark_handler_entry()
+    if len(batch_request.battles) > MAX_BATCH_BATTLES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Batch too large: {len(batch_request.battles)} battles (max {MAX_BATCH_BATTLES})"
+        )
+    for i, battle in enumerate(batch_request.battles):
+        error = battle_request_error(battle, monte_carlo=False)
+        if error:
+            raise HTTPException(status_code=400, detail=f"battles[{i}]: {error}")
+    try:
+        start = time.perf_counter()
+        battles = batch_request.battles
+        player_counts, player_bonuses = armies_to_arrays([b.player_army for b in battles])
+        enemy_counts, enemy_bonuses = armies_to_arrays([b.enemy_army for b in battles])
+
+        results = []
+        if battles:
+            # Large batches are split into row chunks across the worker pool
+            with stage_timer("simulate_battles"):
+                outcome = await run_chunked(simulate_battles, player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+            
+            # Lanchester battles are rerun round by round, one pass per round cap, and replace their formula rows
+            lanchester = {}
+            for max_rounds in sorted({b.max_rounds for b in battles if b.engine == "lanchester"}):
+                rows = [i for i, b in enumerate(battles) if b.engine == "lanchester" and b.max_rounds == max_rounds]
+                with stage_timer("lanchester_battles"):
+                    rounds_outcome = await run_chunked(
+                        partial(lanchester_battles, max_rounds=max_rounds),
+                        *[[a[i] for i in rows] for a in (player_counts, player_bonuses, enemy_counts, enemy_bonuses)]
+                    )
+                for key in ("win_probability", "player_losses", "enemy_losses", "player_power", "enemy_power", "type_advantage"):
+                    outcome[key][rows] = rounds_outcome[key]
+                for j, i in enumerate(rows):
+                    lanchester[i] = {
+                        "engine": "lanchester",
+                        "rounds": int(rounds_outcome["rounds"][j]),
+                        "player_broken": bool(rounds_outcome["player_broken"][j]),
+                        "enemy_broken": bool(rounds_outcome["enemy_broken"][j])
+                    }
+            win_probs = outcome["win_probability"].tolist()
+            player_losses = outcome["player_losses"].tolist()
+            enemy_losses = outcome["enemy_losses"].tolist()
+            player_powers = outcome["player_power"].tolist()
+            enemy_powers = outcome["enemy_power"].tolist()
+            type_advantages = outcome["type_advantage"].tolist()
+
+            for i, battle in enumerate(battles):
+                win_prob = win_probs[i]
+                recommendation = generate_recommendation(
+                    {"win_probability": win_prob, "type_advantage": type_advantages[i]},
+                    battle.player_army,
+                    battle.enemy_army
+                )
+                details = {
+                    "player_power": round(player_powers[i], 2),
+                    "enemy_power": round(enemy_powers[i], 2),
+                    "type_advantage": round(type_advantages[i], 3)
+                }
+                details.update(lanchester.get(i, {}))
+                results.append(BatchBattleItem(
+                    win_probability=round(win_prob, 3),
+                    expected_losses=UnitComposition(**dict(zip(UNIT_TYPES, player_losses[i]))),
+                    enemy_losses=UnitComposition(**dict(zip(UNIT_TYPES, enemy_losses[i]))),
+                    recommendation=recommendation,
+                    confidence_level=determine_confidence_level(win_prob),
+                    details=details
+                ))
+
+        elapsed = time.perf_counter() - start
+        return BatchBattleResult(
+            results=results,
+            battle_count=len(results),
+            elapsed_ms=round(elapsed * 1000, 3),
+            battles_per_second=round(len(results) / elapsed, 1) if elapsed > 0 else 0.0
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch battle simulation failed: {str(e)}")
+
+@app.post("/api/battle/tournament", response_model=TournamentResult)
+async def battle_tournament(tournament_request: TournamentRequest):
+    """Win probability and losses for every army against every opponent, one row block per call"""
+    mark_handler_entry()
+    armies = tournament_request.armies
+    opponents = tournament_request.opponents if tournament_request.opponents is not None else armies
+    if not armies or not opponents:
+        raise HTTPException(status_code=400, detail="Tournament needs at least one army on each side")
+    if len(armies) > MAX_TOURNAMENT_ARMIES or len(opponents) > MAX_TOURNAMENT_ARMIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tournament too large: {len(armies)} x {len(opponents)} armies (max {MAX_TOURNAMENT_ARMIES} per side)"
+        )
+    if not 0 <= tournament_request.row_offset < len(armies):
+        raise HTTPException(status_code=400, detail=f"row_offset must be between 0 and {len(armies) - 1}")
+    if tournament_request.row_limit is not None and tournament_request.row_limit < 1:
+        raise HTTPException(status_code=400, detail="row_limit must be at least 1")
+    try:
+        start = time.perf_counter()
+
+        # Pages are blocks of whole rows, sized to stay under MAX_TOURNAMENT_CELLS
+        row_count = max(MAX_TOURNAMENT_CELLS // len(opponents), 1)
+        if tournament_request.row_limit is not None:
+            row_count = min(row_count, tournament_request.row_limit)
+        row_offset = tournament_request.row_offset
+        row_end = min(row_offset + row_count, len(armies))
+
+        player_counts, player_bonuses = armies_to_arrays(armies[row_offset:row_end])
+        enemy_counts, enemy_bonuses = armies_to_arrays(opponents)
+
+        # Large blocks are split by rows across the worker pool; every chunk sees all opponents
+        with stage_timer("tournament_matrix"):
+            outcome = await run_chunked(
+                partial(tournament_matrix, enemy_counts=enemy_counts, enemy_bonuses=enemy_bonuses),
+                player_counts,
+                player_bonuses,
+                min_batch=max(POOL_MIN_BATCH // len(opponents), 1)
+            )
+
+        return TournamentResult(
+            rows=len(armies),
+            columns=len(opponents),
+            row_offset=row_offset,
+            row_count=row_end - row_offset,
+            next_row_offset=row_end if row_end < len(armies) else None,
+            win_probability=outcome["win_probability"].round(4).tolist(),
+            player_losses=outcome["player_losses"].tolist(),
+            enemy_losses=outcome["enemy_losses"].tolist(),
+            elapsed_ms=round((time.perf_counter() - start) * 1000, 3)
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Tournament simulation failed: {str(e)}")
+
+# Sensitivity report keys: UnitComposition fields, then Army.research_* and Hero.army_* fields
+SENSITIVITY_FIELDS = UNIT_TYPES + [field if field.startswith("research") else f"hero_{field}" for field in BONUS_FIELDS]
+
+@app.post("/api/battle/sensitivity")
+async def battle_sensitivity(battle_request: BattleRequest):
+    """Marginal effect of each troop type and bonus point on win probability and expected losses"""
+    mark_handler_entry()
+    if battle_request.engine != "formula" or battle_request.trials > 0:
+        raise HTTPException(status_code=400, detail="Sensitivity is only available for the formula engine without Monte Carlo trials")
+    try:
+        (player_counts,), (player_bonuses,) = armies_to_arrays([battle_request.player_army])
+        (enemy_counts,), (enemy_bonuses,) = armies_to_arrays([battle_request.enemy_army])
+        with stage_timer("sensitivity"):
+            report = sensitivity_report(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+        
+        gradient = report["gradient"].tolist()
+        sides = {}
+        for side_index, side in enumerate(("player", "enemy")):
+            sides[side] = {
+                field: {
+                    "win_probability": gradient[side_index][k][0],
+                    "expected_losses": gradient[side_index][k][1],
+                    "enemy_losses": gradient[side_index][k][2]
+                }
+                for k, field in enumerate(SENSITIVITY_FIELDS)
+            }
+        
+        return {
+            "win_probability": round(report["win_probability"], 6),
+            "expected_losses": round(report["player_losses"], 2),
+            "enemy_losses": round(report["enemy_losses"], 2),
+            "player": sides["player"],
+            "enemy": sides["enemy"],
+            "units": "change per additional troop for unit types, per bonus point (1%) for research and hero bonuses"
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Sensitivity analysis failed: {str(e)}")
+
+@app.post("/api/battle/win-probability")
+async def fast_win_probability(battle_request: BattleRequest):
+    """Win probability from the precomputed surface, falling back to simulate_battle off the grid
+    
+    The surface models the formula engine; Lanchester requests are always simulated exactly.
+    """
+    error = battle_request_error(battle_request, monte_carlo=False)
+    if error:
+        raise HTTPException(status_code=400, detail=error)
+    start = time.perf_counter()
+    try:
+        (player_counts,), (player_bonuses,) = armies_to_arrays([battle_request.player_army])
+        (enemy_counts,), (enemy_bonuses,) = armies_to_arrays([battle_request.enemy_army])
+        answer = None
+        if win_surface is not None and battle_request.engine == "formula":
+            answer = win_surface.query(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+        
+        if answer is not None:
+            win_prob, error_bound = answer
+            source = "surface"
+        elif battle_request.engine == "lanchester":
+            win_prob = simulate_battle_lanchester(
+                battle_request.player_army, battle_request.enemy_army, battle_request.max_rounds
+            )["win_probability"]
+            error_bound = 0.0
+            source = "exact"
+        else:
+            win_prob = simulate_battle(battle_request.player_army, battle_request.enemy_army)["win_probability"]
+            error_bound = 0.0
+            source = "exact"
+        
+        return {
+            "win_probability": round(win_prob, 6),
+            "error_bound": round(error_bound, 6),
+            "source": source,
+            "elapsed_us": round((time.perf_counter() - start) * 1e6, 1)
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Win probability lookup failed: {str(e)}")
+
+def history_filters(scenario=None, since=None, until=None, min_win_probability=None, max_win_probability=None):
+    """History filter arguments in the form the battle store takes them"""
+    return {
+        "scenario": scenario,
+        "since": since,
+        "until": until,
+        "min_win_probability": min_win_probability,
+        "max_win_probability": max_win_probability
+    }
+
 @app.get("/api/battle/history")
-async def get_battle_history(limit: int = 10):
-    """Get recent battle simulations"""
+async def get_battle_history(
+    limit: int = 10,
+    cursor: Optional[str] = None,
+    scenario: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    min_win_probability: Optional[float] = None,
+    max_win_probability: Optional[float] = None,
+    fields: Optional[str] = None
+):
+    """Get recent battle simulations, newest first, one keyset page at a time"""
+    mark_handler_entry()
+    if limit <= 0 or limit > MAX_HISTORY_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_HISTORY_LIMIT}")
+    filters = history_filters(scenario, since, until, min_win_probability, max_win_probability)
     try:
-        if not mongo_available:
-            return {"battles": [], "message": "Database not available for history retrieval."}
-        battles = list(battles_collection.find(
-            {}, 
-            {"_id": 0}
-        ).sort("timestamp", -1).limit(limit))
+        names = history_field_names(fields)
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        if not battle_store.available:
+            DB_FALLBACKS.inc(operation="history_read")
+            return {"battles": [], "next": None, "message": "Database not available for history retrieval."}
+        # Make battles that are still buffered visible to this read
+        await battle_writer.flush()
+        with stage_timer("db_read"):
+            battles = await battle_store.recent_battles(filters, cursor, fields, limit)
+        
+        # Compact and original layouts both come back in the original one
+        battles = [decode_battle(battle) for battle in battles]
+        if names:
+            battles = [select_fields(battle, names) for battle in battles]
         
-        return {"battles": battles}
+        # A full page means there may be more; the token resumes after its last battle
+        next_cursor = encode_cursor(battles[-1]) if len(battles) == limit else None
+        return {"battles": battles, "next": next_cursor}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to retrieve battle history: {str(e)}")
 
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+async def stream_battles_ndjson(filters: Dict, fields: Optional[str], names: Optional[List[str]], batch_size: int,
+                                compress: bool):
+    """Yield battles as NDJSON chunks, one store batch at a time"""
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    battles = battle_store.iter_battles(filters, fields, batch_size)
+    lines = []
+    try:
+        async for battle in battles:
+            battle = decode_battle(battle)
+            if names:
+                battle = select_fields(battle, names)
+            lines.append(json.dumps(battle, default=_json_default))
+            if len(lines) >= batch_size:
+                chunk = ("\n".join(lines) + "\n").encode()
+                lines = []
+                yield compressor.compress(chunk) if compressor else chunk
+        if lines:
+            chunk = ("\n".join(lines) + "\n").encode()
+            yield compressor.compress(chunk) if compressor else chunk
+        if compressor:
+            yield compressor.flush()
+    finally:
+        await battles.aclose()
+
+@app.get("/api/battle/export")
+async def export_battle_history(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    scenario: Optional[str] = None,
+    min_win_probability: Optional[float] = None,
+    max_win_probability: Optional[float] = None,
+    fields: Optional[str] = None,
+    batch_size: int = EXPORT_BATCH_SIZE,
+    gzip: bool = False
+):
+    """Stream battles oldest first as NDJSON for offline analytics"""
+    if batch_size <= 0 or batch_size > MAX_EXPORT_BATCH_SIZE:
+        raise HTTPException(status_code=400, detail=f"batch_size must be between 1 and {MAX_EXPORT_BATCH_SIZE}")
+    filters = history_filters(scenario, since, until, min_win_probability, max_win_probability)
+    try:
+        names = history_field_names(fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not battle_store.available:
+        DB_FALLBACKS.inc(operation="export")
+        raise HTTPException(status_code=503, detail="Database not available for export.")
+    
+    # Make battles that are still buffered part of the export
+    await battle_writer.flush()
+    
+    body = stream_battles_ndjson(filters, fields, names, batch_size, gzip)
+    if gzip:
+        return StreamingResponse(
+            body,
+            media_type="application/gzip",
+            headers={"Content-Disposition": "attachment; filename=battles.ndjson.gz"}
+        )
+    return StreamingResponse(body, media_type="application/x-ndjson")
+
+def require_mongo_for_migration():
+    """MongoDB connection the layout migration runs against; the embedded store is always compact"""
+    if battle_store.name != "mongo":
+        raise HTTPException(status_code=400, detail=f"The {battle_store.name} battle store needs no migration.")
+    if not battle_store.available:
+        raise HTTPException(status_code=503, detail="Database not available for migration.")
+    return battle_store.database
+
+@app.post("/api/battle/migrate")
+async def start_battle_migration(request: Request):
+    """Start converting battles stored in the original layout to the compact one in the background"""
+    require_admin(request)
+    database = require_mongo_for_migration()
+    started = battle_migration.start(database.collection('battles'))
+    return {"status": "started" if started else "already running", **battle_migration.stats()}
+
+@app.get("/api/battle/migrate")
+async def get_battle_migration(request: Request):
+    """Progress of the layout migration, and how many battles are stored in each layout"""
+    require_admin(request)
+    database = require_mongo_for_migration()
+    try:
+        battles = database.collection('battles')
+        compact = await battles.count_documents({"schema_version": BATTLE_SCHEMA_VERSION})
+        total = await battles.count_documents({})
+        storage = {}
+        try:
+            coll_stats = await database.db.command("collStats", "battles")
+            storage = {"average_document_bytes": coll_stats.get("avgObjSize"), "data_bytes": coll_stats.get("size")}
+        except Exception:
+            # Not every deployment exposes collStats
+            pass
+        return {
+            **battle_migration.stats(),
+            "compact_documents": compact,
+            "other_documents": total - compact,
+            **storage
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read migration status: {str(e)}")
+
+@app.get("/api/analytics/battles")
+async def get_battle_analytics(
+    granularity: str = "day",
+    scenario: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = MAX_ANALYTICS_BUCKETS
+):
+    """Win rates and average losses per scenario and time bucket, read from the rollups"""
+    if granularity not in ROLLUP_GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of: {', '.join(ROLLUP_GRANULARITIES)}")
+    if limit <= 0 or limit > MAX_ANALYTICS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_ANALYTICS_BUCKETS}")
+    if not battle_store.available:
+        DB_FALLBACKS.inc(operation="analytics_read")
+        return {"granularity": granularity, "buckets": [], "totals": [], "message": "Database not available for analytics."}
+    try:
+        with stage_timer("db_read"):
+            rollups = await battle_store.read_rollups(granularity, scenario, since, until, limit)
+        
+        return {
+            "granularity": granularity,
+            "buckets": [summarize_rollup(rollup) for rollup in rollups],
+            "totals": [summarize_rollup(total) for total in combine_rollups(rollups)]
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to read battle analytics: {str(e)}")
+
+@app.post("/api/analytics/rebuild")
+async def rebuild_battle_analytics(request: Request):
+    """Recompute every rollup from the stored battles"""
+    require_admin(request)
+    if not battle_store.available:
+        raise HTTPException(status_code=503, detail="Database not available for analytics rebuild.")
+    try:
+        # Buffered battles are written first so the rebuild includes them; writes arriving
+        # meanwhile wait, or their rollup increments would be lost or duplicate a bucket
+        async with battle_writer.paused():
+            start = time.perf_counter()
+            rollups = await battle_store.rebuild_rollups()
+        return {"status": "rebuilt", "rollups": rollups, "elapsed_ms": round((time.perf_counter() - start) * 1000, 1)}
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Analytics rebuild failed: {str(e)}")
+
 @app.get("/api/army/optimize")
 async def optimize_army_composition(
     total_troops: int,
     enemy_infantry: int = 0,
     enemy_ranged: int = 0,
     enemy_cavalry: int = 0,
-    enemy_siege: int = 0
+    enemy_siege: int = 0,
+    research_attack: float = 0.0,
+    research_defense: float = 0.0,
+    research_hp: float = 0.0,
+    hero_army_attack: float = 0.0,
+    hero_army_defense: float = 0.0,
+    hero_army_hp: float = 0.0,
+    enemy_research_attack: float = 0.0,
+    enemy_research_defense: float = 0.0,
+    enemy_research_hp: float = 0.0,
+    enemy_hero_army_attack: float = 0.0,
+    enemy_hero_army_defense: float = 0.0,
+    enemy_hero_army_hp: float = 0.0,
+    max_ms: int = 200
 ):
-    """Suggest optimal army composition against specific enemy"""
+    """Search for the army composition with the best predicted outcome against a specific enemy"""
+    mark_handler_entry()
+    if total_troops <= 0:
+        raise HTTPException(status_code=400, detail="total_troops must be positive")
+    if max_ms <= 0 or max_ms > MAX_OPTIMIZE_MS:
+        raise HTTPException(status_code=400, detail=f"max_ms must be between 1 and {MAX_OPTIMIZE_MS}")
     try:
         enemy_comp = UnitComposition(
             infantry=enemy_infantry,
@@ -349,6 +1241,26 @@ async def optimize_army_composition(
             cavalry=enemy_cavalry,
             siege=enemy_siege
         )
+        player_army = Army(
+            composition=UnitComposition(),
+            hero=Hero(army_attack=hero_army_attack, army_defense=hero_army_defense, army_hp=hero_army_hp),
+            research_attack=research_attack,
+            research_defense=research_defense,
+            research_hp=research_hp
+        )
+        enemy_army = Army(
+            composition=enemy_comp,
+            hero=Hero(army_attack=enemy_hero_army_attack, army_defense=enemy_hero_army_defense, army_hp=enemy_hero_army_hp),
+            research_attack=enemy_research_attack,
+            research_defense=enemy_research_defense,
+            research_hp=enemy_research_hp
+        )
+        
+        type_advantages = {
+            "infantry_counters": enemy_ranged,
+            "ranged_counters": enemy_cavalry,
+            "cavalry_counters": enemy_infantry
+        }
         
         # Calculate optimal composition based on enemy
         enemy_units = enemy_comp.dict()
@@ -362,50 +1274,163 @@ async def optimize_army_composition(
                 cavalry=int(total_troops * 0.3),
                 siege=int(total_troops * 0.1)
             )
-        else:
-            # Counter-composition
-            infantry_needed = int(enemy_ranged * 1.2)
-            ranged_needed = int(enemy_cavalry * 1.2)
-            cavalry_needed = int(enemy_infantry * 1.2)
-            siege_needed = int(total_troops * 0.1)
-            
-            total_needed = infantry_needed + ranged_needed + cavalry_needed + siege_needed
-            
-            if total_needed > total_troops:
-                # Scale down proportionally
-                scale = total_troops / total_needed
-                infantry_needed = int(infantry_needed * scale)
-                ranged_needed = int(ranged_needed * scale)
-                cavalry_needed = int(cavalry_needed * scale)
-                siege_needed = int(siege_needed * scale)
-            
-            # Fill remaining with balanced units
-            remaining = total_troops - (infantry_needed + ranged_needed + cavalry_needed + siege_needed)
-            if remaining > 0:
-                infantry_needed += remaining // 3
-                ranged_needed += remaining // 3
-                cavalry_needed += remaining - (2 * (remaining // 3))
-            
-            optimal_comp = UnitComposition(
-                infantry=infantry_needed,
-                ranged=ranged_needed,
-                cavalry=cavalry_needed,
-                siege=siege_needed
+            return {
+                "optimal_composition": optimal_comp.dict(),
+                "reasoning": f"Balanced composition for {total_troops} troops; no enemy composition given",
+                "type_advantages": type_advantages,
+                "candidates_evaluated": 0
+            }
+        
+        _, (player_bonuses,) = armies_to_arrays([player_army])
+        (enemy_counts,), (enemy_bonuses,) = armies_to_arrays([enemy_army])
+        flight_key = canonical_key(
+            total_troops,
+            [float(b) for b in player_bonuses],
+            enemy_counts,
+            [float(b) for b in enemy_bonuses],
+            max_ms
+        )
+        with stage_timer("optimize"):
+            search = await optimize_flights.run(
+                flight_key, run_in_pool, optimize_composition, total_troops, player_bonuses, enemy_counts, enemy_bonuses, max_ms
             )
         
+        optimal_comp = UnitComposition(**dict(zip(UNIT_TYPES, search["composition"].tolist())))
+        
         return {
             "optimal_composition": optimal_comp.dict(),
-            "reasoning": f"Optimized for {total_troops} troops against the given enemy composition",
-            "type_advantages": {
-                "infantry_counters": enemy_ranged,
-                "ranged_counters": enemy_cavalry,
-                "cavalry_counters": enemy_infantry
-            }
+            "reasoning": f"Best of {search['candidates_evaluated']} simulated compositions for {total_troops} troops against the given enemy composition",
+            "type_advantages": type_advantages,
+            "predicted_win_probability": round(search["win_probability"], 3),
+            "expected_losses": dict(zip(UNIT_TYPES, search["player_losses"].tolist())),
+            "enemy_losses": dict(zip(UNIT_TYPES, search["enemy_losses"].tolist())),
+            "candidates_evaluated": search["candidates_evaluated"],
+            "search_ms": round(search["elapsed_ms"], 2)
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Army optimization failed: {str(e)}")
 
+def live_battle_message(session: LiveBattleSession):
+    """Result message for the session's current armies"""
+    battle_result = session.result()
+    win_prob = battle_result["win_probability"]
+    return {
+        "type": "result",
+        "win_probability": round(win_prob, 3),
+        "expected_losses": battle_result["player_losses"].dict(),
+        "enemy_losses": battle_result["enemy_losses"].dict(),
+        "recommendation": generate_recommendation(
+            battle_result, session.armies["player_army"], session.armies["enemy_army"]
+        ),
+        "confidence_level": determine_confidence_level(win_prob),
+        "details": {
+            "player_power": round(battle_result["player_power"], 2),
+            "enemy_power": round(battle_result["enemy_power"], 2),
+            "type_advantage": round(battle_result["type_advantage"], 3)
+        }
+    }
+
+def optimizer_message(kind: str, search: Dict):
+    return {
+        "type": kind,
+        "composition": dict(zip(UNIT_TYPES, search["composition"].tolist())),
+        "predicted_win_probability": round(search["win_probability"], 3),
+        "expected_losses": dict(zip(UNIT_TYPES, search["player_losses"].tolist())),
+        "score": round(search["score"], 6),
+        "candidates_evaluated": search["candidates_evaluated"],
+        "search_ms": round(search["elapsed_ms"], 2)
+    }
+
+async def stream_optimizer(session: LiveBattleSession, send, total_troops: int, max_ms: int):
+    """Run the optimizer for the session's armies, sending its best-so-far result as it improves"""
+    (player_counts,), (player_bonuses,) = armies_to_arrays([session.armies["player_army"]])
+    (enemy_counts,), (enemy_bonuses,) = armies_to_arrays([session.armies["enemy_army"]])
+    # The search runs in a worker process, so the session keeps receiving updates meanwhile;
+    # cancelling this task stops the search at its next check rather than at its deadline
+    steps = stream_in_pool(
+        optimize_composition_steps, total_troops, player_bonuses, enemy_counts, enemy_bonuses, max_ms
+    )
+    search = None
+    try:
+        async for step in steps:
+            if search is not None:
+                await send(optimizer_message("optimize_progress", search))
+            search = step
+        await send(optimizer_message("optimize_done", search))
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await send({"type": "error", "detail": f"Army optimization failed: {str(e)}"})
+    finally:
+        await steps.aclose()
+
+@app.websocket("/api/battle/live")
+async def live_battle(websocket: WebSocket):
+    """What-if session: the client sends partial army updates and gets results pushed back
+    
+    Messages from the client:
+      {"type": "update", "player_army": {...}, "enemy_army": {...}}  partial armies, merged into the session
+      {"type": "optimize", "total_troops": int, "max_ms": int}       stream an optimizer search for the session
+      {"type": "cancel"}                                              stop a running optimizer search
+    Messages to the client have type "result", "optimize_progress", "optimize_done" or "error";
+    an "id" sent with a message is echoed on its reply.
+    """
+    await websocket.accept()
+    session = LiveBattleSession()
+    send_lock = asyncio.Lock()
+    optimizer = None
+    
+    async def send(message: Dict, message_id=None):
+        if message_id is not None:
+            message["id"] = message_id
+        async with send_lock:
+            await websocket.send_json(message)
+    
+    try:
+        while True:
+            text = await websocket.receive_text()
+            message_id = None
+            try:
+                message = json.loads(text)
+                if not isinstance(message, dict):
+                    raise ValueError("Messages must be JSON objects")
+                message_id = message.get("id")
+                kind = message.get("type")
+                if kind == "update":
+                    start = time.perf_counter()
+                    recomputed = session.update(message)
+                    reply = live_battle_message(session)
+                    reply["recomputed"] = recomputed
+                    reply["elapsed_us"] = round((time.perf_counter() - start) * 1e6, 1)
+                    await send(reply, message_id)
+                elif kind == "optimize":
+                    total_troops = int(message.get("total_troops") or sum(composition_counts(session.armies["player_army"].composition)))
+                    max_ms = int(message.get("max_ms", 200))
+                    if total_troops <= 0:
+                        raise ValueError("total_troops must be positive")
+                    if max_ms <= 0 or max_ms > MAX_OPTIMIZE_MS:
+                        raise ValueError(f"max_ms must be between 1 and {MAX_OPTIMIZE_MS}")
+                    # A new search replaces the one still running
+                    if optimizer is not None:
+                        optimizer.cancel()
+                    optimizer = asyncio.create_task(stream_optimizer(
+                        session, lambda m, i=message_id: send(m, i), total_troops, max_ms
+                    ))
+                elif kind == "cancel":
+                    if optimizer is not None:
+                        optimizer.cancel()
+                        optimizer = None
+                else:
+                    raise ValueError(f"Unknown message type: {kind}")
+            except (ValidationError, ValueError, TypeError) as e:
+                await send({"type": "error", "detail": str(e)}, message_id)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        if optimizer is not None:
+            optimizer.cancel()
+
 if __name__ == "__main__":
     import uvicorn
     # Bind to localhost only for security
@@ -0,0 +1,182 @@
+"""Precomputed win-probability surface for the formula battle model
+
+The formula model factors exactly as
+
+    log(player_power / enemy_power) = g(x, y) + 2 * log(player_total / enemy_total) + log(bonus ratio)
+
+where x and y are the two armies' normalized compositions and the bonus ratio is the
+product of each side's attack and hp multipliers. Only g depends on compositions in a
+non-trivial way, so it is the part that is tabulated: on a regular grid over the
+stick-breaking cube coordinates of x and y (6 dimensions). Army size and bonus levels
+are applied exactly on top of the interpolated g, which keeps the table small.
+
+Build the table once (and again after a unit-stats change):
+
+    python3 backend/win_surface.py --grid 9
+"""
+import argparse
+import itertools
+import json
+import math
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+from battle_engine import get_unit_tables
+
+# Where the surface is written and loaded from (suffixes .npy, _error.npy and .json are added)
+WIN_SURFACE_PATH = os.environ.get(
+    'WIN_SURFACE_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "win_surface")
+)
+
+# Corners of a 6-D grid cell, as 0/1 offsets per axis
+CELL_CORNERS = np.array(list(itertools.product((0, 1), repeat=6)), dtype=np.int64)
+
+def to_cube(fractions):
+    """Map (M x 4) compositions summing to 1 onto (M x 3) stick-breaking coordinates in [0, 1]"""
+    remaining_after_first = 1 - fractions[:, 0]
+    remaining_after_second = remaining_after_first - fractions[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        u1 = np.where(remaining_after_first > 0, fractions[:, 1] / remaining_after_first, 0.0)
+        u2 = np.where(remaining_after_second > 0, fractions[:, 2] / remaining_after_second, 0.0)
+    return np.clip(np.stack([fractions[:, 0], u1, u2], axis=1), 0.0, 1.0)
+
+def from_cube(cube):
+    """Inverse of to_cube"""
+    x0 = cube[:, 0]
+    x1 = (1 - x0) * cube[:, 1]
+    x2 = (1 - x0) * (1 - cube[:, 1]) * cube[:, 2]
+    return np.stack([x0, x1, x2, np.maximum(1 - x0 - x1 - x2, 0.0)], axis=1)
+
+def composition_log_ratio(player_fractions, enemy_fractions):
+    """Exact g for every pair of rows: an (M x K) matrix for (M x 4) and (K x 4) compositions"""
+    tables = get_unit_tables()
+    strong_vs = tables.strong_vs.astype(np.float64)
+    player_attack = np.log(player_fractions @ tables.base_attack)[:, None]
+    player_hp = np.log(player_fractions @ tables.base_hp)[:, None]
+    enemy_attack = np.log(enemy_fractions @ tables.base_attack)[None, :]
+    enemy_hp = np.log(enemy_fractions @ tables.base_hp)[None, :]
+
+    # Same advantage terms as type_advantage_batch, on fractions instead of counts
+    player_advantage = 1 + 0.25 * (player_fractions @ strong_vs @ enemy_fractions.T)
+    enemy_advantage = 1 + 0.25 * (player_fractions @ strong_vs.T @ enemy_fractions.T)
+    return (player_attack + player_hp + np.log(player_advantage)
+            - enemy_attack - enemy_hp - np.log(enemy_advantage))
+
+def _cell_max(values):
+    """Max of a grid^6 array over the 2^6 corners of each cell, giving a (grid-1)^6 array"""
+    for dim in range(6):
+        lower = [slice(None)] * 6
+        upper = [slice(None)] * 6
+        lower[dim] = slice(None, -1)
+        upper[dim] = slice(1, None)
+        values = np.maximum(values[tuple(lower)], values[tuple(upper)])
+    return values
+
+def build_surface(grid=9):
+    """Tabulate g on a grid^6 lattice and bound the interpolation error of every cell"""
+    axis = np.linspace(0.0, 1.0, grid)
+    cube = np.array(list(itertools.product(axis, repeat=3)))
+    fractions = from_cube(cube)
+    table = composition_log_ratio(fractions, fractions).reshape((grid,) * 6)
+
+    # Multilinear interpolation error is at most h^2/8 * sum of |d2g/du2| per axis; second
+    # differences on the grid give h^2 * d2g/du2, taken at the worst corner of each cell
+    error = np.zeros((grid - 1,) * 6)
+    for dim in range(6):
+        curvature = np.abs(np.diff(table, n=2, axis=dim))
+        padding = [(0, 0)] * 6
+        padding[dim] = (1, 1)
+        error += _cell_max(np.pad(curvature, padding, mode="edge")) / 8
+    # Headroom for float32 storage
+    error += 1e-6
+    return table.astype(np.float32), error.astype(np.float32)
+
+def save_surface(path, table, error):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    np.save(f"{path}.npy", table)
+    np.save(f"{path}_error.npy", error)
+    with open(f"{path}.json", "w") as f:
+        json.dump({
+            "grid": table.shape[0],
+            "unit_stats_key": get_unit_tables().key,
+            "built_at": datetime.now().isoformat(),
+            "max_error": float(error.max())
+        }, f)
+
+def _sigmoid(z):
+    if z >= 0:
+        return 1 / (1 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1 + e)
+
+class WinSurface:
+    """Memory-mapped surface answering win_probability by 6-D multilinear interpolation"""
+
+    def __init__(self, table, error, meta):
+        self.table = table
+        self.error = error
+        self.meta = meta
+        self.grid = table.shape[0]
+
+    @classmethod
+    def load(cls, path=WIN_SURFACE_PATH):
+        """Memory-map a saved surface, or return None if none has been built"""
+        if not os.path.exists(f"{path}.npy"):
+            return None
+        with open(f"{path}.json") as f:
+            meta = json.load(f)
+        return cls(np.load(f"{path}.npy", mmap_mode="r"), np.load(f"{path}_error.npy", mmap_mode="r"), meta)
+
+    def query(self, player_counts, player_bonuses, enemy_counts, enemy_bonuses):
+        """(win_probability, error_bound), or None when the inputs are outside what the surface covers"""
+        if self.meta["unit_stats_key"] != get_unit_tables().key:
+            return None
+        player_counts = np.asarray(player_counts, dtype=np.float64)
+        enemy_counts = np.asarray(enemy_counts, dtype=np.float64)
+        if (player_counts < 0).any() or (enemy_counts < 0).any():
+            return None
+        player_total = player_counts.sum()
+        enemy_total = enemy_counts.sum()
+        if player_total <= 0 or enemy_total <= 0:
+            return None
+
+        # Attack and hp multipliers apply uniformly to every unit type
+        player_bonus = math.prod(1 + b / 100 for i, b in enumerate(player_bonuses) if i in (0, 2, 3, 5))
+        enemy_bonus = math.prod(1 + b / 100 for i, b in enumerate(enemy_bonuses) if i in (0, 2, 3, 5))
+        if player_bonus <= 0 or enemy_bonus <= 0:
+            return None
+
+        fractions = np.stack([player_counts / player_total, enemy_counts / enemy_total])
+        position = to_cube(fractions).reshape(6) * (self.grid - 1)
+        cell = np.minimum(np.floor(position).astype(np.int64), self.grid - 2)
+        offset = position - cell
+        corners = cell + CELL_CORNERS
+        weights = np.where(CELL_CORNERS == 1, offset, 1 - offset).prod(axis=1)
+        g = float(self.table[tuple(corners.T)] @ weights)
+        g_error = float(self.error[tuple(cell)])
+
+        log_ratio = g + 2 * math.log(player_total / enemy_total) + math.log(player_bonus / enemy_bonus)
+        win_probability = _sigmoid(log_ratio)
+        error_bound = max(
+            abs(_sigmoid(log_ratio + g_error) - win_probability),
+            abs(_sigmoid(log_ratio - g_error) - win_probability)
+        )
+        return win_probability, error_bound
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the win-probability surface")
+    parser.add_argument("--grid", type=int, default=9, help="grid points per composition axis")
+    parser.add_argument("--output", default=WIN_SURFACE_PATH, help="output path prefix")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table, error = build_surface(args.grid)
+    save_surface(args.output, table, error)
+    print(f"Built {args.grid}^6 surface in {time.perf_counter() - start:.1f}s -> {args.output}.npy "
+          f"({table.nbytes / 1e6:.1f} MB, max error bound in log-odds {error.max():.4f})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Number of worker processes; 0 runs every job inline on the event loop
+SIMULATION_WORKERS = int(os.environ.get('SIMULATION_WORKERS', str(os.cpu_count() or 1)))
+
+# Batches smaller than this are cheaper to run inline than to ship to a worker
+POOL_MIN_BATCH = int(os.environ.get('POOL_MIN_BATCH', '2000'))
+
+_pool = None
+_manager = None
+
+def _pool_context():
+    """Pick the multiprocessing start method for the worker pool"""
+    method = os.environ.get('SIMULATION_POOL_START_METHOD')
+    if method:
+        return multiprocessing.get_context(method)
+    # The pool starts lazily, after motor and asyncio.to_thread have started threads, and a
+    # forked child can deadlock on a lock another thread held mid-fork. spawn starts clean
+    # workers; they only unpickle battle_engine functions, so they import battle_engine
+    # (reading UNIT_STATS_FILE as it is now, which recycle_pool relies on) and numpy
+    return multiprocessing.get_context("spawn")
+
+def get_pool():
+    """Return the shared process pool, creating it on first use"""
+    global _pool
+    if _pool is None and SIMULATION_WORKERS > 0:
+        _pool = ProcessPoolExecutor(max_workers=SIMULATION_WORKERS, mp_context=_pool_context())
+    return _pool
+
+def get_manager():
+    """Return the shared manager process, whose queues and events pool jobs can use, creating it on first use"""
+    global _manager
+    if _manager is None:
+        _manager = _pool_context().Manager()
+    return _manager
+
+def shutdown_pool():
+    """Stop the worker processes"""
+    global _pool, _manager
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+    if _manager is not None:
+        _manager.shutdown()
+        _manager = None
+
+def recycle_pool():
+    """Replace the pool so new jobs see state changed since the workers started
+
+    Jobs already running finish on the old workers.
+    """
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+async def run_in_pool(fn, *args):
+    """Run a CPU-bound job in a worker process without blocking the event loop"""
+    pool = get_pool()
+    if pool is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(pool, fn, *args)
+
+def _stream_job(fn, items, stop, args):
+    """Put everything fn(*args, stop=stop) yields on `items`, then None"""
+    try:
+        for item in fn(*args, stop=stop):
+            items.put(item)
+    finally:
+        items.put(None)
+
+async def stream_in_pool(fn, *args):
+    """Run a generator job in a worker process and yield its items as they arrive
+
+    fn must take a `stop` Event and return soon after it is set. Closing this generator,
+    or cancelling whatever is iterating it, sets the event and waits for the job to end,
+    so a job never outlives its consumer.
+    """
+    pool = get_pool()
+    if pool is None:
+        items, stop = queue.Queue(), threading.Event()
+        job = asyncio.ensure_future(asyncio.to_thread(_stream_job, fn, items, stop, args))
+    else:
+        manager = get_manager()
+        items, stop = manager.Queue(), manager.Event()
+        job = asyncio.get_running_loop().run_in_executor(pool, _stream_job, fn, items, stop, args)
+    try:
+        while True:
+            item = await asyncio.to_thread(items.get)
+            if item is None:
+                break
+            yield item
+        await job
+    finally:
+        stop.set()
+        # The job always ends by putting None, which also releases a get left waiting above
+        await asyncio.wait([job])
+
+def chunk_bounds(n, chunks):
+    """Split range(n) into at most `chunks` contiguous (start, stop) pairs of near-equal size"""
+    size = max(math.ceil(n / max(chunks, 1)), 1)
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+async def run_chunked(fn, *arrays, min_batch=POOL_MIN_BATCH):
+    """Run fn over row chunks of equal-length arrays across the pool and concatenate the results
+
+    fn must return a dict of arrays whose first axis matches its inputs, like simulate_battles.
+    """
+    arrays = [np.asarray(a) for a in arrays]
+    n = len(arrays[0])
+    pool = get_pool()
+    if pool is None or n < min_batch:
+        return fn(*arrays)
+
+    # A few chunks per worker keeps every core busy when chunks finish unevenly
+    loop = asyncio.get_running_loop()
+    bounds = chunk_bounds(n, SIMULATION_WORKERS * 4)
+    futures = [
+        loop.run_in_executor(pool, fn, *[a[start:stop] for a in arrays])
+        for start, stop in bounds
+    ]
+    parts = await asyncio.gather(*futures)
+    return {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
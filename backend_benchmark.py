@@ -0,0 +1,258 @@
+"""Local benchmark suite for the battle engine and API hot paths
+
+Runs everything in-process (the API through an ASGI test client), so no server or
+MongoDB is needed. Results are written as JSON and can be compared with a stored
+baseline to catch regressions:
+
+    python3 backend_benchmark.py --output bench.json
+    python3 backend_benchmark.py --baseline bench.json --tolerance 0.2
+
+With --stores, battle store writes and reads are measured too: the embedded SQLite
+store in a temporary file, and MongoDB as well when one is reachable at MONGO_URL
+(in a separate lords_mobile_ai_benchmark database, dropped afterwards).
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# Measure the code paths themselves: no result cache, no worker processes
+os.environ.setdefault("BATTLE_CACHE_ENABLED", "false")
+os.environ.setdefault("SIMULATION_WORKERS", "0")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import server
+from server import (
+    Army, Hero, UnitComposition, BattleRequest, BattleResult, calculate_effective_stats, calculate_type_advantage,
+    optimize_army_composition, simulate_battle, compute_battle_result, history_filters
+)
+from battle_records import encode_battle
+from battle_store import MongoBattleStore, SQLiteBattleStore
+
+# Total troops per army for each benchmarked size
+ARMY_SIZES = {"small": 2_000, "medium": 200_000, "large": 20_000_000}
+
+# Battles stored before the read cases run, battles per write batch, and rows per read
+STORE_PREFILL = 20_000
+STORE_BATCH_SIZE = 100
+STORE_PAGE_SIZE = 50
+STORE_EXPORT_SIZE = 1_000
+
+def make_army(total, mix=(0.3, 0.3, 0.3, 0.1), bonus=20.0):
+    """Army of roughly `total` troops split by `mix`"""
+    return Army(
+        composition=UnitComposition(
+            infantry=int(total * mix[0]),
+            ranged=int(total * mix[1]),
+            cavalry=int(total * mix[2]),
+            siege=int(total * mix[3])
+        ),
+        hero=Hero(name="Bench", army_attack=bonus, army_defense=bonus / 2, army_hp=bonus / 2),
+        research_attack=bonus,
+        research_defense=bonus,
+        research_hp=bonus
+    )
+
+def measure(fn, min_time, min_iterations):
+    """Call fn repeatedly and return per-call latencies in seconds"""
+    latencies = []
+    start = time.perf_counter()
+    while len(latencies) < min_iterations or time.perf_counter() - start < min_time:
+        t0 = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - t0)
+    return latencies
+
+def summarize(name, size, latencies):
+    latencies_us = np.array(latencies) * 1e6
+    return {
+        "name": name,
+        "size": size,
+        "iterations": len(latencies),
+        "ops_per_sec": round(len(latencies) / sum(latencies), 1),
+        "mean_us": round(float(latencies_us.mean()), 2),
+        "p50_us": round(float(np.percentile(latencies_us, 50)), 2),
+        "p99_us": round(float(np.percentile(latencies_us, 99)), 2)
+    }
+
+def build_cases():
+    """(name, size, callable) for every benchmark"""
+    client = TestClient(server.app)
+    cases = []
+    for size, total in ARMY_SIZES.items():
+        player = make_army(total)
+        enemy = make_army(int(total * 0.9), mix=(0.4, 0.2, 0.3, 0.1), bonus=15.0)
+        request_body = {"player_army": player.model_dump(), "enemy_army": enemy.model_dump(), "scenario": "field_battle"}
+        params = {
+            "total_troops": total,
+            "enemy_infantry": enemy.composition.infantry,
+            "enemy_ranged": enemy.composition.ranged,
+            "enemy_cavalry": enemy.composition.cavalry,
+            "enemy_siege": enemy.composition.siege,
+            "research_attack": 20,
+            "max_ms": 50
+        }
+
+        cases.extend([
+            ("calculate_effective_stats", size, lambda p=player: calculate_effective_stats(
+                p.composition, p.hero, p.research_attack, p.research_defense, p.research_hp)),
+            ("calculate_type_advantage", size, lambda p=player, e=enemy: calculate_type_advantage(
+                p.composition, e.composition)),
+            ("simulate_battle", size, lambda p=player, e=enemy: simulate_battle(p, e)),
+            ("optimize_army_composition", size, lambda q=params: asyncio.run(optimize_army_composition(**q))),
+            ("POST /api/battle/simulate", size, lambda b=request_body: client.post("/api/battle/simulate", json=b))
+        ])
+    return cases
+
+def make_records(count, start):
+    """Stored (compact) battle records one second apart from `start`, as the simulate endpoint writes them"""
+    player = make_army(2_000)
+    enemy = make_army(1_800, mix=(0.4, 0.2, 0.3, 0.1), bonus=15.0)
+    fields = asyncio.run(compute_battle_result(BattleRequest(player_army=player, enemy_army=enemy)))
+    records = []
+    for i in range(count):
+        battle_id = str(uuid.uuid4())
+        records.append(encode_battle({
+            "battle_id": battle_id,
+            "timestamp": start + timedelta(seconds=i),
+            "player_army": player.model_dump(),
+            "enemy_army": enemy.model_dump(),
+            "result": BattleResult(battle_id=battle_id, **fields).model_dump(),
+            "scenario": "siege" if i % 4 == 0 else "field_battle"
+        }))
+    return records
+
+async def open_stores():
+    """Started stores to benchmark: SQLite always, MongoDB if it answers within a few seconds"""
+    stores = [SQLiteBattleStore(os.path.join(tempfile.mkdtemp(), "battles.db"))]
+    mongo = MongoBattleStore(server.MONGO_URL, "lords_mobile_ai_benchmark")
+    mongo.start()
+    for _ in range(30):
+        if mongo.available:
+            break
+        await asyncio.sleep(0.1)
+    if mongo.available:
+        await mongo.database.client.drop_database("lords_mobile_ai_benchmark")
+        stores.append(mongo)
+    else:
+        print(f"MongoDB not reachable at {server.MONGO_URL}; benchmarking the SQLite store only")
+        await mongo.close()
+    for store in stores:
+        store.start()
+    return stores
+
+def build_store_cases(loop):
+    """(name, size, callable) for battle store writes and reads, per backend; all run on `loop`"""
+    stores = loop.run_until_complete(open_stores())
+    start = datetime(2026, 1, 1)
+    prefill = make_records(STORE_PREFILL, start)
+    batches = iter(make_records(STORE_BATCH_SIZE * 1_000, start + timedelta(days=365)))
+    filters = history_filters(scenario="siege", min_win_probability=0.1)
+
+    async def export(store):
+        """First STORE_EXPORT_SIZE battles of an export, as the NDJSON stream would read them"""
+        battles = store.iter_battles(history_filters(since=start), None, STORE_EXPORT_SIZE)
+        count = 0
+        async for _ in battles:
+            count += 1
+            if count == STORE_EXPORT_SIZE:
+                break
+        await battles.aclose()
+
+    cases = []
+    for store in stores:
+        for i in range(0, len(prefill), STORE_BATCH_SIZE):
+            loop.run_until_complete(store.insert_many([dict(r) for r in prefill[i:i + STORE_BATCH_SIZE]]))
+        cases.extend([
+            (f"{store.name} insert_many", str(STORE_BATCH_SIZE), lambda s=store: loop.run_until_complete(
+                s.insert_many([dict(next(batches)) for _ in range(STORE_BATCH_SIZE)]))),
+            (f"{store.name} recent_battles", str(STORE_PAGE_SIZE), lambda s=store: loop.run_until_complete(
+                s.recent_battles(history_filters(), None, None, STORE_PAGE_SIZE))),
+            (f"{store.name} recent_battles filtered", str(STORE_PAGE_SIZE), lambda s=store: loop.run_until_complete(
+                s.recent_battles(filters, None, None, STORE_PAGE_SIZE))),
+            (f"{store.name} iter_battles", str(STORE_EXPORT_SIZE), lambda s=store: loop.run_until_complete(export(s)))
+        ])
+    return cases, stores
+
+def compare(results, baseline, tolerance):
+    """Return (name, size, baseline ops/sec, current ops/sec) for every case slower than the tolerance allows"""
+    previous = {(r["name"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in results:
+        old = previous.get((result["name"], result["size"]))
+        if old and result["ops_per_sec"] < old["ops_per_sec"] * (1 - tolerance):
+            regressions.append((result["name"], result["size"], old["ops_per_sec"], result["ops_per_sec"]))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the battle engine and API hot paths")
+    parser.add_argument("--output", help="write results JSON to this path")
+    parser.add_argument("--baseline", help="compare against a previously written results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed ops/sec drop vs baseline (fraction)")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds to run each case")
+    parser.add_argument("--min-iterations", type=int, default=20, help="minimum calls per case")
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this text")
+    parser.add_argument("--stores", action="store_true", help="also benchmark battle store writes and reads")
+    args = parser.parse_args()
+
+    cases = build_cases()
+    stores = []
+    loop = asyncio.new_event_loop()
+    if args.stores:
+        store_cases, stores = build_store_cases(loop)
+        cases += store_cases
+
+    results = []
+    print(f"{'case':<30} {'size':<7} {'ops/sec':>12} {'p50 us':>10} {'p99 us':>10}")
+    for name, size, fn in cases:
+        if args.filter not in name:
+            continue
+        fn()  # warm up
+        result = summarize(name, size, measure(fn, args.min_time, args.min_iterations))
+        results.append(result)
+        print(f"{name:<30} {size:<7} {result['ops_per_sec']:>12,.1f} {result['p50_us']:>10,.1f} {result['p99_us']:>10,.1f}")
+
+    for store in stores:
+        if store.name == "mongo":
+            loop.run_until_complete(store.database.client.drop_database("lords_mobile_ai_benchmark"))
+        loop.run_until_complete(store.close())
+    loop.close()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "min_time": args.min_time
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for name, size, old, new in regressions:
+                print(f"  {name} [{size}]: {old:,.1f} -> {new:,.1f} ops/sec")
+            return 1
+        print(f"\n✅ No regressions beyond {args.tolerance:.0%} against {args.baseline}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""Replay recorded battle traffic against a local server and measure how it holds up
+
+Request payloads come from stored battles: the newest --sample battles of the configured
+battle store (BATTLE_STORE with MONGO_URL or BATTLE_SQLITE_PATH), or an NDJSON file
+written by /api/battle/export. Each replayed call picks a stored battle and turns it into
+a simulate request with its armies and scenario, an optimize request for its troop total
+against its enemy, or a history read for its scenario; --mix weights the three.
+
+The target is a uvicorn server started here with --workers processes, or any running
+server given with --url. A started server writes to a scratch SQLite store seeded with
+the sampled battles, so replays never add battles to the real one.
+
+Requests arrive at --rate per second with Poisson gaps, with at most --concurrency in
+flight. Latency counts from the scheduled arrival, so time spent waiting for a free slot
+is included. --rate 0 keeps --concurrency requests in flight back to back instead.
+
+    python3 backend_loadtest.py --ndjson battles.ndjson --rate 200 --duration 30
+    python3 backend_loadtest.py --saturate --workers 1 --workers 4 --slo-ms 250
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+sys.path.insert(0, BACKEND_DIR)
+
+import httpx
+import numpy as np
+
+from battle_engine import UNIT_TYPES
+from battle_records import encode_battle, decode_battle
+from battle_store import MongoBattleStore, SQLiteBattleStore, BATTLE_SQLITE_PATH
+
+# Request kinds and the share of traffic each gets by default
+DEFAULT_MIX = "simulate=0.8,optimize=0.05,history=0.15"
+
+# Latency percentiles reported per request kind
+PERCENTILES = (50, 90, 99)
+
+def parse_mix(text):
+    """{"simulate": weight, ...} from "simulate=0.8,optimize=0.05,history=0.15\""""
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        kind = kind.strip()
+        if kind not in ("simulate", "optimize", "history"):
+            raise ValueError(f"Unknown request kind in mix: {kind}")
+        mix[kind] = float(weight)
+    if not mix or sum(mix.values()) <= 0 or min(mix.values()) < 0:
+        raise ValueError("Mix weights must be non-negative and not all zero")
+    return mix
+
+def read_ndjson(path, limit):
+    """Up to `limit` battles from an export file, in the original layout"""
+    battles = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                battle = json.loads(line)
+                battle["timestamp"] = datetime.fromisoformat(battle["timestamp"])
+                battles.append(battle)
+                if len(battles) >= limit:
+                    break
+    return battles
+
+async def read_store(limit):
+    """Newest `limit` battles of the configured battle store, in the original layout"""
+    if os.environ.get('BATTLE_STORE', 'mongo') == "sqlite":
+        store = SQLiteBattleStore(BATTLE_SQLITE_PATH)
+    else:
+        store = MongoBattleStore(os.environ.get('MONGO_URL', 'mongodb://localhost:27017/'), 'lords_mobile_ai')
+    store.start()
+    try:
+        for _ in range(50):
+            if store.available:
+                break
+            await asyncio.sleep(0.1)
+        if not store.available:
+            raise RuntimeError(f"{store.name} battle store is not available; pass --ndjson to replay an export instead")
+        filters = dict.fromkeys(["scenario", "since", "until", "min_win_probability", "max_win_probability"])
+        return [decode_battle(battle) for battle in await store.recent_battles(filters, None, None, limit)]
+    finally:
+        await store.close()
+
+def build_requests(battles, max_ms):
+    """Replayable (method, path, keyword arguments) per request kind"""
+    requests = {"simulate": [], "optimize": [], "history": []}
+    for battle in battles:
+        player = battle.get("player_army")
+        enemy = battle.get("enemy_army")
+        if not player or not enemy:
+            continue
+        scenario = battle.get("scenario") or "field_battle"
+        requests["simulate"].append(("POST", "/api/battle/simulate", {"json": {
+            "player_army": player, "enemy_army": enemy, "scenario": scenario
+        }}))
+        total_troops = sum(player["composition"].values())
+        if total_troops > 0:
+            params = {f"enemy_{unit_type}": enemy["composition"][unit_type] for unit_type in UNIT_TYPES}
+            for prefix, army in (("", player), ("enemy_", enemy)):
+                hero = army.get("hero") or {}
+                for field in ("research_attack", "research_defense", "research_hp"):
+                    params[f"{prefix}{field}"] = army.get(field, 0.0)
+                for field in ("army_attack", "army_defense", "army_hp"):
+                    params[f"{prefix}hero_{field}"] = hero.get(field, 0.0)
+            requests["optimize"].append(("GET", "/api/army/optimize", {"params": {
+                "total_troops": total_troops, "max_ms": max_ms, **params
+            }}))
+        requests["history"].append(("GET", "/api/battle/history", {"params": {"limit": 20, "fields": "summary"}}))
+        requests["history"].append(("GET", "/api/battle/history", {"params": {"limit": 20, "scenario": scenario}}))
+    return requests
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def wait_until_healthy(client, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/api/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Server did not become healthy")
+
+def seed_scratch_store(path, battles):
+    """Scratch SQLite store holding the sampled battles, so history reads have something to return"""
+    async def seed():
+        store = SQLiteBattleStore(path)
+        store.start()
+        # The store refuses a battle_id twice, so a sample repeating one is seeded once
+        records = list({
+            battle["battle_id"]: encode_battle(battle)
+            for battle in battles if "result" in battle and "player_army" in battle
+        }.values())
+        for i in range(0, len(records), 500):
+            await store.insert_many(records[i:i + 500])
+            await store.apply_rollups(records[i:i + 500])
+        await store.close()
+    asyncio.run(seed())
+
+def start_server(workers, port, battles, cache):
+    """uvicorn subprocess serving the app with `workers` processes on a scratch store"""
+    env = dict(os.environ)
+    env["BATTLE_STORE"] = "sqlite"
+    env["BATTLE_SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "battles.db")
+    if not cache:
+        env["BATTLE_CACHE_ENABLED"] = "false"
+    seed_scratch_store(env["BATTLE_SQLITE_PATH"], battles)
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env
+    )
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+class LoadRun:
+    """Outcome of replaying traffic for a while: one (kind, latency, error) sample per request"""
+
+    def __init__(self, offered_rate):
+        self.offered_rate = offered_rate
+        self.samples = []
+        self.errors = {}
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def record(self, kind, latency, error=None):
+        self.samples.append((kind, latency, error))
+        if error:
+            self.errors[error] = self.errors.get(error, 0) + 1
+
+    def summary(self):
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        report = {
+            "offered_rate": self.offered_rate,
+            "elapsed_s": round(elapsed, 2),
+            "requests": len(self.samples),
+            "errors": dict(self.errors),
+            "kinds": {}
+        }
+        for kind in ["all"] + sorted({sample[0] for sample in self.samples}):
+            samples = [s for s in self.samples if kind in ("all", s[0])]
+            latencies_ms = np.array([latency for _, latency, _ in samples]) * 1000
+            failed = sum(1 for _, _, error in samples if error)
+            entry = {
+                "requests": len(samples),
+                "throughput": round((len(samples) - failed) / elapsed, 1) if elapsed > 0 else 0.0,
+                "error_rate": round(failed / len(samples), 4) if samples else 0.0
+            }
+            for p in PERCENTILES:
+                entry[f"p{p}_ms"] = round(float(np.percentile(latencies_ms, p)), 1) if samples else None
+            entry["max_ms"] = round(float(latencies_ms.max()), 1) if samples else None
+            report["kinds"][kind] = entry
+        return report
+
+async def send(client, run, semaphore, kind, request, scheduled):
+    method, path, kwargs = request
+    async with semaphore:
+        try:
+            response = await client.request(method, path, **kwargs)
+            error = f"HTTP {response.status_code}" if response.status_code >= 400 else None
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+    run.record(kind, time.perf_counter() - scheduled, error)
+
+async def replay(client, requests, mix, rate, concurrency, duration, rng):
+    """Replay traffic for `duration` seconds; open loop at `rate`, or closed loop when rate is 0"""
+    kinds = [kind for kind in mix if requests.get(kind)]
+    weights = [mix[kind] for kind in kinds]
+    semaphore = asyncio.Semaphore(concurrency)
+    run = LoadRun(rate or None)
+    deadline = run.started + duration
+
+    def pick():
+        kind = rng.choices(kinds, weights)[0]
+        return kind, rng.choice(requests[kind])
+
+    if rate:
+        tasks = []
+        scheduled = run.started
+        while True:
+            scheduled += rng.expovariate(rate)
+            if scheduled >= deadline:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(client, run, semaphore, *pick(), scheduled)))
+        await asyncio.gather(*tasks)
+    else:
+        async def worker():
+            while time.perf_counter() < deadline:
+                await send(client, run, semaphore, *pick(), time.perf_counter())
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    run.finished = time.perf_counter()
+    return run.summary()
+
+def sustained(report, slo_ms, max_error_rate):
+    """Whether a run kept up with its offered rate within the latency and error budgets"""
+    overall = report["kinds"]["all"]
+    return (
+        overall["throughput"] >= report["offered_rate"] * 0.95
+        and overall["error_rate"] <= max_error_rate
+        and overall["p99_ms"] is not None and overall["p99_ms"] <= slo_ms
+    )
+
+def print_header():
+    print(f"{'target':<12} {'offered/s':>10} {'done/s':>9} {'errors':>7} " + " ".join(f"{f'p{p} ms':>9}" for p in PERCENTILES))
+
+def print_row(target, report):
+    overall = report["kinds"]["all"]
+    offered = f"{report['offered_rate']:,.0f}" if report["offered_rate"] else "closed"
+    print(f"{target:<12} {offered:>10} {overall['throughput']:>9,.1f} {overall['error_rate']:>7.1%} "
+          + " ".join(f"{overall[f'p{p}_ms']:>9,.1f}" for p in PERCENTILES))
+
+async def run_target(base_url, args, requests, mix, rng, target):
+    """Every replay for one server: a single run, or a saturation sweep"""
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        await wait_until_healthy(client, args.startup_timeout)
+        # Warm up worker pools, caches and connections before measuring
+        await replay(client, requests, mix, 0, min(args.concurrency, 4), args.warmup, rng)
+
+        if not args.saturate:
+            report = await replay(client, requests, mix, args.rate, args.concurrency, args.duration, rng)
+            print_row(target, report)
+            return {"target": target, "runs": [report]}
+
+        runs = []
+        best = None
+        rate = args.rate or 50.0
+        while rate <= args.max_rate:
+            report = await replay(client, requests, mix, rate, args.concurrency, args.duration, rng)
+            runs.append(report)
+            print_row(target, report)
+            if not sustained(report, args.slo_ms, args.max_error_rate):
+                break
+            best = rate
+            rate *= args.step
+        peak = max(run["kinds"]["all"]["throughput"] for run in runs)
+        return {"target": target, "runs": runs, "saturation_rate": best, "peak_throughput": peak}
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded battle traffic against a local server")
+    parser.add_argument("--ndjson", help="replay battles from this export file instead of the battle store")
+    parser.add_argument("--sample", type=int, default=1000, help="battles to build request payloads from")
+    parser.add_argument("--url", help="replay against this running server instead of starting one")
+    parser.add_argument("--workers", type=int, action="append",
+                        help="uvicorn worker processes for a started server; repeat to compare several")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="request kind weights")
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="arrivals per second (the first step with --saturate); 0 for closed loop")
+    parser.add_argument("--concurrency", type=int, default=64, help="requests in flight at most")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run (per step with --saturate)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="seconds of unmeasured traffic first")
+    parser.add_argument("--max-ms", type=int, default=50, help="search budget of replayed optimize requests")
+    parser.add_argument("--no-cache", action="store_true", help="start servers with the result cache disabled")
+    parser.add_argument("--saturate", action="store_true",
+                        help="raise the rate step by step until the server stops keeping up")
+    parser.add_argument("--step", type=float, default=1.5, help="rate multiplier between saturation steps")
+    parser.add_argument("--max-rate", type=float, default=20000.0, help="highest rate a saturation sweep tries")
+    parser.add_argument("--slo-ms", type=float, default=500.0, help="p99 latency a sustained step must stay under")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate a sustained step may reach")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--startup-timeout", type=float, default=60.0, help="seconds to wait for a server")
+    parser.add_argument("--seed", type=int, default=None, help="seed for arrivals and request choice")
+    parser.add_argument("--output", help="write the report JSON to this path")
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+        if args.ndjson:
+            battles = read_ndjson(args.ndjson, args.sample)
+        else:
+            battles = asyncio.run(read_store(args.sample))
+    except (OSError, ValueError, RuntimeError) as e:
+        print(f"❌ {e}")
+        return 1
+    requests = build_requests(battles, args.max_ms)
+    if not requests["simulate"]:
+        print("❌ No replayable battles found")
+        return 1
+    print(f"Replaying {len(battles)} recorded battles, mix {mix}\n")
+    rng = random.Random(args.seed)
+
+    results = []
+    print_header()
+    if args.url:
+        results.append(asyncio.run(run_target(args.url, args, requests, mix, rng, "url")))
+    else:
+        for workers in args.workers or [1]:
+            port = free_port()
+            process = start_server(workers, port, battles, not args.no_cache)
+            try:
+                results.append(asyncio.run(run_target(
+                    f"http://127.0.0.1:{port}", args, requests, mix, rng, f"{workers} worker{'s' if workers > 1 else ''}"
+                )))
+            finally:
+                stop_server(process)
+
+    if args.saturate:
+        print()
+        for result in results:
+            rate = f"{result['saturation_rate']:,.0f} req/s" if result["saturation_rate"] else "below the first step"
+            print(f"{result['target']}: sustained up to {rate}, peak {result['peak_throughput']:,.1f} req/s")
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "battles": len(battles),
+            "mix": mix,
+            "concurrency": args.concurrency,
+            "duration": args.duration
+        },
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+import pytest
+from pymongo import ReplaceOne
+
+
+class BulkWriteCollection:
+    """mongomock_motor collection whose bulk_write applies each operation on its own
+
+    mongomock's own bulk_write rejects the operation objects of current pymongo releases.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def bulk_write(self, operations, ordered=True):
+        for operation in operations:
+            if isinstance(operation, ReplaceOne):
+                await self.collection.replace_one(operation._filter, operation._doc, upsert=operation._upsert)
+            else:
+                await self.collection.update_one(operation._filter, operation._doc, upsert=operation._upsert)
+
+
+class MockDatabase:
+    """Database whose collections are BulkWriteCollections over one mongomock_motor client"""
+
+    def __init__(self):
+        from mongomock_motor import AsyncMongoMockClient
+        self.db = AsyncMongoMockClient()["lords_mobile_ai"]
+
+    def __getitem__(self, name):
+        return BulkWriteCollection(self.db[name])
+
+
+@pytest.fixture
+def mongo_db():
+    return MockDatabase()
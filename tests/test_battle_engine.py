@@ -0,0 +1,95 @@
+import json
+import os
+import random
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+import battle_engine
+from battle_engine import UNIT_STATS, UNIT_TYPES, get_unit_tables, simulate_battles, tournament_matrix
+from server import Army, Hero, UnitComposition, armies_to_arrays, simulate_battle
+
+
+def random_army(rnd):
+    """Army with random troops, research and (sometimes) a hero; some unit types left empty"""
+    composition = UnitComposition(**{t: rnd.choice([0, rnd.randint(1, 50000)]) for t in UNIT_TYPES})
+    hero = None
+    if rnd.random() < 0.5:
+        hero = Hero(name="hero", army_attack=rnd.uniform(0, 40), army_defense=rnd.uniform(0, 40), army_hp=rnd.uniform(0, 40))
+    return Army(
+        composition=composition,
+        hero=hero,
+        research_attack=rnd.uniform(0, 60),
+        research_defense=rnd.uniform(0, 60),
+        research_hp=rnd.uniform(0, 60)
+    )
+
+
+def random_armies(seed, n):
+    rnd = random.Random(seed)
+    armies = [random_army(rnd) for _ in range(n)]
+    # Empty armies take the fallback branches (0.5 win probability, 1.0 advantage)
+    armies[0] = Army(composition=UnitComposition())
+    return armies
+
+
+def test_simulate_battles_matches_simulate_battle():
+    player_armies = random_armies(1, 200)
+    enemy_armies = random_armies(2, 200)
+    player_counts, player_bonuses = armies_to_arrays(player_armies)
+    enemy_counts, enemy_bonuses = armies_to_arrays(enemy_armies)
+
+    batch = simulate_battles(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+
+    for i, (player, enemy) in enumerate(zip(player_armies, enemy_armies)):
+        single = simulate_battle(player, enemy)
+        assert batch["win_probability"][i] == single["win_probability"]
+        assert batch["player_power"][i] == single["player_power"]
+        assert batch["enemy_power"][i] == single["enemy_power"]
+        assert batch["type_advantage"][i] == single["type_advantage"]
+        assert batch["player_losses"][i].tolist() == [getattr(single["player_losses"], t) for t in UNIT_TYPES]
+        assert batch["enemy_losses"][i].tolist() == [getattr(single["enemy_losses"], t) for t in UNIT_TYPES]
+
+
+def test_tournament_matrix_matches_simulate_battle():
+    player_armies = random_armies(3, 25)
+    enemy_armies = random_armies(4, 20)
+    player_counts, player_bonuses = armies_to_arrays(player_armies)
+    enemy_counts, enemy_bonuses = armies_to_arrays(enemy_armies)
+
+    matrix = tournament_matrix(player_counts, player_bonuses, enemy_counts, enemy_bonuses)
+    win_probability = np.asarray(matrix["win_probability"])
+    player_losses = np.asarray(matrix["player_losses"])
+    enemy_losses = np.asarray(matrix["enemy_losses"])
+
+    for i, player in enumerate(player_armies):
+        for j, enemy in enumerate(enemy_armies):
+            single = simulate_battle(player, enemy)
+            assert win_probability[i, j] == single["win_probability"]
+            assert player_losses[i, j] == sum(getattr(single["player_losses"], t) for t in UNIT_TYPES)
+            assert enemy_losses[i, j] == sum(getattr(single["enemy_losses"], t) for t in UNIT_TYPES)
+
+
+def test_unit_tables_follow_changes_to_the_stats_file(tmp_path, monkeypatch):
+    # Restored afterwards, so later tests see the built-in stats again
+    for name in ("UNIT_STATS_FILE", "UNIT_STATS_CHECK_MS", "_tables", "_tables_signature"):
+        monkeypatch.setattr(battle_engine, name, getattr(battle_engine, name))
+    path = tmp_path / "unit_stats.json"
+    path.write_text(json.dumps(UNIT_STATS))
+    monkeypatch.setattr(battle_engine, "UNIT_STATS_FILE", str(path))
+    monkeypatch.setattr(battle_engine, "UNIT_STATS_CHECK_MS", 0)
+    original = battle_engine.reload_unit_stats()
+
+    # Another process rewriting the file (e.g. behind a reload it served) is picked up here too
+    stats = json.loads(json.dumps(UNIT_STATS))
+    stats["infantry"]["attack"] = 300
+    path.write_text(json.dumps(stats, indent=1))
+    changed = get_unit_tables()
+    assert changed.key != original.key
+    assert changed.unit_stats["infantry"]["attack"] == 300
+
+    # A broken file keeps the last good stats
+    path.write_text("{")
+    assert get_unit_tables() is changed
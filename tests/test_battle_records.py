@@ -0,0 +1,210 @@
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from battle_records import (
+    BATTLE_SCHEMA_VERSION, CONFIDENCE_LEVELS, RECOMMENDATIONS, BattleMigration, decode_battle, encode_battle,
+    select_fields, stored_fields
+)
+from server import Army, app, generate_recommendation
+
+HERO = {"name": "Elite Archer", "attack_bonus": 5.0, "defense_bonus": 2.5, "hp_bonus": 1.0,
+        "army_attack": 12.0, "army_defense": 8.0, "army_hp": 6.5}
+
+REQUESTS = {
+    "formula": {
+        "player_army": {"composition": {"infantry": 1200, "ranged": 800, "cavalry": 0, "siege": 150}},
+        "enemy_army": {"composition": {"infantry": 900, "ranged": 900, "cavalry": 700}, "research_attack": 10.0}
+    },
+    "hero": {
+        "player_army": {"composition": {"infantry": 500, "cavalry": 2500}, "hero": HERO, "research_hp": 15.0},
+        "enemy_army": {"composition": {"ranged": 3000}, "hero": {**HERO, "name": "Demon Slayer"}},
+        "scenario": "siege"
+    },
+    "lanchester": {
+        "player_army": {"composition": {"infantry": 2000, "ranged": 1000}, "hero": HERO},
+        "enemy_army": {"composition": {"cavalry": 2500, "siege": 100}},
+        "engine": "lanchester"
+    },
+    "monte_carlo": {
+        "player_army": {"composition": {"infantry": 1000, "ranged": 1000}},
+        "enemy_army": {"composition": {"infantry": 1000, "cavalry": 900}},
+        "trials": 200,
+        "seed": 7
+    }
+}
+
+
+def original_record(name):
+    """Battle record in the original nested layout, from a real /api/battle/simulate response"""
+    request = REQUESTS[name]
+    response = TestClient(app).post("/api/battle/simulate", json=request)
+    assert response.status_code == 200
+    result = response.json()
+    return {
+        "battle_id": result["battle_id"],
+        "timestamp": datetime(2026, 10, 1, 12, 30),
+        "player_army": Army(**request["player_army"]).dict(),
+        "enemy_army": Army(**request["enemy_army"]).dict(),
+        "result": result,
+        "scenario": request.get("scenario", "field_battle")
+    }
+
+
+@pytest.fixture(scope="module")
+def records():
+    return {name: original_record(name) for name in REQUESTS}
+
+
+@pytest.mark.parametrize("name", list(REQUESTS))
+def test_encode_decode_round_trip(records, name):
+    record = records[name]
+    encoded = encode_battle(record)
+    assert encoded["schema_version"] == BATTLE_SCHEMA_VERSION
+    # Filtered and sorted fields stay where they were
+    for field in ("battle_id", "timestamp", "scenario"):
+        assert encoded[field] == record[field]
+    assert encoded["result"]["win_probability"] == record["result"]["win_probability"]
+    assert decode_battle(encoded) == record
+
+
+def test_round_trip_keeps_variant_details(records):
+    lanchester = encode_battle(records["lanchester"])["result"]
+    assert "lanchester" in lanchester and "monte_carlo" not in lanchester
+    assert decode_battle({"schema_version": BATTLE_SCHEMA_VERSION, "result": lanchester})["result"]["details"]["engine"] == "lanchester"
+
+    monte_carlo = encode_battle(records["monte_carlo"])
+    assert monte_carlo["result"]["monte_carlo"]["trials"] == 200
+    assert "player_hero" not in monte_carlo
+
+    hero = encode_battle(records["hero"])
+    assert hero["player_hero"][0] == "Elite Archer" and hero["enemy_hero"][0] == "Demon Slayer"
+
+
+def test_unlisted_texts_round_trip(records):
+    record = dict(records["formula"])
+    record["result"] = {**record["result"], "recommendation": "Retreat.", "confidence_level": "Unknown"}
+    encoded = encode_battle(record)
+    assert encoded["result"]["recommendation"] == "Retreat."
+    assert decode_battle(encoded) == record
+
+
+@pytest.mark.parametrize("fields", [
+    ["battle_id", "timestamp"],
+    ["result.win_probability", "scenario"],
+    ["player_army", "result.expected_losses"],
+    ["enemy_army.hero", "result.details", "result.monte_carlo"]
+])
+def test_projected_documents_decode(records, fields):
+    for record in records.values():
+        encoded = encode_battle(record)
+        projected = {key: value for key, value in encoded.items() if key in stored_fields(fields)}
+        assert select_fields(decode_battle(projected), fields) == select_fields(record, fields)
+
+
+def test_original_layout_decodes_unchanged(records):
+    record = records["hero"]
+    assert decode_battle(record) == record
+    assert decode_battle({**record, "schema_version": 1}) == record
+
+
+def test_code_tables_only_grow():
+    # Stored documents hold these indices; changing one would change what old battles decode to
+    assert RECOMMENDATIONS[:9] == (
+        "Strong victory expected! Proceed with confidence.",
+        "Favorable battle. Consider attacking if losses are acceptable.",
+        "Close battle. Consider adjusting army composition for better type advantage.",
+        "Close battle. Consider adding more troops or improving hero/research bonuses.",
+        "High risk of defeat. Your army composition is weak against enemy. Add more cavalry to counter their infantry.",
+        "High risk of defeat. Your army composition is weak against enemy. Add more infantry to counter their ranged.",
+        "High risk of defeat. Your army composition is weak against enemy. Add more ranged to counter their cavalry.",
+        "High risk of defeat. Your army composition is weak against enemy. ",
+        "High risk of defeat. Consider significantly increasing army size or improving bonuses."
+    )
+    assert CONFIDENCE_LEVELS[:3] == ("High", "Medium", "Low")
+    assert len(set(RECOMMENDATIONS)) == len(RECOMMENDATIONS)
+
+
+def test_generated_recommendations_are_listed():
+    armies = [Army(composition={t: 1000}) for t in ("infantry", "ranged", "cavalry", "siege")]
+    for win_probability in (0.1, 0.35, 0.45, 0.55, 0.65, 0.8):
+        for type_advantage in (-0.2, 0.0, 0.2):
+            for player in armies:
+                for enemy in armies:
+                    result = {"win_probability": win_probability, "type_advantage": type_advantage}
+                    assert generate_recommendation(result, player, enemy) in RECOMMENDATIONS
+
+
+def migration_documents(records):
+    """Version 1 documents, one that cannot be converted, and one already converted"""
+    documents = []
+    for i in range(7):
+        record = records[list(REQUESTS)[i % len(REQUESTS)]]
+        battle_id = f"v1-{i}"
+        documents.append({**record, "_id": battle_id, "battle_id": battle_id,
+                          "result": {**record["result"], "battle_id": battle_id}})
+    documents.append({"_id": "broken", "battle_id": "broken", "timestamp": datetime(2026, 10, 1), "result": {}})
+    converted = {"_id": "v2", **encode_battle({**records["hero"], "battle_id": "v2"})}
+    documents.append(converted)
+    return documents, converted
+
+
+async def run_migration(migration, collection):
+    migration.start(collection)
+    await migration._task
+
+
+def test_migration_converts_version_1_documents(mongo_db, records):
+    collection = mongo_db["battles"]
+    documents, converted = migration_documents(records)
+
+    async def scenario():
+        await collection.insert_many(documents)
+        migration = BattleMigration(batch_size=3, pause_ms=0)
+        await run_migration(migration, collection)
+        return migration, await collection.find().to_list(length=None)
+
+    migration, stored = asyncio.run(scenario())
+    assert migration.stats()["migrated"] == 7
+    assert migration.stats()["skipped"] == 1
+    assert migration.stats()["last_error"] is None
+    stored = {document["_id"]: document for document in stored}
+    for document in documents[:7]:
+        assert stored[document["_id"]]["schema_version"] == BATTLE_SCHEMA_VERSION
+        original = {key: value for key, value in document.items() if key != "_id"}
+        assert decode_battle({k: v for k, v in stored[document["_id"]].items() if k != "_id"}) == original
+    assert stored["broken"] == {**documents[7], "schema_version": 1}
+    assert stored["v2"] == converted
+
+
+def test_migration_resumes_after_stop(mongo_db, records):
+    collection = mongo_db["battles"]
+    documents, converted = migration_documents(records)
+
+    async def scenario():
+        await collection.insert_many(documents)
+        # A long pause after the first batch leaves time to stop it there
+        migration = BattleMigration(batch_size=3, pause_ms=10000)
+        migration.start(collection)
+        while migration.migrated == 0:
+            await asyncio.sleep(0.001)
+        await migration.stop()
+        first = migration.stats()
+        resumed = BattleMigration(batch_size=3, pause_ms=0)
+        await run_migration(resumed, collection)
+        return first, resumed.stats(), await collection.find().to_list(length=None)
+
+    first, resumed, stored = asyncio.run(scenario())
+    assert first["migrated"] == 3
+    # Only what the first run left is picked up again
+    assert resumed["migrated"] == 4
+    assert resumed["skipped"] == 1
+    stored = {document["_id"]: document for document in stored}
+    assert all(stored[document["_id"]]["schema_version"] == BATTLE_SCHEMA_VERSION for document in documents[:7])
+    assert stored["v2"] == converted
@@ -0,0 +1,206 @@
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from analytics import ROLLUP_GRANULARITIES
+from battle_engine import UNIT_TYPES
+from battle_records import decode_battle, encode_battle
+from battle_store import MongoBattleStore, SQLiteBattleStore
+from history_query import encode_cursor
+from persistence import BufferedBattleWriter
+
+FILTERS = {"scenario": None, "since": None, "until": None, "min_win_probability": None, "max_win_probability": None}
+
+FILTER_CASES = [
+    {},
+    {"scenario": "siege"},
+    {"since": datetime(2026, 10, 1, 6), "until": datetime(2026, 10, 2, 3)},
+    {"min_win_probability": 0.3, "max_win_probability": 0.6},
+    {"scenario": "field_battle", "since": datetime(2026, 10, 1, 12), "min_win_probability": 0.5}
+]
+
+
+def make_records(n, seed=1):
+    """Stored battle records; timestamps repeat (and are whole milliseconds, as BSON keeps them)"""
+    rnd = random.Random(seed)
+    base = datetime(2026, 10, 1)
+    timestamps = [base + timedelta(minutes=rnd.randint(0, 3000), milliseconds=rnd.choice([0, 250])) for _ in range(n // 4)]
+
+    def army():
+        return {"composition": {t: rnd.randint(0, 1000) for t in UNIT_TYPES}, "hero": None,
+                "research_attack": 1.0, "research_defense": 2.0, "research_hp": 3.0}
+
+    records = []
+    for i in range(n):
+        battle_id = f"{rnd.getrandbits(64):016x}-{i:04d}"
+        records.append(encode_battle({
+            "battle_id": battle_id,
+            "timestamp": rnd.choice(timestamps),
+            "scenario": rnd.choice(["field_battle", "siege"]),
+            "player_army": army(),
+            "enemy_army": army(),
+            "result": {
+                "battle_id": battle_id,
+                "win_probability": round(rnd.random(), 3),
+                "expected_losses": {t: rnd.randint(0, 100) for t in UNIT_TYPES},
+                "enemy_losses": {t: rnd.randint(0, 100) for t in UNIT_TYPES},
+                "recommendation": "Close battle. Consider adding more troops or improving hero/research bonuses.",
+                "confidence_level": "Low",
+                "details": {"player_power": 1.5, "enemy_power": 2.0, "type_advantage": 0.1},
+                "monte_carlo": None
+            }
+        }))
+    return records
+
+
+def expected_ids(records, filters, newest_first=True):
+    """battle_ids the history filters should select, in history (or export) order"""
+    filters = {**FILTERS, **filters}
+    selected = [
+        record for record in records
+        if (not filters["scenario"] or record["scenario"] == filters["scenario"])
+        and (not filters["since"] or record["timestamp"] >= filters["since"])
+        and (not filters["until"] or record["timestamp"] < filters["until"])
+        and (filters["min_win_probability"] is None or record["result"]["win_probability"] >= filters["min_win_probability"])
+        and (filters["max_win_probability"] is None or record["result"]["win_probability"] <= filters["max_win_probability"])
+    ]
+    selected.sort(key=lambda record: (record["timestamp"], record["battle_id"]), reverse=newest_first)
+    return [record["battle_id"] for record in selected]
+
+
+def open_stores(tmp_path, mongo_db):
+    sqlite = SQLiteBattleStore(str(tmp_path / "battles.db"))
+    sqlite.start()
+    mongo = MongoBattleStore("mongodb://localhost:27017/", "lords_mobile_ai")
+    mongo.database.db = mongo_db
+    mongo.database.state = "connected"
+    return sqlite, mongo
+
+
+async def write_all(store, records, batch_size=50):
+    """Store records through the buffered writer, rollups included, as the server does"""
+    writer = BufferedBattleWriter(store, batch_size=batch_size, on_written=store.apply_rollups)
+    for record in records:
+        # Mongo adds _id to the documents it inserts
+        writer.add(dict(record))
+    await writer.flush()
+    return writer
+
+
+async def read_pages(store, filters, limit):
+    """battle_ids of every history page, following the cursors the server hands out"""
+    ids = []
+    cursor = None
+    while True:
+        page = await store.recent_battles({**FILTERS, **filters}, cursor, None, limit)
+        ids += [battle["battle_id"] for battle in page]
+        if len(page) < limit:
+            return ids
+        cursor = encode_cursor(decode_battle(page[-1]))
+
+
+async def read_rollups(store):
+    return {granularity: await store.read_rollups(granularity, limit=100000) for granularity in ROLLUP_GRANULARITIES}
+
+
+def assert_same_rollups(actual, expected):
+    for granularity in ROLLUP_GRANULARITIES:
+        assert len(actual[granularity]) == len(expected[granularity])
+        for a, b in zip(actual[granularity], expected[granularity]):
+            assert a["win_probability_sum"] == pytest.approx(b["win_probability_sum"])
+            assert {**a, "win_probability_sum": 0} == {**b, "win_probability_sum": 0}
+
+
+@pytest.fixture(scope="module")
+def records():
+    return make_records(400)
+
+
+@pytest.fixture
+def stores(tmp_path, mongo_db, records):
+    sqlite, mongo = open_stores(tmp_path, mongo_db)
+
+    async def fill():
+        await write_all(sqlite, records)
+        await write_all(mongo, records)
+
+    asyncio.run(fill())
+    yield sqlite, mongo
+    asyncio.run(sqlite.close())
+
+
+@pytest.mark.parametrize("filters", FILTER_CASES)
+def test_history_filters_select_the_same_battles(stores, records, filters):
+    sqlite, mongo = stores
+
+    async def read(store):
+        return [battle["battle_id"] for battle in await store.recent_battles({**FILTERS, **filters}, None, None, 1000)]
+
+    expected = expected_ids(records, filters)
+    assert expected
+    assert asyncio.run(read(sqlite)) == expected
+    assert asyncio.run(read(mongo)) == expected
+
+
+@pytest.mark.parametrize("filters", FILTER_CASES[:3])
+def test_history_pages_neither_skip_nor_repeat(stores, records, filters):
+    sqlite, mongo = stores
+    expected = expected_ids(records, filters)
+    # Many battles share a timestamp, so page boundaries regularly fall inside a tie
+    assert len({record["timestamp"] for record in records}) < len(records)
+    for store in (sqlite, mongo):
+        for limit in (1, 7, 50):
+            assert asyncio.run(read_pages(store, filters, limit)) == expected
+
+
+@pytest.mark.parametrize("filters", FILTER_CASES[:3])
+def test_export_runs_oldest_first(stores, records, filters):
+    sqlite, mongo = stores
+
+    async def export(store, batch_size):
+        return [battle["battle_id"] async for battle in store.iter_battles({**FILTERS, **filters}, None, batch_size)]
+
+    expected = expected_ids(records, filters, newest_first=False)
+    assert asyncio.run(export(sqlite, 7)) == expected
+    assert asyncio.run(export(sqlite, 1000)) == expected
+    assert asyncio.run(export(mongo, 7)) == expected
+
+
+def test_incremental_rollups_match_rebuild(stores):
+    sqlite, mongo = stores
+    incremental = asyncio.run(read_rollups(sqlite))
+    assert sum(rollup["battles"] for rollup in incremental["day"]) == 400
+    # Both stores fold in the same increments
+    assert_same_rollups(asyncio.run(read_rollups(mongo)), incremental)
+
+    rollups = sum(len(rollups) for rollups in incremental.values())
+    for store in (sqlite, mongo):
+        assert asyncio.run(store.rebuild_rollups()) == rollups
+        assert_same_rollups(asyncio.run(read_rollups(store)), incremental)
+
+
+def test_duplicate_battles_are_stored_and_counted_once(tmp_path, mongo_db, records):
+    sqlite, _ = open_stores(tmp_path, mongo_db)
+
+    async def scenario():
+        first = await write_all(sqlite, records[:250])
+        # 150 of these are already stored
+        again = await write_all(sqlite, records[100:300], batch_size=40)
+        return first.stats(), again.stats(), await read_rollups(sqlite)
+
+    first, again, incremental = asyncio.run(scenario())
+    assert first["written"] == 250
+    assert again["written"] == 50 and again["dropped"] == 150 and again["failed_flushes"] == 0
+    assert len(asyncio.run(sqlite.recent_battles(FILTERS, None, None, 1000))) == 300
+    for granularity in ROLLUP_GRANULARITIES:
+        assert sum(rollup["battles"] for rollup in incremental[granularity]) == 300
+
+    asyncio.run(sqlite.rebuild_rollups())
+    assert_same_rollups(asyncio.run(read_rollups(sqlite)), incremental)
+    asyncio.run(sqlite.close())
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sys
+
+import mongomock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from persistence import BufferedBattleWriter
+
+
+def battle(i):
+    return {"_id": f"battle-{i}", "win_probability": i / 100}
+
+
+class FailingCollection:
+    """Stand-in for a database that is down"""
+
+    def insert_many(self, records, ordered=True):
+        raise ConnectionError("database unavailable")
+
+
+def test_flush_writes_in_batches():
+    collection = mongomock.MongoClient().db.battles
+    batches = []
+
+    async def on_written(records):
+        batches.append([record["_id"] for record in records])
+
+    async def scenario():
+        writer = BufferedBattleWriter(collection, batch_size=10, on_written=on_written)
+        for i in range(25):
+            writer.add(battle(i))
+        await writer.flush()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats == {"buffered": 0, "written": 25, "dropped": 0, "failed_flushes": 0}
+    assert collection.count_documents({}) == 25
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+    assert sum(batches, []) == [f"battle-{i}" for i in range(25)]
+
+
+def test_flush_loop_writes_on_size_and_time():
+    collection = mongomock.MongoClient().db.battles
+
+    async def scenario():
+        writer = BufferedBattleWriter(collection, batch_size=5, flush_ms=200)
+        writer.start()
+        for i in range(5):
+            writer.add(battle(i))
+        # A full batch wakes the loop straight away
+        await asyncio.sleep(0.01)
+        assert collection.count_documents({}) == 5
+        # A partial batch waits for the flush interval
+        writer.add(battle(5))
+        await asyncio.sleep(0.01)
+        assert collection.count_documents({}) == 5
+        await asyncio.sleep(0.4)
+        assert collection.count_documents({}) == 6
+        writer.add(battle(6))
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert collection.count_documents({}) == 7
+
+
+def test_partial_failure_passes_inserted_records_to_on_written():
+    collection = mongomock.MongoClient().db.battles
+    collection.insert_one(battle(1))
+    written = []
+
+    async def on_written(records):
+        written.extend(record["_id"] for record in records)
+
+    async def scenario():
+        writer = BufferedBattleWriter(collection, on_written=on_written)
+        for i in range(4):
+            writer.add(battle(i))
+        await writer.flush()
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    # The duplicate is dropped rather than retried; the rest of the batch is stored
+    assert stats == {"buffered": 0, "written": 3, "dropped": 1, "failed_flushes": 0}
+    assert written == ["battle-0", "battle-2", "battle-3"]
+    assert collection.count_documents({}) == 4
+
+
+def test_failed_flush_keeps_records_for_retry():
+    async def scenario():
+        writer = BufferedBattleWriter(FailingCollection(), batch_size=2, max_buffer=3)
+        for i in range(4):
+            writer.add(battle(i))
+        await writer.flush()
+        return writer
+
+    writer = asyncio.run(scenario())
+    assert writer.stats() == {"buffered": 3, "written": 0, "dropped": 1, "failed_flushes": 1}
+    # The oldest record was dropped when the buffer overflowed; the rest wait in order
+    assert [record["_id"] for record in writer.buffer] == ["battle-1", "battle-2", "battle-3"]
+
+    collection = mongomock.MongoClient().db.battles
+    writer.collection = collection
+    asyncio.run(writer.flush())
+    assert collection.count_documents({}) == 3
+    assert writer.stats()["written"] == 3
+
+
+def test_paused_holds_off_writes_until_exit():
+    collection = mongomock.MongoClient().db.battles
+
+    async def scenario():
+        writer = BufferedBattleWriter(collection, batch_size=2)
+        writer.add(battle(0))
+        async with writer.paused():
+            # Records buffered before the pause are written on entry
+            assert collection.count_documents({}) == 1
+            writer.add(battle(1))
+            writer.add(battle(2))
+            flush = asyncio.create_task(writer.flush())
+            await asyncio.sleep(0.01)
+            assert not flush.done()
+            assert collection.count_documents({}) == 1
+        await flush
+        return writer.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["written"] == 3
+    assert collection.count_documents({}) == 3